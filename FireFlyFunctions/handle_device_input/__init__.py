@@ -5,61 +5,160 @@ a.k.a. Azure Function 2
 ===================
 
 This function triggers when the associated IoT Hub receives new device data. When triggered, the function will obtain the data record and do the following:
-1. Parse it into a GeoJSON-formatted object
+1. Parse it into a GeoJSON-formatted record
 2. Check that GeoJSON record has a 'device_type' property
 3. If parsed record is invalid and does not meet necessary criteria, SKIP and wait for next record
 4. If 'device_type' is a sensor, then insert record into the 'sensors' table in the associated Cosmos DB database
 5. Otherwise, 'device_type' must be actuator, so insert record into the 'actuators' table in the associated Cosmos DB database
 
+Records are stored in the layout described in shared_code.document_layout: partitioned by region and hour under
+`pk`, with an id derived from the event body so that redelivered events are upserted rather than duplicated, and with
+numeric readings flattened into `readings`. Replays of events seen within the last DedupLateness seconds, recognized by
+their device timestamp or their Event Hub sequence number, are dropped before they are written at all (see
+shared_code.dedup).
+
+Events arrive in batches. All valid records of a batch are gathered into one document list per table, which is
+written once per invocation, since each output binding only keeps the last value it was given.
+
+Batches are decoded in line, unless IngestExecutor sets up a pool of IngestWorkers workers. Large batches are then
+decoded on the pool, in chunks merged back in the order of the batch, so every device's events keep their order (see
+shared_code.parallel_ingest). Smaller batches, below a threshold that adapts to the measured cost of the pool, are
+still decoded in line. Deduplication and routing then run over the decoded events in
+order. The chunk latencies, the number of chunks still queued, and how far the newest event of the batch lags behind
+its enqueued time are reported, to show when the function falls behind its Event Hub partition.
+
 Azure Function made by Athreya Murali
 
 Last Modified: 3 May 2021, 8:46 PM EDT
 """
 
 
-import json.decoder
 import os
+import threading
+import time
+from collections import namedtuple
 from typing import List
-import logging
-import geojson
 
 import azure.functions as func
 
-from ..shared_code.shared_utils import meets_device_format, is_device_sensor
-
-
-def main(events: List[func.EventHubEvent], actmsg: func.Out[func.Document], sensmsg: func.Out[func.Document]):
-    for event in events:
-        decoded_message = event.get_body().decode('utf-8')
-
-        # dictionary obtained from message
-        decoded_dict = None
-
-        # logging.info("TEST 1")
-
-        try:
-            decoded_dict = geojson.loads(decoded_message)
-        except json.decoder.JSONDecodeError:
-            continue
-        # logging.info("TEST 2: Successfully converted to dict without error")
-
-        # Ensure that GeoJSON format is met, with requirement that event be from an "actuator", i.e. drone
-        if decoded_dict is None or not meets_device_format(decoded_dict):
-            continue
-        # logging.info("TEST 3: Meets defined GeoJSON format")
-
-        try:
-            is_sensor = is_device_sensor(decoded_dict)
-        except KeyError:
-            # logging.info("INVALID DEVICE TYPE!")
-            continue
-        # logging.info("TEST 4: Is a valid device reading")
-
-        # logging.info('Python EventHub trigger processed an event: %s', decoded_message)
-
-        # Send data to correct database depending on device type
-        if is_sensor:
-            sensmsg.set(func.Document.from_dict(decoded_dict))
-        else:
-            actmsg.set(func.Document.from_dict(decoded_dict))
-        # logging.info("TEST 5: Successfully sent")
+from ..shared_code.dedup import DedupCache, dedup_key, event_time, DUPLICATE, FRESH, LATE
+from ..shared_code.event_decoder import SENSOR, REJECTED
+from ..shared_code.parallel_ingest import ParallelDecoder
+from ..shared_code.telemetry import create_telemetry, Telemetry
+
+# Maximum number of events validated together before the counts of that batch are reported.
+# The trigger's own batch size is set by `eventProcessorOptions.maxBatchSize` in host.json
+MAX_BATCH_SIZE = int(os.getenv('MaxBatchSize', '256'))
+
+# Number of accepted and rejected events in a single batch
+BatchCounts = namedtuple('BatchCounts', ['accepted', 'rejected'])
+
+# Replayed and retransmitted events seen within the last DEDUP_LATENESS seconds of event time are dropped before they
+# are written. At most DEDUP_CAPACITY keys are remembered, across warm invocations. Since the IoT Hub routes every
+# device to the same Event Hub partition, and a partition is processed by a single instance at a time, each device's
+# replays reach the same cache. Invocations for different partitions may run at the same time, so the cache is only
+# used under DEDUP_LOCK
+DEDUP_CAPACITY = int(os.getenv('DedupCapacity', '200000'))
+DEDUP_LATENESS = float(os.getenv('DedupLateness', '600'))
+DEDUP_CACHE = DedupCache(capacity=DEDUP_CAPACITY, lateness=DEDUP_LATENESS)
+DEDUP_LOCK = threading.Lock()
+
+# Events are decoded in line ("inline"), or on a pool of INGEST_WORKERS spawned processes ("process") or threads
+# ("thread"), the number of CPUs by default, in chunks of INGEST_CHUNK_SIZE events, once a batch holds at least
+# INGEST_PARALLEL_THRESHOLD events. The threshold then adapts to the measured cost of the pool, which is created on the
+# first large batch and kept across warm invocations. Decoding holds the GIL, so threads do not speed it up, and
+# processes only pay off with several CPUs: a pool is only used when asked for, once the parallel_ingest benchmark
+# shows a gain on the plan the app runs on. The threshold defaults to `maxBatchSize` in host.json, so that full
+# batches start on the pool
+INGEST_WORKERS = int(os.getenv('IngestWorkers', str(os.cpu_count() or 1)))
+INGEST_CHUNK_SIZE = int(os.getenv('IngestChunkSize', '64'))
+INGEST_PARALLEL_THRESHOLD = int(os.getenv('IngestParallelThreshold', '256'))
+INGEST_EXECUTOR = os.getenv('IngestExecutor', 'inline')
+DECODER = ParallelDecoder(workers=INGEST_WORKERS, chunk_size=INGEST_CHUNK_SIZE, min_parallel=INGEST_PARALLEL_THRESHOLD,
+                          executor=INGEST_EXECUTOR)
+
+
+def process_batches(events: List[func.EventHubEvent], telemetry: Telemetry, max_batch_size: int = MAX_BATCH_SIZE):
+    """
+    Sorts every valid event into sensor and actuator documents, so that each output binding is written only once
+    :param events: events received from the IoT Hub in a single invocation
+    :param telemetry: telemetry of the invocation
+    :param max_batch_size: maximum number of events per reported batch
+    :return: tuple of (sensor documents, actuator documents, list of BatchCounts, one per batch)
+    """
+    sensor_docs, actuator_docs = func.DocumentList(), func.DocumentList()
+    batch_counts = []
+    now = time.time()
+
+    def record_chunk(stats):
+        telemetry.observe('chunk_latency', stats.latency * 1e3)
+        telemetry.observe('queue_depth', stats.queue_depth)
+
+    # Ensure that GeoJSON format is met, with requirement that event be from a "sensor" or an "actuator", i.e. drone,
+    # and lay every record out with its partition key and stable id (see shared_code.document_layout)
+    enqueued = [event.enqueued_time for event in events]
+    enqueued_ts = [ts.timestamp() if ts is not None else None for ts in enqueued]
+    with telemetry.span('decode'):
+        decoded_events, parallel = DECODER.decode([(event.get_body(), ts) for event, ts in zip(events, enqueued_ts)],
+                                        on_chunk=record_chunk)
+    telemetry.count('parallel_batches' if parallel else 'inline_batches')
+    if any(ts is not None for ts in enqueued):
+        telemetry.observe('enqueued_lag', now - max(ts.timestamp() for ts in enqueued if ts is not None))
+
+    with DEDUP_LOCK:
+        DEDUP_CACHE.expire(now)
+        for start in range(0, len(events), max_batch_size):
+            accepted, rejected = 0, 0
+            with telemetry.span('route_batch'):
+                for event, decoded, enqueued_at in zip(events[start:start + max_batch_size],
+                                                       decoded_events[start:start + max_batch_size],
+                                                       enqueued_ts[start:start + max_batch_size]):
+                    if decoded.kind == REJECTED:
+                        telemetry.count('rejected.' + decoded.reason)
+                        rejected += 1
+                        continue
+
+                    # Drop replays. Events too late to be checked, or without a key, are still written, and their
+                    # stable id keeps the write idempotent
+                    record = decoded.record
+                    key = dedup_key(record, event.sequence_number)
+                    default = enqueued_at if enqueued_at is not None else now
+                    outcome = FRESH if key is None else DEDUP_CACHE.check(key, event_time(record, default), now)
+                    if outcome == DUPLICATE:
+                        telemetry.count('rejected.duplicate')
+                        rejected += 1
+                        continue
+                    if outcome == LATE:
+                        telemetry.count('late')
+
+                    # Send the record to the correct database depending on device type
+                    doc = func.Document.from_dict(record)
+                    if decoded.kind == SENSOR:
+                        sensor_docs.append(doc)
+                    else:
+                        actuator_docs.append(doc)
+                    accepted += 1
+            batch_counts.append(BatchCounts(accepted, rejected))
+    return sensor_docs, actuator_docs, batch_counts
+
+
+def main(events: List[func.EventHubEvent], actmsg: func.Out[func.DocumentList], sensmsg: func.Out[func.DocumentList]):
+    # Decode latency, chunk latencies and queue depths, lag behind the Event Hub, and event counts per outcome. Each
+    # invocation records its own, since invocations may run concurrently
+    telemetry = create_telemetry('handle_device_input')
+    sensor_docs, actuator_docs, batch_counts = process_batches(events, telemetry)
+
+    # Each binding accepts a single value per invocation, so every document goes out in one list
+    if sensor_docs:
+        sensmsg.set(sensor_docs)
+    if actuator_docs:
+        actmsg.set(actuator_docs)
+
+    telemetry.count('events', len(events))
+    telemetry.observe('dedup_cache_size', len(DEDUP_CACHE))
+    telemetry.count('sensor_documents', len(sensor_docs))
+    telemetry.count('actuator_documents', len(actuator_docs))
+    for counts in batch_counts:
+        telemetry.observe('batch_accepted', counts.accepted)
+        telemetry.observe('batch_rejected', counts.rejected)
+    telemetry.emit()
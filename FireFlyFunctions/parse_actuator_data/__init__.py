@@ -8,10 +8,28 @@ Query for sensor readings at a regular interval (may change trigger). Use sensor
 estimate where the fire is After parsing sensor data to obtain coordinates of triggered sensors, apply Welzl's
 Algorithm to finding the minimum enclosing circle to estimate the wildfire's outer boundary
 
-After running Welzl's Algorithm, return a fixed number of points on the circumference, spaced at regular intervals.
-These coordinates will form the flight path of the drone, and they will be sent via the Azure IoT Hub direct method
+After running Welzl's Algorithm, return points on the circumference, spaced at regular intervals by the distance a
+drone flies between waypoints (see shared_code.flight_path). These coordinates will form the flight path of the drone,
+split across several drones when it is too long for one, and they will be sent via the Azure IoT Hub direct method
 protocol
 
+Circles are kept across timer ticks (see shared_code.incremental_circle). A tick where no reading entered or left the
+window does nothing, Welzl's Algorithm only runs again for fires whose boundary points changed, and a drone is only
+sent out again once its fire's circle changed beyond CircleTolerance metres
+
+The circles of each fire are recorded on every update (see shared_code.fire_tracking), and the spread they show is
+extrapolated to when the nearest idle drone can reach the fire, so that flight paths follow the predicted perimeter
+rather than the one the readings last showed
+
+With the `DetectionMode` app setting set to "changefeed", readings are no longer polled for. The watch_sensor_changes
+function receives them from the sensors container's change feed and runs the same update right away, debounced by
+ChangeFeedDebounce seconds, while the timer only expires old readings and completes deferred updates. When the app runs
+on several instances, the change feed's leases spread its partitions across them, so each instance is only pushed part
+of the readings. Every ChangeFeedReconcileInterval seconds the timer therefore queries again the readings written since
+its previous query, which brings its window up to date with every partition. Missions are not coordinated across
+instances, so the app should be limited to a single instance, e.g. with WEBSITE_MAX_DYNAMIC_APPLICATION_SCALE_OUT=1,
+to keep instances from sending out missions for the same fire
+
 Azure Function made by Athreya Murali
 Welzl's Algorithm implementation made by Karmela Flynn
 Vincenty Direct Method implementation made by Paul Kennedy and Jim Leven
@@ -19,131 +37,415 @@ Vincenty Direct Method implementation made by Paul Kennedy and Jim Leven
 Last Modified: 3 May 2021, 8:46 PM EDT
 """
 
+import json
 import logging
 import os
+import threading
 from datetime import datetime, timedelta
 
 import azure.functions as func
-import geojson
-from azure.cosmos import CosmosClient
 
 import numpy as np
-from azure.iot.device import IoTHubDeviceClient
-from azure.iot.hub import IoTHubRegistryManager
-from azure.iot.hub.models import CloudToDeviceMethod
-from msrest.exceptions import HttpOperationError
-
-from ..shared_code.shared_utils import dict_to_str
-from ..shared_code.welzl import welzl, NSphere
-from ..shared_code.vincenty import vincentyDirect_kennedy
-
-# Number of desired points on circumference of minimum enclosing circle
-NUM_POINTS = 10
 
-# Number of iterations needed for Welzl's Algorithm, multiplied by the number of points
-ITERATION_FACTOR = 10
+from ..shared_code import connections
+from ..shared_code.clustering import dbscan
+from ..shared_code.detection_rules import load_rule_engine
+from ..shared_code.dispatch import DroneRegistry, Dispatcher
+from ..shared_code.document_layout import parse_regions, partition_keys
+from ..shared_code.fire_tracking import arrival_times, nearest_drones
+from ..shared_code.flight_path import FlightPlanner, encode_waypoints
+from ..shared_code.incremental_circle import match_clusters
+from ..shared_code.projection import LocalPlane
+from ..shared_code.sensor_window import SensorWindow
+from ..shared_code.telemetry import create_telemetry
+
+# Largest distance in metres between neighbouring readings of the same fire, and smallest number of readings within
+# that distance for a reading to be part of a fire. Readings far from any fire are ignored
+CLUSTER_RADIUS = float(os.getenv('ClusterRadius', '1000'))
+CLUSTER_MIN_SIZE = int(os.getenv('ClusterMinSize', '2'))
+
+# A mission is only sent again for a fire once its circle moved or grew by more than this many metres
+CIRCLE_TOLERANCE = float(os.getenv('CircleTolerance', '50'))
 
 # Custom log level used for debug purposes
 LEVEL = 25
 
-CLIENT = None
-DATABASE = None
-CONTAINER = None
+# Seconds between health checks of the Cosmos DB and IoT Hub clients, see shared_code.connections
+HEALTH_CHECK_INTERVAL = float(os.getenv('HealthCheckInterval', '300'))
+LAST_HEALTH_CHECK = None
 
-IOT_REGISTRY_MANAGER = IoTHubRegistryManager(os.getenv('ServiceConnectionString'))
+# Drone that missions are sent to while no drone has reported its position yet
 DEVICE_ID = "MyPythonDevice"
 METHOD_NAME = "DetermineFlightPath"
 
-LOGGER = logging.getLogger('log')
-
+# Drones are available for a mission if they reported being idle within DRONE_STALE_AFTER seconds, and are considered
+# busy for DRONE_BUSY_FOR seconds after a mission is sent, unless they report being idle again
+DRONE_STALE_AFTER = float(os.getenv('DroneStaleAfter', '600'))
+DRONE_BUSY_FOR = float(os.getenv('DroneBusyFor', '1800'))
+
+# Maximum number of direct methods in flight at once, seconds to wait for a drone to connect and respond, and number
+# of drones tried before a mission is given up
+DISPATCH_WORKERS = int(os.getenv('DispatchWorkers', '8'))
+DISPATCH_TIMEOUT = int(os.getenv('DispatchTimeout', '15'))
+DISPATCH_ATTEMPTS = int(os.getenv('DispatchAttempts', '3'))
+
+# Flight paths (see shared_code.flight_path): drone cruise speed in m/s and seconds of flight per sortie, seconds of
+# flight between waypoints, number of inner rings or spiral turns covering each fire ("rings" or "spiral"), and most
+# drones a fire's path is split across when it is longer than one sortie, counting the transit from the nearest idle
+# drone. Whatever MAX_SORTIES sorties cannot cover is left out, and reported as a truncated plan
+DRONE_SPEED = float(os.getenv('DroneSpeed', '10'))
+DRONE_ENDURANCE = float(os.getenv('DroneEndurance', '1200'))
+WAYPOINT_INTERVAL = float(os.getenv('WaypointInterval', '15'))
+COVERAGE_RINGS = int(os.getenv('CoverageRings', '0'))
+COVERAGE_PATTERN = os.getenv('CoveragePattern', 'rings')
+MAX_SORTIES = int(os.getenv('MaxSortiesPerFire', '3'))
+FLIGHT_PLANNER = FlightPlanner(speed=DRONE_SPEED, endurance=DRONE_ENDURANCE, waypoint_interval=WAYPOINT_INTERVAL,
+                               rings=COVERAGE_RINGS, pattern=COVERAGE_PATTERN, max_sorties=MAX_SORTIES)
+
+# Number of past circles of each fire its spread is estimated from, and most seconds a fire's perimeter is predicted
+# ahead of its latest circle. 0 sends drones to the latest circle
+FIRE_HISTORY_SIZE = int(os.getenv('FireHistorySize', '64'))
+MAX_PREDICTION_HORIZON = float(os.getenv('MaxPredictionHorizon', '1800'))
+
+# Waypoints are sent rounded to PATH_PRECISION decimals, either as GeoJSON ("geojson") or delta encoded ("delta")
+PATH_PRECISION = int(os.getenv('PathPrecision', '6'))
+PATH_ENCODING = os.getenv('PathEncoding', 'geojson')
+
+# Positions and status of the drone fleet, kept across warm invocations. The dispatcher is created on the first
+# mission, so that the IoT Hub SDK is not loaded before it is needed
+DRONE_REGISTRY = DroneRegistry(stale_after=DRONE_STALE_AFTER, busy_for=DRONE_BUSY_FOR)
+DISPATCHER = None
 
-def init_connections():
-    global CLIENT
-    global DATABASE
-    global CONTAINER
+LOGGER = logging.getLogger('log')
 
-    global IOT_REGISTRY_MANAGER
+# Per-stage latencies and query, clustering and dispatch metrics, emitted once per invocation
+TELEMETRY = create_telemetry('parse_actuator_data')
+
+# Maximum number of documents per page of query results, which bounds the memory used by a refresh
+PAGE_SIZE = int(os.getenv('QueryPageSize', '100'))
+
+# Geohash cells the sensors are deployed in. When set, queries only target the partitions of these cells for the hours
+# of the window (see shared_code.document_layout), instead of every partition
+SENSOR_REGIONS = parse_regions(os.getenv('SensorRegions', ''))
+
+# Size in decimal degrees of the grid cells readings are aggregated into, 1e-4 being about 11 m (see
+# shared_code.spatial_grid). Circles are solved over the cell centers and inflated to enclose every reading. 0 keeps
+# every distinct coordinate
+GRID_RESOLUTION = float(os.getenv('GridResolution', '0.0001'))
+
+# Only sensor readings within this window are used to estimate the wildfire's boundary
+WINDOW = timedelta(hours=2)
+
+# Coordinates of recent significant readings, kept across warm invocations and only topped up with newer documents.
+# Cosmos DB is queried with a timestamp clause plus the detection rules, which are read from the `DetectionRules` or
+# `DetectionRulesPath` app settings (see shared_code.detection_rules), so the window is created on the first
+# invocation and again whenever the rules change
+# NOTE: This may later be done via a stored proc on the Cosmos DB emulator
+SENSOR_WINDOW = None
+
+# Enclosing circle of each fire, kept across warm invocations and only solved again when its readings change
+TRACKERS = []
+
+# Detection mode. With "timer", every tick queries Cosmos DB for new readings. With "changefeed", new readings are
+# pushed by the watch_sensor_changes function as they are written, and ticks only expire readings that fell out of the
+# window and complete updates the change feed deferred. Updates triggered by the change feed run at most once every
+# CHANGE_FEED_DEBOUNCE seconds, so that a burst of readings leads to a single recomputation and dispatch. Every
+# CHANGE_FEED_RECONCILE_INTERVAL seconds, a tick queries again the readings written since the previous query, from
+# every partition, including those whose change feed is read by another instance
+TIMER = 'timer'
+CHANGE_FEED = 'changefeed'
+DETECTION_MODE = os.getenv('DetectionMode', TIMER)
+CHANGE_FEED_DEBOUNCE = float(os.getenv('ChangeFeedDebounce', '2'))
+CHANGE_FEED_RECONCILE_INTERVAL = float(os.getenv('ChangeFeedReconcileInterval', '60'))
+LAST_UPDATE = None
+LAST_QUERY = None
+
+# Both triggers share the state above and may be invoked concurrently, so only one of them works on it at a time
+DETECTION_LOCK = threading.Lock()
+
+
+def check_connections(now: float):
+    """
+    Checks the shared clients at most once every HEALTH_CHECK_INTERVAL seconds. Clients that fail the check are
+    created again on their next use
+    """
+    global LAST_HEALTH_CHECK
+
+    if LAST_HEALTH_CHECK is not None and now - LAST_HEALTH_CHECK < HEALTH_CHECK_INTERVAL:
+        return
+    LAST_HEALTH_CHECK = now
+    health = connections.check_health()
+    if health:
+        LOGGER.log(LEVEL, "Connection health: {}".format(health))
 
-    CLIENT = CosmosClient.from_connection_string(os.getenv('AzureCosmosDBConnectionString'))
-    database_name = 'sensors'
-    DATABASE = CLIENT.get_database_client(database_name)
-    container_name = 'data'
-    CONTAINER = DATABASE.get_container_client(container_name)
 
+def init_dispatcher():
+    """
+    Creates the dispatcher on the first mission, or again when the registry manager was replaced after failing a
+    health check
+    """
+    global DISPATCHER
 
-def main(mytimer: func.TimerRequest):
-    LOGGER.setLevel(LEVEL)
-    timestamps = []
-    if not (CONTAINER and DATABASE and CLIENT):
-        init_connections()
-
-    # Get current time for timestamp-based query filter
-    current_time = datetime.now()
-    prev_time = current_time - timedelta(hours=2)
-    converted_time = datetime.timestamp(prev_time)
-    LOGGER.log(LEVEL, "Time: {}".format(converted_time))
+    registry_manager = connections.get_registry_manager()
+    if DISPATCHER is None or DISPATCHER.registry_manager is not registry_manager:
+        DISPATCHER = Dispatcher(registry_manager, METHOD_NAME, max_workers=DISPATCH_WORKERS, timeout=DISPATCH_TIMEOUT,
+                                max_attempts=DISPATCH_ATTEMPTS, fallback_device_id=DEVICE_ID)
 
-    timestamps.append(("Initialization", current_time))
 
-    # Query Cosmos DB with timestamp clause
-    # NOTE: This may later be done via a stored proc on the Cosmos DB emulator
-    # TODO: Consider sensor readings as criteria for query, need significant readings
-    query_str = "SELECT * FROM data r WHERE r._ts >= @time AND r.properties.carbon_monoxide.val > 12 AND r.properties.pm2_5.val > 5"
+def init_sensor_window():
+    """
+    Creates the sensor window on the first invocation, or when the detection rules have changed since the last one.
+    A new window starts cold, since its readings were selected with the previous rules
+    """
+    global SENSOR_WINDOW
 
-    query_results = list(CONTAINER.query_items(query=query_str, parameters=[{"name": "@time", "value": converted_time}],
-                                               enable_cross_partition_query=True))
-    LOGGER.log(LEVEL, "LENGTH: {}".format(len(query_results)))
+    rules = load_rule_engine()
+    if SENSOR_WINDOW is None or SENSOR_WINDOW.rules is not rules:
+        partitions = (lambda since, now: partition_keys(SENSOR_REGIONS, since, now)) if SENSOR_REGIONS else None
+        SENSOR_WINDOW = SensorWindow(rules.query(), WINDOW, page_size=PAGE_SIZE, rules=rules, partitions=partitions,
+                                     resolution=GRID_RESOLUTION)
 
-    timestamps.append(("Finished Query", datetime.now()))
 
-    # Create aggregation set for coordinates retrieved from query
-    # A set prevents duplicate coordinates from being stored, which would impede
-    # the performance of Welzl's Algorithm
-    coordinates = set()
-    for doc in query_results:
-        # TODO: Check that `doc` has the below keys before accessing, may cause KeyError otherwise
-        point_list = doc['geometry']['coordinates']
-        point = (point_list[0], point_list[1])
-        coordinates.add(point)
-    timestamps.append(("Finished Query", datetime.now()))
+def main(mytimer: func.TimerRequest):
+    LOGGER.setLevel(LEVEL)
+    with DETECTION_LOCK:
+        try:
+            run(datetime.timestamp(datetime.now()))
+        finally:
+            TELEMETRY.emit()
+
+
+def run(converted_time: float):
+    """
+    Brings the window up to date on a timer tick, then estimates the boundary of every fire from the readings within
+    it, and sends a mission around each fire whose boundary changed since its last mission
+    :param converted_time: current time as a POSIX timestamp
+    """
+    init_sensor_window()
+    LOGGER.log(LEVEL, "Time: {}".format(converted_time))
+    check_connections(converted_time)
+
+    if DETECTION_MODE == CHANGE_FEED and not SENSOR_WINDOW.is_cold:
+        # New readings are pushed by the change feed, so there is nothing to query but the readings of partitions
+        # pushed to other instances
+        if LAST_QUERY is not None and converted_time - LAST_QUERY < CHANGE_FEED_RECONCILE_INTERVAL:
+            SENSOR_WINDOW.evict(converted_time - SENSOR_WINDOW.window_seconds)
+        else:
+            refresh_window(converted_time, reconcile=True)
+    else:
+        refresh_window(converted_time)
+    update(converted_time)
+
+
+def on_sensor_documents(documents: list, converted_time: float):
+    """
+    Adds sensor documents pushed by the change feed to the window, then updates the fires unless an update ran less
+    than CHANGE_FEED_DEBOUNCE seconds ago. Deferred updates are completed by the next batch or timer tick
+    :param documents: sensor documents laid out by shared_code.document_layout
+    :param converted_time: current time as a POSIX timestamp
+    """
+    init_sensor_window()
+    check_connections(converted_time)
+
+    TELEMETRY.count('pushed_documents', len(documents))
+    if SENSOR_WINDOW.is_cold:
+        # The pushed documents are already stored, so the full query covers them
+        refresh_window(converted_time)
+    else:
+        with TELEMETRY.span('push'):
+            SENSOR_WINDOW.push(documents)
+            SENSOR_WINDOW.evict(converted_time - SENSOR_WINDOW.window_seconds)
+
+    if LAST_UPDATE is not None and converted_time - LAST_UPDATE < CHANGE_FEED_DEBOUNCE:
+        TELEMETRY.count('updates_debounced')
+        return
+    update(converted_time)
+
+
+def refresh_window(converted_time: float, reconcile: bool = False):
+    """
+    Fetches only the readings newer than those already in the window, or the whole window on a cold start
+    :param converted_time: current time as a POSIX timestamp
+    :param reconcile: whether to fetch every reading written since the previous query instead, whatever was pushed by
+        the change feed in between. Readings are fetched from one CHANGE_FEED_RECONCILE_INTERVAL before that query, to
+        cover readings stamped by Cosmos DB shortly before it ran
+    """
+    global LAST_QUERY
+
+    def record_page(page_number, num_docs, num_bytes, request_charge):
+        TELEMETRY.count('query_pages')
+        TELEMETRY.count('documents_scanned', num_docs)
+        if num_bytes is not None:
+            TELEMETRY.count('response_bytes', num_bytes)
+        if request_charge is not None:
+            TELEMETRY.count('request_charge', request_charge)
+
+    was_cold = SENSOR_WINDOW.is_cold
+    container = connections.get_container('sensors')
+    with TELEMETRY.span('query'):
+        if reconcile and not was_cold and LAST_QUERY is not None:
+            TELEMETRY.count('reconciles')
+            new_docs = SENSOR_WINDOW.reconcile(container, LAST_QUERY - CHANGE_FEED_RECONCILE_INTERVAL, converted_time,
+                                               on_page=record_page)
+        else:
+            new_docs = SENSOR_WINDOW.refresh(container, converted_time, on_page=record_page)
+    LAST_QUERY = converted_time
+    TELEMETRY.count('new_documents', new_docs)
+    LOGGER.log(LEVEL, "LENGTH: {} new, {} in window (full query: {})".format(new_docs, len(SENSOR_WINDOW), was_cold))
+
+
+def update(converted_time: float):
+    """
+    Estimates the boundary of every fire from the readings within the window, and sends a mission around each fire
+    whose boundary changed since its last mission
+    :param converted_time: current time as a POSIX timestamp
+    """
+    global TRACKERS
+    global LAST_UPDATE
+
+    LAST_UPDATE = converted_time
+
+    # The window keeps a deduplicated set of coordinates, one per grid cell, since duplicates and near-duplicates would
+    # impede the performance of Welzl's Algorithm
+    coordinates = SENSOR_WINDOW.coordinates
+    inserted, expired = SENSOR_WINDOW.take_changes()
+    TELEMETRY.observe('window_points', len(coordinates))
+    LOGGER.log(LEVEL, "{} points in window, {} inserted, {} expired".format(len(coordinates), len(inserted),
+                                                                            len(expired)))
+
+    # Nothing to do when no point entered or left the window, unless a mission still has to be delivered
+    if not (inserted or expired) and not any(t.should_dispatch(CIRCLE_TOLERANCE) for t in TRACKERS):
+        TELEMETRY.count('ticks_unchanged')
+        return
 
     # Check if there are any coordinates from recent sensor readings of significance
     if len(coordinates) < 2:
         LOGGER.log(LEVEL, "Not enough coordinates retrieved to apply Welzl's Algorithm")
+        TRACKERS = []
         return
-    LOGGER.log(LEVEL, "Sensor coordinates retrieved: {}".format(coordinates))
-
-    # Apply Welzl's Algo to parsed coordinates
-    coord_list = list(coordinates)
-    max_iterations = len(coord_list) * ITERATION_FACTOR
-    nsphere: NSphere = welzl(points=coord_list, maxiterations=max_iterations)
-    timestamps.append(("Finished Welzl's Algorithm", datetime.now()))
-
-    # Log coordinates and radius of minimum enclosing circle
-    LOGGER.log(LEVEL, "Center: {}, Radius: {}".format(nsphere.center, nsphere.sqradius))
-
-    # Send out points along circumference of minimum enclosing circle
-    mission_coords = []
-    for bearing in range(0, 360, 360 // NUM_POINTS):
-        lat, lon, _ = vincentyDirect_kennedy(nsphere.center[0], nsphere.center[1], 1000 * (nsphere.sqradius ** 0.5),
-                                             bearing)
-        mission_coords.append((lat, lon))
-        LOGGER.log(LEVEL, "Coordinates on Circumference: ({}, {})".format(lat, lon))
-    timestamps.append(("Finished Vincenty's Direct Method", datetime.now()))
-
-    try:
-        mission_geojson = geojson.MultiPoint(mission_coords)
-        if mission_geojson.is_valid:
-            # Send out coordinates on circumference to IoT Hub drones via direct method via IoTHubRegistryManager
-            device_method = CloudToDeviceMethod(method_name=METHOD_NAME, payload=mission_geojson)
-            response = IOT_REGISTRY_MANAGER.invoke_device_method(DEVICE_ID, device_method)
-            print("Response Payload: {}".format(response.payload))
-    except ValueError:
+
+    if inserted or expired:
+        LOGGER.log(LEVEL, "Sensor coordinates retrieved: {}".format(coordinates))
+
+        # Split the coordinates into separate fires, so that each fire gets its own circle
+        with TELEMETRY.span('clustering'):
+            lon_lat = np.array(coordinates)
+            plane = LocalPlane.around(lon_lat[:, 0], lon_lat[:, 1])
+            labels = dbscan(plane.to_plane(lon_lat[:, 0], lon_lat[:, 1]), CLUSTER_RADIUS, CLUSTER_MIN_SIZE)
+            num_clusters = int(labels.max()) + 1
+            clusters = [[] for _ in range(num_clusters)]
+            for point, label in zip(coordinates, labels.tolist()):
+                if label >= 0:
+                    clusters[label].append(point)
+        TELEMETRY.observe('clusters', num_clusters)
+        LOGGER.log(LEVEL, "Clusters found: {}".format(num_clusters))
+
+        # Carry each fire's circle over from the last tick, and apply Welzl's Algo only where its support changed.
+        # The solver only sees the vertices of each fire's convex hull (see shared_code.convex_hull)
+        with TELEMETRY.span('welzl'):
+            solves_before = {id(tracker): tracker.solves for tracker in TRACKERS}
+            TRACKERS = match_clusters(TRACKERS, clusters, history_size=FIRE_HISTORY_SIZE,
+                                      max_horizon=MAX_PREDICTION_HORIZON)
+        for tracker in TRACKERS:
+            if tracker.solves != solves_before.get(id(tracker)):
+                TELEMETRY.count('welzl_solves')
+                TELEMETRY.observe('welzl_iterations', tracker.iterations)
+                if not tracker.converged:
+                    TELEMETRY.count('welzl_unconverged')
+        if not TRACKERS:
+            LOGGER.log(LEVEL, "No cluster of at least {} coordinates found".format(CLUSTER_MIN_SIZE))
+            return
+        for tracker in TRACKERS:
+            tracker.record(converted_time)
+
+    # Only fires whose circle changed beyond the tolerance since their last mission are sent out again, along with
+    # fires whose mission was only partly delivered
+    pending = [tracker for tracker in TRACKERS if tracker.should_dispatch(CIRCLE_TOLERANCE)]
+    TELEMETRY.count('missions_unchanged', len(TRACKERS) - len(pending))
+    if not pending:
+        LOGGER.log(LEVEL, "No fire changed by more than {} m".format(CIRCLE_TOLERANCE))
         return
-    except HttpOperationError as e:
-        print("No available idle drones for mission!")
-        timestamps.append(("Finished Sending Payload to Drone", datetime.now()))
 
-    for i in range(1, len(timestamps)):
-        curr, prev = timestamps[i], timestamps[i-1]
-        print("\033[92m {}: difference is {} from previous stage {} \033[00m".format(curr[0], curr[1] - prev[1], prev[0]))
+    # Sorties are planned again only where the circle changed since they were planned. The sorties of a partly
+    # delivered mission are kept, so that the drones that accepted theirs are not sent them again
+    DRONE_REGISTRY.refresh(connections.get_container('actuators'), converted_time)
+    replan = [tracker for tracker in pending if tracker.should_plan(CIRCLE_TOLERANCE)]
+    if replan:
+        plan_sorties(replan, converted_time)
+
+    # Send out each sortie not delivered yet to the nearest idle drone via direct method via IoTHubRegistryManager
+    with TELEMETRY.span('dispatch'):
+        init_dispatcher()
+        payloads, sent_for = [], []
+        for tracker in pending:
+            for index, sortie in tracker.undelivered():
+                payload = encode_waypoints(sortie.waypoints, precision=PATH_PRECISION, encoding=PATH_ENCODING)
+                TELEMETRY.observe('payload_bytes', len(json.dumps(payload, separators=(',', ':'))))
+                payloads.append((sortie.target, payload))
+                sent_for.append((tracker, index))
+        if not payloads:
+            LOGGER.warning("No sortie with finite waypoints to send")
+            return
+        results = DISPATCHER.dispatch(payloads, DRONE_REGISTRY, converted_time)
+
+    for result in results:
+        TELEMETRY.observe('dispatch_latency', result.latency * 1e3)
+        TELEMETRY.observe('dispatch_attempts', result.attempts)
+        if result.device_id is None:
+            TELEMETRY.count('missions_undelivered')
+            LOGGER.warning("No available idle drones for mission {}".format(result.mission))
+        else:
+            # A fire counts as covered once every one of its sorties was accepted
+            tracker, index = sent_for[result.mission]
+            tracker.mark_delivered(index)
+            TELEMETRY.count('missions_delivered')
+            LOGGER.log(LEVEL, "Response Payload from {}: {}".format(result.device_id, result.payload))
+
+
+def plan_sorties(trackers: list, converted_time: float):
+    """
+    Plans the sorties over the predicted perimeter of each fire, and records them on its tracker. The drone registry
+    must be up to date
+    :param trackers: IncrementalEnclosingCircles whose sorties are planned again
+    :param converted_time: current time as a POSIX timestamp
+    """
+    # Each fire is targeted where it is predicted to be once the nearest idle drone reaches it. Circles enclose the cell
+    # centers, so they are grown by the half diagonal of a cell to enclose every reading
+    with TELEMETRY.span('prediction'):
+        drones = DRONE_REGISTRY.idle_drones(converted_time)
+        arrivals = arrival_times([tracker.circle for tracker in trackers], drones, DRONE_SPEED)
+        circles = []
+        for tracker, arrival in zip(trackers, arrivals.tolist()):
+            center_lon, center_lat, radius = tracker.predicted_circle(converted_time + arrival)
+            TELEMETRY.observe('arrival_s', arrival)
+            TELEMETRY.observe('predicted_growth_m', radius - tracker.radius)
+            circles.append((center_lon, center_lat, radius + SENSOR_WINDOW.grid.half_diagonal(center_lat)))
+        # Sorties count the transit from the nearest idle drone against the endurance
+        _, nearest = nearest_drones(circles, drones)
+        origins = [(drones[i].lon, drones[i].lat) if i >= 0 else None for i in nearest.tolist()]
+    for tracker in trackers:
+        speed, bearing = tracker.history.spread()
+        LOGGER.log(LEVEL, "Spread: {:.2f} m/s towards {:.0f} deg, growth {:.2f} m/s".format(
+            speed, bearing, tracker.history.velocity()[2]))
+
+    # Log coordinates and radius of minimum enclosing circles
+    for center_lon, center_lat, radius in circles:
+        LOGGER.log(LEVEL, "Center: ({}, {}), Radius: {} m".format(center_lon, center_lat, radius))
+
+    # Plan the sorties over every fire: waypoints along the circumference of its minimum enclosing circle, and over its
+    # inside when coverage rings are configured. A path longer than a drone can fly is split across several drones, and
+    # only partly flown when it needs more than MAX_SORTIES of them
+    with TELEMETRY.span('flight_path'):
+        plans = FLIGHT_PLANNER.plan(circles, origins)
+    for tracker, plan in zip(trackers, plans):
+        TELEMETRY.observe('sorties_per_fire', len(plan.sorties))
+        if plan.truncated:
+            TELEMETRY.count('plans_truncated')
+            LOGGER.warning("Flight path of {:.0f} m needs more than {} sorties of {:.0f} m, only {:.0f} m will be flown"
+                           .format(plan.length, MAX_SORTIES, FLIGHT_PLANNER.sortie_range,
+                                   sum(sortie.length for sortie in plan.sorties)))
+        for sortie in plan.sorties:
+            TELEMETRY.observe('waypoints', len(sortie.waypoints))
+            LOGGER.log(LEVEL, "Sortie of {:.0f} m, {:.0f} m away, over waypoints: {}".format(
+                sortie.length, sortie.transit, sortie.waypoints.tolist()))
+        tracker.set_sorties([sortie for sortie in plan.sorties if np.isfinite(sortie.waypoints).all()])
@@ -0,0 +1,179 @@
+"""
+Spatial Clustering
+
+===================
+
+Splits planar points (in metres, see shared_code.projection) into spatial clusters with DBSCAN, so that separate
+wildfires each get their own enclosing circle instead of one circle spanning the empty ground between them.
+
+Points are bucketed into a grid whose cells are eps / sqrt(2) wide, so that any two points sharing a cell are within
+eps of each other, and every neighbour of a point lies within the 5x5 block of cells around its own. This keeps the
+work linear in the number of points for a fixed density:
+- a cell holding at least `min_samples` points is made of core points without computing any distance
+- cells whose whole 5x5 neighbourhood holds fewer than `min_samples` points are noise without computing any distance
+- distances are only computed between points of neighbouring cells, and two cells already known to be in the same
+  cluster are never compared
+"""
+
+import numpy as np
+
+# Label of points that belong to no cluster
+NOISE = -1
+
+# Offsets of the 5x5 block of cells that may hold neighbours of a point
+_OFFSETS = [(dx, dy) for dx in range(-2, 3) for dy in range(-2, 3)]
+
+# Largest number of point pairs compared at once
+_PAIR_CHUNK = 1 << 18
+
+
+class _Grid:
+    """
+    Points bucketed into square cells, with the points of each cell stored contiguously
+    """
+
+    def __init__(self, points: np.ndarray, side: float):
+        cells = np.floor(points / side).astype(np.int64)
+        cells -= cells.min(axis=0) - 2
+        self.width = int(cells[:, 1].max()) + 3
+        keys = cells[:, 0] * self.width + cells[:, 1]
+
+        self.keys, self.cell_of, self.counts = np.unique(keys, return_inverse=True, return_counts=True)
+        self.cell_of = self.cell_of.ravel()
+        self.order = np.argsort(self.cell_of, kind='stable')
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1]))
+
+        # Index of each of the 25 neighbouring cells of every cell, or -1 where the neighbouring cell is empty
+        self.neighbours = np.full((len(self.keys), len(_OFFSETS)), -1, dtype=np.int64)
+        for i, (dx, dy) in enumerate(_OFFSETS):
+            target = self.keys + dx * self.width + dy
+            idx = np.minimum(np.searchsorted(self.keys, target), len(self.keys) - 1)
+            self.neighbours[:, i] = np.where(self.keys[idx] == target, idx, -1)
+
+    def members(self, cell: int) -> np.ndarray:
+        """
+        Returns the indices of the points in the given cell
+        """
+        return self.order[self.starts[cell]:self.starts[cell] + self.counts[cell]]
+
+    def neighbour_members(self, cell: int) -> np.ndarray:
+        """
+        Returns the indices of the points in the 5x5 block of cells around the given cell
+        """
+        return np.concatenate([self.members(k) for k in self.neighbours[cell] if k >= 0])
+
+
+def _any_within(a: np.ndarray, b: np.ndarray, eps: float) -> bool:
+    """
+    Checks whether any point of `a` is within `eps` of any point of `b`
+    """
+    # Only points near the other set's bounding box can be close to it
+    a = a[np.all((a >= b.min(axis=0) - eps) & (a <= b.max(axis=0) + eps), axis=1)]
+    if len(a) == 0:
+        return False
+    b = b[np.all((b >= a.min(axis=0) - eps) & (b <= a.max(axis=0) + eps), axis=1)]
+    if len(b) == 0:
+        return False
+
+    eps_sq = eps * eps
+    step = max(1, _PAIR_CHUNK // len(b))
+    for start in range(0, len(a), step):
+        offsets = a[start:start + step, None, :] - b[None, :, :]
+        if np.any(np.einsum('ijk,ijk->ij', offsets, offsets) <= eps_sq):
+            return True
+    return False
+
+
+def _find(parent: np.ndarray, i: int) -> int:
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+
+def dbscan(points, eps: float, min_samples: int) -> np.ndarray:
+    """
+    Clusters planar points with DBSCAN
+    :param points: (n, 2) array of points in metres
+    :param eps: largest distance between two neighbouring points, in metres
+    :param min_samples: smallest number of points, including itself, within `eps` of a core point
+    :return: array of cluster labels numbered from 0, with NOISE for points that belong to no cluster
+    """
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    labels = np.full(n, NOISE, dtype=np.int64)
+    if n == 0:
+        return labels
+
+    grid = _Grid(points, eps / np.sqrt(2))
+    eps_sq = eps * eps
+
+    # Find the core points
+    is_core = grid.counts[grid.cell_of] >= min_samples
+    neighbourhood = np.where(grid.neighbours >= 0, grid.counts[grid.neighbours], 0).sum(axis=1)
+    for cell in np.nonzero((grid.counts < min_samples) & (neighbourhood >= min_samples))[0]:
+        members = grid.members(cell)
+        candidates = points[grid.neighbour_members(cell)]
+        offsets = points[members][:, None, :] - candidates[None, :, :]
+        within = np.einsum('ijk,ijk->ij', offsets, offsets) <= eps_sq
+        is_core[members] = within.sum(axis=1) >= min_samples
+
+    # Join neighbouring cells whose core points are within eps of each other
+    core_cells = np.zeros(len(grid.keys), dtype=bool)
+    core_cells[grid.cell_of[is_core]] = True
+    parent = np.arange(len(grid.keys))
+    for cell in np.nonzero(core_cells)[0]:
+        cell_core = None
+        for other in grid.neighbours[cell]:
+            if other <= cell or not core_cells[other]:
+                continue
+            root, other_root = _find(parent, cell), _find(parent, other)
+            if root == other_root:
+                continue
+            if cell_core is None:
+                cell_core = points[grid.members(cell)[is_core[grid.members(cell)]]]
+            other_members = grid.members(other)
+            if _any_within(cell_core, points[other_members[is_core[other_members]]], eps):
+                parent[max(root, other_root)] = min(root, other_root)
+
+    # Label the core points by the root of their cell
+    roots = np.array([_find(parent, cell) for cell in range(len(grid.keys))])
+    core_roots = roots[grid.cell_of[is_core]]
+    _, cluster_ids = np.unique(core_roots, return_inverse=True)
+    labels[is_core] = cluster_ids.ravel()
+
+    # Assign each border point to the cluster of its nearest core point within eps
+    border_cells = np.unique(grid.cell_of[~is_core])
+    for cell in border_cells:
+        members = grid.members(cell)
+        members = members[~is_core[members]]
+        candidates = grid.neighbour_members(cell)
+        candidates = candidates[is_core[candidates]]
+        if len(candidates) == 0:
+            continue
+        offsets = points[members][:, None, :] - points[candidates][None, :, :]
+        sqdists = np.einsum('ijk,ijk->ij', offsets, offsets)
+        nearest = np.argmin(sqdists, axis=1)
+        reached = sqdists[np.arange(len(members)), nearest] <= eps_sq
+        labels[members[reached]] = labels[candidates[nearest[reached]]]
+    return labels
+
+
+if __name__ == '__main__':
+    import time
+
+    rng = np.random.default_rng(0)
+    for count in [1000, 10000, 50000, 200000]:
+        # Three fires a few kilometres apart, plus scattered noise
+        centers = np.array([[0.0, 0.0], [8000.0, 1000.0], [-3000.0, 9000.0]])
+        fires = centers[rng.integers(0, 3, count)] + rng.normal(scale=600.0, size=(count, 2))
+        noise = rng.uniform(-20000, 20000, size=(count // 100, 2))
+        points = np.vstack((fires, noise))
+
+        start = time.perf_counter()
+        labels = dbscan(points, eps=250.0, min_samples=4)
+        elapsed = time.perf_counter() - start
+        print("{:>7} points: {:.3f}s, {} clusters, {} noise points".format(
+            len(points), elapsed, labels.max() + 1, np.sum(labels == NOISE)))
@@ -0,0 +1,133 @@
+"""
+Shared Connections
+
+===================
+
+Cosmos DB and IoT Hub clients shared by the functions of this app. Clients are only created the first time they are
+needed, and are then reused across warm invocations. The Azure SDKs are imported at that point as well, so that
+loading a function does not pay for SDKs it may not use before its first invocation.
+
+`check_health` verifies the clients that were created so far, and drops any client that fails, so that the next call
+creates it again. `register_container` and `register_registry_manager` put local stand-ins in place of the real
+clients, e.g. for offline benchmarks.
+"""
+
+import logging
+import os
+import threading
+
+LOGGER = logging.getLogger('log')
+
+COSMOS_CLIENT = None
+REGISTRY_MANAGER = None
+CONTAINERS = {}
+
+_LOCK = threading.Lock()
+
+
+def get_cosmos_client():
+    """
+    Returns the shared Cosmos DB client, created from the `AzureCosmosDBConnectionString` app setting
+    """
+    global COSMOS_CLIENT
+
+    with _LOCK:
+        if COSMOS_CLIENT is None:
+            from azure.cosmos import CosmosClient
+            COSMOS_CLIENT = CosmosClient.from_connection_string(os.getenv('AzureCosmosDBConnectionString'))
+        return COSMOS_CLIENT
+
+
+def get_container(database_name: str, container_name: str = 'data'):
+    """
+    Returns the shared client of a Cosmos DB container
+    :param database_name: name of the database, e.g. 'sensors' or 'actuators'
+    :param container_name: name of the container within the database
+    """
+    key = (database_name, container_name)
+    container = CONTAINERS.get(key)
+    if container is None:
+        container = get_cosmos_client().get_database_client(database_name).get_container_client(container_name)
+        with _LOCK:
+            container = CONTAINERS.setdefault(key, container)
+    return container
+
+
+def get_registry_manager():
+    """
+    Returns the shared IoT Hub registry manager, created from the `ServiceConnectionString` app setting
+    """
+    global REGISTRY_MANAGER
+
+    with _LOCK:
+        if REGISTRY_MANAGER is None:
+            from azure.iot.hub import IoTHubRegistryManager
+            REGISTRY_MANAGER = IoTHubRegistryManager(os.getenv('ServiceConnectionString'))
+        return REGISTRY_MANAGER
+
+
+def register_container(database_name: str, container_name: str, container):
+    """
+    Uses the given object as the client of a Cosmos DB container
+    """
+    with _LOCK:
+        CONTAINERS[(database_name, container_name)] = container
+
+
+def register_registry_manager(registry_manager):
+    """
+    Uses the given object as the IoT Hub registry manager
+    """
+    global REGISTRY_MANAGER
+
+    with _LOCK:
+        REGISTRY_MANAGER = registry_manager
+
+
+def reset():
+    """
+    Drops every client, so that they are created again on next use
+    """
+    global COSMOS_CLIENT
+    global REGISTRY_MANAGER
+
+    with _LOCK:
+        COSMOS_CLIENT, REGISTRY_MANAGER = None, None
+        CONTAINERS.clear()
+
+
+def check_health() -> dict:
+    """
+    Checks the clients created so far with a cheap request each, and drops those that fail
+    :return: dictionary of client name to whether it is healthy
+    """
+    global COSMOS_CLIENT
+    global REGISTRY_MANAGER
+
+    health = {}
+    for (database_name, container_name), container in list(CONTAINERS.items()):
+        name = "{}/{}".format(database_name, container_name)
+        read = getattr(container, 'read', None)
+        try:
+            if read is not None:
+                read()
+            health[name] = True
+        except Exception as e:
+            LOGGER.warning("Cosmos DB container {} is unhealthy: {}".format(name, e))
+            health[name] = False
+            with _LOCK:
+                CONTAINERS.pop((database_name, container_name), None)
+                COSMOS_CLIENT = None
+
+    if REGISTRY_MANAGER is not None:
+        get_statistics = getattr(REGISTRY_MANAGER, 'get_service_statistics', None)
+        try:
+            if get_statistics is not None:
+                get_statistics()
+            health['iot_hub'] = True
+        except Exception as e:
+            LOGGER.warning("IoT Hub registry manager is unhealthy: {}".format(e))
+            health['iot_hub'] = False
+            with _LOCK:
+                REGISTRY_MANAGER = None
+    return health
@@ -0,0 +1,159 @@
+"""
+Convex Hull
+
+===================
+
+The minimum enclosing circle of a set of points only depends on the vertices of their convex hull, so the points are
+reduced to those vertices before the circle is solved (see shared_code.welzl).
+
+Most points of a dense cluster are discarded first by Akl-Toussaint throttling: the points extreme along the x and y
+axes and both diagonals span an octagon, and every point strictly inside that octagon cannot be a hull vertex. The
+test is a handful of vectorized cross products per point. When many points are left, as in a uniformly dense cluster,
+they are throttled again by a finer polygon of REFINE_DIRECTIONS extreme points. Andrew's monotone chain then finds the
+hull of the remaining points, which lie in a thin band along the polygon's edges.
+
+Degenerate inputs would otherwise reach the chain whole: when the extreme points are collinear, only the points off
+their line and its two ends are kept, and duplicates are dropped before the chain runs.
+"""
+
+import numpy as np
+
+# Points left after throttling by the octagon, above which they are throttled again by a polygon of REFINE_DIRECTIONS
+# extreme points before the monotone chain loops over them
+REFINE_ABOVE = 1024
+REFINE_DIRECTIONS = 64
+
+
+def _cross(o: list, a: list, b: list) -> float:
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def _throttle_collinear(x: np.ndarray, y: np.ndarray, extremes: np.ndarray) -> np.ndarray:
+    """
+    Discards the points lying on the line through collinear extreme points, except for the two at its ends. Points on
+    the line between those two lie on a hull edge at best, so only points off the line and both ends are kept
+    """
+    if len(extremes) == 0:
+        # Every extreme point is the same, and so is every point
+        return np.array([0])
+    a = extremes[0]
+    b = extremes[int(np.argmax(np.sum((extremes - a) ** 2, axis=1)))]
+    dx, dy = b - a
+    # A cross product within rounding of 0 is as good as 0 to the monotone chain
+    spread = np.abs(x - a[0]).max() ** 2 + np.abs(y - a[1]).max() ** 2
+    tolerance = 8 * np.finfo(float).eps * (dx * dx + dy * dy + spread)
+    on_line = np.abs(dx * (y - a[1]) - dy * (x - a[0])) <= tolerance
+    along = dx * (x - a[0]) + dy * (y - a[1])
+    keep = ~on_line
+    keep[int(np.argmin(np.where(on_line, along, np.inf)))] = True
+    keep[int(np.argmax(np.where(on_line, along, -np.inf)))] = True
+    return np.nonzero(keep)[0]
+
+
+def akl_toussaint(points: np.ndarray, directions: int = 8) -> np.ndarray:
+    """
+    Discards the points lying strictly inside the polygon spanned by the extreme points along evenly spaced directions,
+    the octagon of the axes and diagonals by default
+    :param points: (n, 2) array of (x, y) points
+    :param directions: even number of directions
+    :return: sorted indices of the points that may be hull vertices
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) <= directions:
+        return np.arange(len(points))
+
+    # Each projection gives the extreme points of two opposite directions
+    x, y = np.ascontiguousarray(points[:, 0]), np.ascontiguousarray(points[:, 1])
+    angles = np.pi * np.arange(directions // 2) / (directions // 2)
+    lowest, highest = [], []
+    for angle in angles:
+        projection = x if angle == 0 else x * np.cos(angle) + y * np.sin(angle)
+        lowest.append(int(np.argmin(projection)))
+        highest.append(int(np.argmax(projection)))
+    # Extreme points in counterclockwise order, starting from the lowest one along the first direction
+    extremes = lowest + highest
+    polygon = points[[i for k, i in enumerate(extremes) if i != extremes[k - 1]]]
+    following = np.roll(polygon, -1, axis=0)
+    area = np.sum(polygon[:, 0] * following[:, 1] - following[:, 0] * polygon[:, 1]) / 2
+    if len(polygon) < 3 or not area > 0:
+        return _throttle_collinear(x, y, polygon)
+
+    if len(polygon) <= 8:
+        # A point is left of the edge from a to b when dx * y - dy * x > dx * a_y - dy * a_x
+        inside = np.ones(len(points), dtype=bool)
+        side, term = np.empty(len(points)), np.empty(len(points))
+        for a, b in zip(polygon, following):
+            dx, dy = b - a
+            np.multiply(y, dx, out=side)
+            side -= np.multiply(x, dy, out=term)
+            inside &= side > dx * a[1] - dy * a[0]
+        return np.nonzero(~inside)[0]
+
+    # The polygon is convex and contains its vertex centroid, so the ray from the centroid through a point crosses the
+    # single edge whose vertices' angles around the centroid enclose the point's angle. Only that edge is tested
+    center = polygon.mean(axis=0)
+    vertex_angles = np.arctan2(polygon[:, 1] - center[1], polygon[:, 0] - center[0])
+    first = int(np.argmin(vertex_angles))
+    polygon, following = np.roll(polygon, -first, axis=0), np.roll(following, -first, axis=0)
+    vertex_angles = np.roll(vertex_angles, -first)
+
+    edge = np.searchsorted(vertex_angles, np.arctan2(y - center[1], x - center[0]), side='right') - 1
+    a, b = polygon[edge], following[edge]
+    side = (b[:, 0] - a[:, 0]) * (y - a[:, 1]) - (b[:, 1] - a[:, 1]) * (x - a[:, 0])
+    return np.nonzero(~(side > 0))[0]
+
+
+def convex_hull(points: np.ndarray) -> np.ndarray:
+    """
+    Returns the vertices of the convex hull of a set of points, leaving out points on its edges
+    :param points: (n, 2) array of (x, y) points
+    :return: indices of the hull vertices in counterclockwise order, starting from the lowest leftmost point.
+        Duplicates of a vertex are only returned once
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    candidates = akl_toussaint(points)
+    if len(candidates) > REFINE_ABOVE:
+        candidates = candidates[akl_toussaint(points[candidates], REFINE_DIRECTIONS)]
+    # Sorted by x then y, with duplicates left out, which also keeps a heavily duplicated input from reaching the chains
+    candidates = candidates[np.lexsort((points[candidates, 1], points[candidates, 0]))]
+    ordered = points[candidates]
+    distinct = np.ones(len(candidates), dtype=bool)
+    distinct[1:] = np.any(ordered[1:] != ordered[:-1], axis=1)
+    candidates = candidates[distinct]
+    if len(candidates) < 3:
+        return candidates
+
+    # The chains loop in Python, on the few points left by throttling
+    pts = points[candidates].tolist()
+
+    def chain(order) -> list:
+        hull = []
+        for i in order:
+            while len(hull) >= 2 and _cross(pts[hull[-2]], pts[hull[-1]], pts[i]) <= 0:
+                hull.pop()
+            hull.append(i)
+        return hull
+
+    hull = chain(range(len(pts)))[:-1] + chain(range(len(pts) - 1, -1, -1))[:-1]
+    return candidates[hull]
+
+
+if __name__ == '__main__':
+    import time
+
+    rng = np.random.default_rng(0)
+    for shape in ['normal', 'uniform disk']:
+        for count in [10000, 100000, 1000000]:
+            if shape == 'normal':
+                pts = rng.normal(scale=500, size=(count, 2))
+            else:
+                radii, angles = 500 * np.sqrt(rng.uniform(size=count)), rng.uniform(0, 2 * np.pi, count)
+                pts = np.column_stack([radii * np.cos(angles), radii * np.sin(angles)])
+            start = time.perf_counter()
+            survivors = akl_toussaint(pts)
+            throttled = time.perf_counter() - start
+            start = time.perf_counter()
+            hull = convex_hull(pts)
+            elapsed = time.perf_counter() - start
+            print("{:>12} {:>8} points: {} left by the octagon ({:.2f} ms), {} hull vertices ({:.2f} ms)".format(
+                shape, count, len(survivors), throttled * 1e3, len(hull), elapsed * 1e3))
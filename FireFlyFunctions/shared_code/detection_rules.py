@@ -0,0 +1,376 @@
+"""
+Fire Detection Rules
+
+===================
+
+Decides which sensor readings are significant enough to count as a detected wildfire. The rules are loaded from
+configuration instead of being written into the query, so that detection can be tuned without redeploying.
+
+Rules are given as JSON, either inline in the `DetectionRules` app setting or in the file named by the
+`DetectionRulesPath` app setting, which is read again whenever it changes. Rules that cannot be read or are malformed
+are logged once and ignored: the previous rules stay in use, or the default rules if none were loaded yet. For
+example:
+
+    {
+        "thresholds": {
+            "high_co": {"reading": "carbon_monoxide", "op": ">", "value": 12},
+            "high_pm2_5": {"reading": "pm2_5", "op": ">", "value": 5}
+        },
+        "combination": {"all": ["high_co", "high_pm2_5"]},
+        "calibration": {
+            "sensor-17": {"carbon_monoxide": {"scale": 0.95, "offset": -1.5}}
+        },
+        "pushdown": true
+    }
+
+- `thresholds` compare a reading, i.e. `readings.<reading>` of a sensor document (see shared_code.document_layout),
+  against a finite constant
+- `combination` joins thresholds by name with nested "all", "any", "not" and {"at_least": n, "of": [...]} rules.
+  It may also be just "all" or "any" of every threshold, which is the default
+- a threshold on a missing reading is never met, and neither is its negation: "not" only holds for readings that are
+  present. Negations are pushed down to the thresholds when the rules are loaded, e.g. "not" of `co > 12` becomes
+  `co <= 12`, so that a missing reading is false in every comparison, locally as in Cosmos DB, where a comparison with
+  a missing property is undefined and filtered out
+- `calibration` corrects the readings of individual sensors, identified by `properties.device_id`, as
+  `scale * value + offset` before they are compared
+- `pushdown` adds the comparisons that can be checked by Cosmos DB to the query's WHERE clause, so fewer documents are
+  returned. Comparisons on calibrated readings are never pushed down. Readings are always checked again locally
+
+Readings are evaluated with NumPy over a columnar batch, one array per reading, so that evaluating a window with
+hundreds of thousands of readings costs a handful of vectorized operations per rule.
+"""
+
+import json
+import logging
+import math
+import operator
+import os
+import re
+
+import numpy as np
+
+# Rules equivalent to the original hard-coded query
+DEFAULT_RULES = {
+    "thresholds": {
+        "high_co": {"reading": "carbon_monoxide", "op": ">", "value": 12},
+        "high_pm2_5": {"reading": "pm2_5", "op": ">", "value": 5}
+    },
+    "combination": "all",
+    "calibration": {},
+    "pushdown": True
+}
+
+# Field of the projected documents holding the id of the sensor
+SENSOR_ID_FIELD = 'device_id'
+
+_OPERATORS = {
+    '>': (operator.gt, '>'),
+    '>=': (operator.ge, '>='),
+    '<': (operator.lt, '<'),
+    '<=': (operator.le, '<='),
+    '==': (operator.eq, '='),
+    '!=': (operator.ne, '!='),
+}
+
+# Operator of the negation of each comparison, for readings that are present
+_NEGATIONS = {'>': '<=', '>=': '<', '<': '>=', '<=': '>', '==': '!=', '!=': '=='}
+
+# Reading names become part of the query, so only plain identifiers are allowed
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class RuleEngine:
+    """
+    Evaluates threshold, combination and calibration rules over columnar batches of sensor readings
+    """
+
+    def __init__(self, rules: dict):
+        """
+        :param rules: rule configuration, see the module docstring
+        :exception: ValueError if the rules are malformed
+        """
+        if not isinstance(rules, dict):
+            raise ValueError("Rules must be a JSON object")
+        thresholds = rules.get('thresholds') or {}
+        if not thresholds or not isinstance(thresholds, dict):
+            raise ValueError("At least one threshold is required")
+
+        self.thresholds = {}
+        for name, threshold in thresholds.items():
+            if not isinstance(threshold, dict):
+                raise ValueError("Invalid threshold '{}': {}".format(name, threshold))
+            reading, op = threshold.get('reading'), threshold.get('op')
+            if not isinstance(reading, str) or not _IDENTIFIER.match(reading):
+                raise ValueError("Invalid reading name in threshold '{}': {}".format(name, reading))
+            if op not in _OPERATORS:
+                raise ValueError("Invalid operator in threshold '{}': {}".format(name, op))
+            # The value is written into the query, where only a finite number is valid
+            try:
+                value = float(threshold.get('value'))
+            except (TypeError, ValueError):
+                value = math.nan
+            if not math.isfinite(value):
+                raise ValueError("Invalid value in threshold '{}': {}".format(name, threshold.get('value')))
+            self.thresholds[name] = (reading, op, value)
+
+        self.readings = sorted({reading for reading, _, _ in self.thresholds.values()})
+        self.combination = self._normalize(rules.get('combination', 'all'))
+
+        # Per-sensor calibration, as {sensor id: {reading: (scale, offset)}}
+        self.calibration = {}
+        for sensor_id, corrections in (rules.get('calibration') or {}).items():
+            self.calibration[str(sensor_id)] = {
+                reading: (float(c.get('scale', 1.0)), float(c.get('offset', 0.0)))
+                for reading, c in corrections.items()
+            }
+        self.calibrated_readings = {reading for corrections in self.calibration.values() for reading in corrections}
+
+        self.pushdown = bool(rules.get('pushdown', True))
+
+    def _normalize(self, node):
+        """
+        Validates a combination rule, expanding the "all" and "any" shorthands and pushing negations down to the
+        thresholds, where they are kept as {"not": name}
+        """
+        if node in ('all', 'any'):
+            return {node: list(self.thresholds)}
+        if isinstance(node, str):
+            if node not in self.thresholds:
+                raise ValueError("Unknown threshold in combination: {}".format(node))
+            return node
+        if isinstance(node, dict) and set(node) in ({'all'}, {'any'}):
+            key = 'all' if 'all' in node else 'any'
+            return {key: [self._normalize(child) for child in node[key]]}
+        if isinstance(node, dict) and set(node) == {'not'}:
+            return self._negate(self._normalize(node['not']))
+        if isinstance(node, dict) and set(node) == {'at_least', 'of'}:
+            return {'at_least': int(node['at_least']), 'of': [self._normalize(child) for child in node['of']]}
+        raise ValueError("Invalid combination rule: {}".format(node))
+
+    def _negate(self, node):
+        """
+        Negates a normalized combination rule
+        """
+        if isinstance(node, str):
+            return {'not': node}
+        if 'not' in node:
+            return node['not']
+        if 'all' in node:
+            return {'any': [self._negate(child) for child in node['all']]}
+        if 'any' in node:
+            return {'all': [self._negate(child) for child in node['any']]}
+        # Fewer than n of the rules hold when more than len - n of their negations do
+        return {'at_least': len(node['of']) - node['at_least'] + 1,
+                'of': [self._negate(child) for child in node['of']]}
+
+    def query(self, time_clause: str = "r._ts >= @time") -> str:
+        """
+        Builds the sensor query, projecting only the fields needed to evaluate the rules
+        :param time_clause: condition restricting the query to the sliding window
+        :return: Cosmos DB SQL query string
+        """
+        fields = ["r.id", "r._ts", "r.geometry.coordinates"]
+        fields += ["r.readings.{0} AS {0}".format(reading) for reading in self.readings]
+        if self.calibration:
+            fields.append("r.properties.{0} AS {0}".format(SENSOR_ID_FIELD))
+
+        conditions = [time_clause]
+        if self.pushdown:
+            pushed, _ = self._to_sql(self.combination)
+            if pushed:
+                conditions.append(pushed)
+        return "SELECT {} FROM data r WHERE {}".format(", ".join(fields), " AND ".join(conditions))
+
+    def project(self, document: dict) -> dict:
+        """
+        Projects a full sensor document, e.g. one pushed by the change feed, onto the fields selected by `query`
+        :param document: sensor document laid out by shared_code.document_layout
+        :return: projected document
+        """
+        geometry, readings = document.get('geometry') or {}, document.get('readings') or {}
+        projected = {'id': document.get('id'), '_ts': document.get('_ts'), 'coordinates': geometry.get('coordinates')}
+        for reading in self.readings:
+            if reading in readings:
+                projected[reading] = readings[reading]
+        if self.calibration:
+            projected[SENSOR_ID_FIELD] = (document.get('properties') or {}).get(SENSOR_ID_FIELD)
+        return projected
+
+    def _to_sql(self, node):
+        """
+        Translates a combination rule into a SQL condition
+        :return: tuple of (condition or None, whether the condition is exactly equivalent to the rule). A condition
+            that is not exact is always weaker than the rule, so it never filters out a qualifying reading. Rules are
+            free of negations above the thresholds, so a missing reading, undefined in Cosmos DB, never makes a
+            condition true where the rule is false
+        """
+        if isinstance(node, str) or 'not' in node:
+            name = node if isinstance(node, str) else node['not']
+            reading, op, value = self.thresholds[name]
+            if reading in self.calibrated_readings:
+                return None, False
+            op = op if isinstance(node, str) else _NEGATIONS[op]
+            return "r.readings.{} {} {!r}".format(reading, _OPERATORS[op][1], value), True
+        if 'all' in node:
+            parts = [self._to_sql(child) for child in node['all']]
+            conditions = [condition for condition, _ in parts if condition]
+            exact = all(exact for _, exact in parts)
+            if not conditions:
+                return None, False
+            return "({})".format(" AND ".join(conditions)), exact
+        if 'any' in node:
+            parts = [self._to_sql(child) for child in node['any']]
+            if not parts or any(condition is None for condition, _ in parts):
+                return None, False
+            return "({})".format(" OR ".join(condition for condition, _ in parts)), all(e for _, e in parts)
+        return None, False
+
+    def columns(self, documents: list) -> tuple:
+        """
+        Converts projected sensor documents into a columnar batch
+        :param documents: documents returned by the query built by `query`
+        :return: tuple of ({reading: float array, NaN where missing}, array of sensor ids)
+        """
+        columns = {}
+        for reading in self.readings:
+            values = [doc.get(reading) for doc in documents]
+            columns[reading] = np.array([v if isinstance(v, (int, float)) else np.nan for v in values], dtype=float)
+        sensor_ids = np.array([str(doc.get(SENSOR_ID_FIELD, '')) for doc in documents], dtype=object)
+        return columns, sensor_ids
+
+    def calibrate(self, columns: dict, sensor_ids: np.ndarray) -> dict:
+        """
+        Applies the per-sensor calibration to a columnar batch
+        :return: dictionary of calibrated reading arrays
+        """
+        if not self.calibration or len(sensor_ids) == 0:
+            return columns
+
+        # Index of each reading's sensor among the calibrated sensors, where 0 stands for an uncalibrated sensor
+        sensor_index = {sensor_id: i + 1 for i, sensor_id in enumerate(self.calibration)}
+        index = np.fromiter((sensor_index.get(sensor_id, 0) for sensor_id in sensor_ids), dtype=int,
+                            count=len(sensor_ids))
+
+        calibrated = dict(columns)
+        for reading in self.calibrated_readings.intersection(columns):
+            scale, offset = np.ones(len(sensor_index) + 1), np.zeros(len(sensor_index) + 1)
+            for sensor_id, i in sensor_index.items():
+                scale[i], offset[i] = self.calibration[sensor_id].get(reading, (1.0, 0.0))
+            calibrated[reading] = columns[reading] * scale[index] + offset[index]
+        return calibrated
+
+    def evaluate(self, columns: dict, sensor_ids: np.ndarray = None) -> np.ndarray:
+        """
+        Evaluates the rules over a columnar batch of readings
+        :param columns: dictionary of reading name to float array, with NaN for missing readings
+        :param sensor_ids: array of sensor ids, required when calibration rules are configured
+        :return: boolean array, True where the reading indicates a fire
+        """
+        size = len(next(iter(columns.values()))) if columns else 0
+        if self.calibration and sensor_ids is not None:
+            columns = self.calibrate(columns, sensor_ids)
+
+        # Outcome of each threshold, along with where its reading is present. Missing readings are NaN, which fails
+        # every comparison but "!=", so that one is masked explicitly
+        results = {}
+        for name, (reading, op, value) in self.thresholds.items():
+            values = columns.get(reading)
+            if values is None:
+                results[name] = np.zeros(size, dtype=bool), np.zeros(size, dtype=bool)
+            else:
+                present = ~np.isnan(values)
+                with np.errstate(invalid='ignore'):
+                    results[name] = _OPERATORS[op][0](values, value) & present, present
+        return self._combine(self.combination, results, size)
+
+    def _combine(self, node, results: dict, size: int) -> np.ndarray:
+        if isinstance(node, str):
+            return results[node][0]
+        if 'not' in node:
+            passed, present = results[node['not']]
+            return present & ~passed
+        if 'all' in node:
+            combined = np.ones(size, dtype=bool)
+            for child in node['all']:
+                combined &= self._combine(child, results, size)
+            return combined
+        if 'any' in node:
+            combined = np.zeros(size, dtype=bool)
+            for child in node['any']:
+                combined |= self._combine(child, results, size)
+            return combined
+        counts = np.zeros(size, dtype=int)
+        for child in node['of']:
+            counts += self._combine(child, results, size)
+        return counts >= node['at_least']
+
+    def evaluate_documents(self, documents: list) -> np.ndarray:
+        """
+        Evaluates the rules over a list of projected sensor documents
+        :return: boolean array, True where the document indicates a fire
+        """
+        columns, sensor_ids = self.columns(documents)
+        return self.evaluate(columns, sensor_ids)
+
+
+LOGGER = logging.getLogger('log')
+
+# Last loaded rules, along with the configuration they were loaded from
+RULE_ENGINE = None
+RULES_SOURCE = None
+
+
+def load_rule_engine() -> RuleEngine:
+    """
+    Loads the detection rules from the app settings, reusing the previous RuleEngine if the configuration has not
+    changed. Falls back to DEFAULT_RULES when no rules are configured. Rules that cannot be read or are malformed are
+    logged, once per configuration, and the previous RuleEngine is kept, or DEFAULT_RULES are used if there is none
+    :return: RuleEngine for the current configuration
+    """
+    global RULE_ENGINE
+    global RULES_SOURCE
+
+    path = os.getenv('DetectionRulesPath')
+    if path:
+        source = ('file', path, os.path.getmtime(path) if os.path.exists(path) else None)
+    else:
+        source = ('setting', os.getenv('DetectionRules'))
+
+    if RULE_ENGINE is None or RULES_SOURCE != source:
+        try:
+            if path:
+                with open(path) as f:
+                    rules = json.load(f)
+            elif source[1]:
+                rules = json.loads(source[1])
+            else:
+                rules = DEFAULT_RULES
+            engine = RuleEngine(rules)
+        except (OSError, TypeError, ValueError) as e:
+            LOGGER.error("Invalid detection rules from {}, keeping the {} rules: {}".format(
+                path or 'DetectionRules', 'previous' if RULE_ENGINE is not None else 'default', e))
+            engine = RULE_ENGINE if RULE_ENGINE is not None else RuleEngine(DEFAULT_RULES)
+        RULE_ENGINE, RULES_SOURCE = engine, source
+    return RULE_ENGINE
+
+
+if __name__ == '__main__':
+    import time
+
+    engine = RuleEngine(DEFAULT_RULES)
+    print(engine.query())
+    for count in [10000, 100000, 1000000]:
+        rng = np.random.default_rng(0)
+        batch = {'carbon_monoxide': rng.uniform(0, 30, count), 'pm2_5': rng.uniform(0, 20, count)}
+        ids = np.array(["sensor-{}".format(i) for i in rng.integers(0, 5000, count)], dtype=object)
+        calibrated = RuleEngine(dict(DEFAULT_RULES, calibration={"sensor-{}".format(i): {
+            "carbon_monoxide": {"scale": 1.1, "offset": -1.0}} for i in range(0, 5000, 7)}))
+
+        start = time.perf_counter()
+        flagged = engine.evaluate(batch, ids)
+        plain = time.perf_counter() - start
+        start = time.perf_counter()
+        flagged_calibrated = calibrated.evaluate(batch, ids)
+        with_calibration = time.perf_counter() - start
+        print("{:>8} readings: {:.4f}s ({} flagged), with calibration {:.4f}s ({} flagged)".format(
+            count, plain, flagged.sum(), with_calibration, flagged_calibrated.sum()))
@@ -0,0 +1,264 @@
+"""
+Mission Dispatch
+
+===================
+
+Keeps track of the drone fleet and sends each mission to the nearest idle drone.
+
+DroneRegistry holds the last known position and status of every drone, built from the actuator documents written by
+handle_device_input. Like the sensor window, it is kept at module level and only fetches documents newer than the
+ones it has already seen. A drone is idle when its last reported `status` is "idle" (or missing), it reported within
+the staleness limit, and no mission was sent to it since.
+
+Dispatcher assigns missions to the nearest idle drones, computing every mission-to-drone distance in one vectorized
+pass, and invokes the direct methods concurrently on a bounded thread pool. When a drone fails to answer in time or
+refuses the mission, the mission moves on to the next nearest unclaimed drone. Only the IoT Hub client's transport and
+HTTP errors count as a failed delivery: any other exception is a bug or a misconfiguration, such as a missing SDK, and
+is raised rather than reported as every drone refusing. The registry manager is only used through
+`invoke_device_method`, so a local stand-in can take its place, along with its own method class and errors.
+"""
+
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .vincenty import vincenty_inverse_batch
+
+LOGGER = logging.getLogger('log')
+
+# Last known state of a drone
+Drone = namedtuple('Drone', ['device_id', 'lon', 'lat', 'status', 'ts'])
+
+# Outcome of dispatching a single mission. `device_id` is None if no drone accepted it
+DispatchResult = namedtuple('DispatchResult', ['mission', 'device_id', 'attempts', 'latency', 'payload'])
+
+ACTUATOR_QUERY = "SELECT r.id, r._ts, r.geometry.coordinates, r.properties.device_id AS device_id, " \
+                 "r.properties.status AS status FROM data r WHERE r._ts >= @time"
+
+IDLE = 'idle'
+
+
+class DroneRegistry:
+    """
+    Last known position and status of every drone
+    """
+
+    def __init__(self, stale_after: float = 600.0, busy_for: float = 1800.0):
+        """
+        :param stale_after: seconds after which a drone that has not reported is no longer considered available
+        :param busy_for: seconds a drone is considered busy after a mission was sent to it, unless it reports being
+            idle again before then
+        """
+        self.stale_after = stale_after
+        self.busy_for = busy_for
+        self.drones = {}
+        self.high_water_mark = None
+        self._busy_until = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.drones)
+
+    def refresh(self, container, now: float) -> int:
+        """
+        Fetches the actuator documents written since the last refresh
+        :param container: actuators container client, or any object with a matching `query_items` method
+        :param now: current time as a POSIX timestamp
+        :return: number of documents retrieved
+        """
+        since = now - self.stale_after if self.high_water_mark is None else self.high_water_mark
+        results = container.query_items(query=ACTUATOR_QUERY, parameters=[{"name": "@time", "value": since}],
+                                        enable_cross_partition_query=True)
+        return self.add_documents(results)
+
+    def add_documents(self, documents) -> int:
+        """
+        Updates the registry from actuator documents, keeping the latest report of each drone
+        :param documents: iterable of documents with `_ts`, `coordinates`, `device_id` and optionally `status` keys
+        :return: number of documents read
+        """
+        count = 0
+        for doc in documents:
+            count += 1
+            try:
+                device_id, ts, point_list = doc['device_id'], doc['_ts'], doc['coordinates']
+            except (KeyError, TypeError):
+                continue
+            if device_id is None:
+                continue
+            if self.high_water_mark is None or ts > self.high_water_mark:
+                self.high_water_mark = ts
+            current = self.drones.get(device_id)
+            if current is None or ts >= current.ts:
+                status = doc.get('status') or IDLE
+                self.drones[device_id] = Drone(device_id, point_list[0], point_list[1], status, ts)
+                # A drone reporting idle after its mission was sent has finished it
+                with self._lock:
+                    if status == IDLE and self._busy_until.get(device_id, (0, 0))[1] < ts:
+                        self._busy_until.pop(device_id, None)
+        return count
+
+    def idle_drones(self, now: float) -> list:
+        """
+        Returns the drones that are currently available for a mission
+        """
+        with self._lock:
+            return [drone for drone in self.drones.values()
+                    if drone.status == IDLE and now - drone.ts <= self.stale_after
+                    and self._busy_until.get(drone.device_id, (0, 0))[0] <= now]
+
+    def mark_busy(self, device_id, now: float):
+        """
+        Records that a mission was sent to the given drone
+        """
+        with self._lock:
+            self._busy_until[device_id] = (now + self.busy_for, now)
+
+
+class Dispatcher:
+    """
+    Assigns missions to the nearest idle drones and sends them concurrently
+    """
+
+    def __init__(self, registry_manager, method_name: str, max_workers: int = 8, timeout: int = 15,
+                 max_attempts: int = 3, fallback_device_id: str = None, method_class=None, errors: tuple = None):
+        """
+        :param registry_manager: IoTHubRegistryManager, or any object with a matching `invoke_device_method`
+        :param method_name: name of the direct method invoked on the drones
+        :param max_workers: maximum number of direct methods in flight at once
+        :param timeout: seconds to wait for a drone to connect and to respond, each
+        :param max_attempts: maximum number of drones tried for a single mission
+        :param fallback_device_id: drone to send missions to while no drone has reported to the registry yet
+        :param method_class: class of the direct method requests, the IoT Hub SDK's CloudToDeviceMethod by default
+        :param errors: exception classes raised when a direct method could not be delivered, the IoT Hub client's
+            transport and HTTP errors by default
+        """
+        self.registry_manager = registry_manager
+        self.method_name = method_name
+        self.fallback_device_id = fallback_device_id
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.method_class = method_class
+        self.errors = errors
+        self._claimed = set()
+        self._lock = threading.Lock()
+
+    def candidates(self, targets: list, drones: list) -> list:
+        """
+        Orders the drones for each mission. Each mission first gets a distinct drone, picked greedily by shortest
+        distance over all pairs, followed by every other drone from nearest to furthest
+        :param targets: list of (lon, lat) mission locations
+        :param drones: list of available Drones
+        :return: list with, for each mission, the list of indices into `drones` to try in order
+        """
+        if not targets or not drones:
+            return [[] for _ in targets]
+        target_lon_lat, drone_lon_lat = np.array(targets, dtype=float), np.array([(d.lon, d.lat) for d in drones])
+        distances, _, _ = vincenty_inverse_batch(target_lon_lat[:, 1, None], target_lon_lat[:, 0, None],
+                                                 drone_lon_lat[None, :, 1], drone_lon_lat[None, :, 0])
+        distances = np.where(np.isnan(distances), np.inf, distances)
+
+        first_choice, taken = {}, set()
+        for flat in np.argsort(distances, axis=None):
+            mission, drone = divmod(int(flat), len(drones))
+            if mission in first_choice or drone in taken:
+                continue
+            first_choice[mission] = drone
+            taken.add(drone)
+            if len(first_choice) == len(targets) or len(taken) == len(drones):
+                break
+
+        ordered = []
+        for mission in range(len(targets)):
+            nearest = [int(d) for d in np.argsort(distances[mission]) if d != first_choice.get(mission)]
+            ordered.append(([first_choice[mission]] if mission in first_choice else []) + nearest)
+        return ordered
+
+    def _claim(self, device_id) -> bool:
+        with self._lock:
+            if device_id in self._claimed:
+                return False
+            self._claimed.add(device_id)
+            return True
+
+    def _release(self, device_id):
+        with self._lock:
+            self._claimed.discard(device_id)
+
+    def _load_sdk(self):
+        """
+        Imports the IoT Hub SDK classes that were not given, on the first mission
+        """
+        if self.method_class is None:
+            from azure.iot.hub.models import CloudToDeviceMethod
+            self.method_class = CloudToDeviceMethod
+        if self.errors is None:
+            from msrest.exceptions import ClientException
+            # Covers both the HTTP errors returned by the IoT Hub and the connection errors and timeouts on the way
+            self.errors = (ClientException,)
+
+    def _make_method(self, payload):
+        return self.method_class(method_name=self.method_name, payload=payload,
+                                 response_timeout_in_seconds=self.timeout, connect_timeout_in_seconds=self.timeout)
+
+    def _send(self, mission: int, payload, device_ids: list) -> DispatchResult:
+        """
+        Tries the candidate drones in order until one accepts the mission
+        """
+        start = time.monotonic()
+        attempts = 0
+        method = self._make_method(payload)
+        for device_id in device_ids:
+            if attempts >= self.max_attempts:
+                break
+            if not self._claim(device_id):
+                continue
+            attempts += 1
+            try:
+                response = self.registry_manager.invoke_device_method(device_id, method)
+            except self.errors as e:
+                LOGGER.warning("Drone {} did not accept mission {}: {}".format(device_id, mission, e))
+                self._release(device_id)
+                continue
+            status = getattr(response, 'status', 200)
+            if status is not None and not 200 <= status < 300:
+                LOGGER.warning("Drone {} refused mission {} with status {}".format(device_id, mission, status))
+                self._release(device_id)
+                continue
+            return DispatchResult(mission, device_id, attempts, time.monotonic() - start,
+                                  getattr(response, 'payload', None))
+        return DispatchResult(mission, None, attempts, time.monotonic() - start, None)
+
+    def dispatch(self, missions: list, registry: DroneRegistry, now: float) -> list:
+        """
+        Sends every mission to the nearest idle drone that accepts it
+        :param missions: list of (target, payload) pairs, where target is the (lon, lat) location of the mission
+        :param registry: registry of the drone fleet
+        :param now: current time as a POSIX timestamp
+        :return: list of DispatchResults, in the order of `missions`
+        """
+        if not missions:
+            return []
+        self._load_sdk()
+        self._claimed = set()
+        drones = registry.idle_drones(now)
+        if len(registry) == 0 and self.fallback_device_id is not None:
+            drones = [Drone(self.fallback_device_id, np.nan, np.nan, IDLE, now)]
+        order = self.candidates([target for target, _ in missions], drones)
+
+        workers = max(1, min(self.max_workers, len(missions)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self._send, i, payload, [drones[d].device_id for d in order[i]])
+                       for i, (_, payload) in enumerate(missions)]
+            results = [future.result() for future in futures]
+
+        for result in results:
+            if result.device_id is not None:
+                registry.mark_busy(result.device_id, now)
+        return results
+
@@ -0,0 +1,160 @@
+"""
+Document Layout
+
+===================
+
+Layout of the sensor and actuator documents written by handle_device_input, and the partition keys derived from it.
+
+    {
+        "id": "sensor-17-5f0c3d9b2a4e6f718293a4b5c6d7e8f9",
+        "pk": "drt2:2021050320",
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [-71.1, 42.3]},
+        "properties": {"device_type": "sensor", "device_id": "sensor-17"},
+        "readings": {"carbon_monoxide": 20.5, "pm2_5": 7.25}
+    }
+
+- `id` is the device id followed by a hash of the raw event body, so that an event delivered twice by the Event Hub is
+  upserted onto the same document instead of being stored twice
+- `pk` is the partition key: the geohash of the device's position, truncated to `PartitionGeohashPrecision`
+  characters (4 by default, cells of roughly 39 x 20 km), and the UTC hour the event was enqueued in, or of the
+  device's own `timestamp` when the enqueued time is unknown. Both come with the event, so a redelivered event gets the
+  same partition key as well as the same id. Events with neither are rejected. Writes of a region spread over a new
+  logical partition every hour, and a query over a time window and a set of regions only needs the partitions of those
+  hours and cells
+- `readings` holds every numeric reading, flattened from the `{"val": x}` objects of the event's properties. All other
+  properties, such as `device_id`, a drone's `status` or the device's own `timestamp`, are left in `properties`
+
+The timer function targets its partitions with `r.pk IN (...)`. Regions are given by the `SensorRegions` app setting as
+comma-separated geohashes. Geohashes shorter than the partition precision stand for every cell they contain. Since a
+document's hour comes from when its event was enqueued, which precedes its `_ts`, queries reach back PARTITION_SLACK
+seconds further than their time window. A query over more than MAX_PARTITION_KEYS keys, i.e. cells times hours, is
+not restricted to its partitions at all.
+"""
+
+import hashlib
+import os
+from datetime import datetime
+
+PARTITION_KEY_FIELD = 'pk'
+GEOHASH_PRECISION = int(os.getenv('PartitionGeohashPrecision', '4'))
+BUCKET_SECONDS = 3600
+PARTITION_SLACK = 3600
+
+# Largest number of partition keys a single query may target, and of cells in SensorRegions
+MAX_PARTITION_KEYS = 512
+
+# Numeric properties that describe the event rather than a reading, and are left in `properties`
+METADATA_PROPERTIES = {'timestamp'}
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash(lon: float, lat: float, precision: int = GEOHASH_PRECISION) -> str:
+    """
+    Encodes a position as a geohash
+    :param lon: longitude in decimal degrees
+    :param lat: latitude in decimal degrees
+    :param precision: number of characters
+    :return: geohash string
+    """
+    lon_range, lat_range = [-180.0, 180.0], [-90.0, 90.0]
+    chars, bits, bit, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, value = (lon_range, lon) if even else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[bits])
+            bits, bit = 0, 0
+    return ''.join(chars)
+
+
+def hour_bucket(ts: float) -> str:
+    """
+    Returns the UTC hour of a POSIX timestamp, as YYYYMMDDHH
+    """
+    return datetime.utcfromtimestamp(ts - ts % BUCKET_SECONDS).strftime('%Y%m%d%H')
+
+
+def partition_key(lon: float, lat: float, ts: float, precision: int = GEOHASH_PRECISION) -> str:
+    return "{}:{}".format(geohash(lon, lat, precision), hour_bucket(ts))
+
+
+def to_document(record: dict, body: bytes, ts: float, precision: int = GEOHASH_PRECISION) -> dict:
+    """
+    Lays out a decoded event as a document
+    :param record: decoded GeoJSON Feature, see shared_code.event_decoder. It is modified in place
+    :param body: raw event body, hashed into the document id
+    :param ts: POSIX timestamp the event was enqueued at, or of the reading when that is unknown
+    :param precision: geohash precision of the partition key
+    :return: the document
+    """
+    properties = record['properties']
+    readings = {}
+    for name, value in list(properties.items()):
+        if name in METADATA_PROPERTIES:
+            continue
+        if type(value) is dict and type(value.get('val')) in (float, int):
+            readings[name] = value['val']
+            del properties[name]
+        elif type(value) in (float, int):
+            readings[name] = value
+            del properties[name]
+
+    lon, lat = record['geometry']['coordinates'][:2]
+    record['id'] = "{}-{}".format(properties.get('device_id', 'unknown'),
+                                  hashlib.blake2b(body, digest_size=16).hexdigest())
+    record[PARTITION_KEY_FIELD] = partition_key(lon, lat, ts, precision)
+    record['readings'] = readings
+    return record
+
+
+def parse_regions(setting: str, precision: int = GEOHASH_PRECISION) -> list:
+    """
+    Expands a comma-separated list of geohashes into the geohash cells of the partition keys
+    :param setting: value of the `SensorRegions` app setting, e.g. "drt2,drt3" or "drt"
+    :param precision: geohash precision of the partition keys
+    :return: sorted list of geohash cells, empty when no region is given
+    :exception: ValueError if a geohash is invalid or the regions hold more than MAX_PARTITION_KEYS cells
+    """
+    cells = set()
+    for region in (part.strip().lower() for part in (setting or '').split(',')):
+        if not region:
+            continue
+        if any(c not in _BASE32 for c in region):
+            raise ValueError("Invalid geohash in SensorRegions: {!r}".format(region))
+        region = region[:precision]
+        if 32 ** (precision - len(region)) > MAX_PARTITION_KEYS:
+            raise ValueError("Region {!r} is too large for geohash precision {}".format(region, precision))
+        expanded = [region]
+        for _ in range(precision - len(region)):
+            expanded = [prefix + c for prefix in expanded for c in _BASE32]
+        cells.update(expanded)
+    if len(cells) > MAX_PARTITION_KEYS:
+        raise ValueError("SensorRegions holds more than {} cells".format(MAX_PARTITION_KEYS))
+    return sorted(cells)
+
+
+def partition_keys(cells: list, since: float, until: float):
+    """
+    Returns the partition keys holding the documents of the given cells written between `since` and `until`
+    :param cells: geohash cells, see `parse_regions`
+    :param since: POSIX timestamp of the start of the time range
+    :param until: POSIX timestamp of the end of the time range
+    :return: list of partition keys, or None when there would be more than MAX_PARTITION_KEYS of them and every
+        partition must be queried instead
+    """
+    start = since - PARTITION_SLACK
+    start -= start % BUCKET_SECONDS
+    buckets = [hour_bucket(ts) for ts in range(int(start), int(until) + 1, BUCKET_SECONDS)]
+    if len(buckets) * len(cells) > MAX_PARTITION_KEYS:
+        return None
+    return ["{}:{}".format(cell, bucket) for bucket in buckets for cell in cells]
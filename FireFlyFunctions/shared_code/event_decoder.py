@@ -0,0 +1,147 @@
+"""
+GeoJSON Event Decoder
+
+===================
+
+Decodes the raw bytes of a device event straight into a plain dictionary and validates the device format in a single
+pass, instead of building a geojson object tree and walking it again for every check.
+
+A valid event is a GeoJSON Feature with a Point geometry and a 'device_type' property that is either "sensor" or
+"actuator". orjson is used for parsing when it is installed, otherwise the standard library parser is used.
+
+Run `python -m shared_code.event_decoder [count ...]` from the FireFlyFunctions directory to compare the decoder
+against the geojson-based path on a synthetic event corpus.
+"""
+
+import json
+from collections import namedtuple
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
+# Kinds of decoded events
+SENSOR = 'sensor'
+ACTUATOR = 'actuator'
+REJECTED = 'rejected'
+
+# Reasons an event may be rejected
+INVALID_JSON = 'invalid_json'
+NOT_A_FEATURE = 'not_a_feature'
+NOT_A_POINT = 'not_a_point'
+MISSING_DEVICE_TYPE = 'missing_device_type'
+UNKNOWN_DEVICE_TYPE = 'unknown_device_type'
+# Set when the event is laid out as a document (see shared_code.parallel_ingest), not by `decode_event`
+MISSING_TIMESTAMP = 'missing_timestamp'
+
+# Result of decoding a single event. `record` is None and `reason` is set only when the event is rejected
+DecodedEvent = namedtuple('DecodedEvent', ['kind', 'record', 'reason'])
+
+# Rejections carry no record, so a single shared result per reason is enough
+_REJECTIONS = {reason: DecodedEvent(REJECTED, None, reason)
+               for reason in (INVALID_JSON, NOT_A_FEATURE, NOT_A_POINT, MISSING_DEVICE_TYPE, UNKNOWN_DEVICE_TYPE,
+                              MISSING_TIMESTAMP)}
+
+_DEVICE_KINDS = {'sensor': SENSOR, 'actuator': ACTUATOR}
+
+
+def decode_event(body: bytes) -> DecodedEvent:
+    """
+    Decodes raw event bytes and checks the Feature/Point/'device_type' schema in one pass
+    :param body: raw UTF-8 encoded event body
+    :return: DecodedEvent of kind SENSOR or ACTUATOR holding the record as a plain dict, or of kind REJECTED
+        holding the reason for the rejection
+    """
+    try:
+        record = _loads(body)
+    except ValueError:
+        return _REJECTIONS[INVALID_JSON]
+
+    if type(record) is not dict or record.get('type') != 'Feature':
+        return _REJECTIONS[NOT_A_FEATURE]
+
+    geometry = record.get('geometry')
+    if type(geometry) is not dict or geometry.get('type') != 'Point':
+        return _REJECTIONS[NOT_A_POINT]
+    coordinates = geometry.get('coordinates')
+    if type(coordinates) is not list or len(coordinates) < 2 \
+            or type(coordinates[0]) not in (float, int) or type(coordinates[1]) not in (float, int):
+        return _REJECTIONS[NOT_A_POINT]
+
+    properties = record.get('properties')
+    if type(properties) is not dict or 'device_type' not in properties:
+        return _REJECTIONS[MISSING_DEVICE_TYPE]
+    kind = _DEVICE_KINDS.get(properties['device_type'])
+    if kind is None:
+        return _REJECTIONS[UNKNOWN_DEVICE_TYPE]
+
+    return DecodedEvent(kind, record, None)
+
+
+def _synthetic_corpus(count: int, seed: int = 0) -> list:
+    """
+    Builds `count` encoded events: mostly sensor readings, some drone positions and a few invalid messages
+    """
+    import random
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        roll = rng.random()
+        point = {"type": "Point", "coordinates": [rng.uniform(-122.5, -121.5), rng.uniform(37.0, 38.0)]}
+        if roll < 0.8:
+            properties = {"device_type": "sensor", "device_id": "sensor-{}".format(i % 5000),
+                          "carbon_monoxide": {"val": rng.uniform(0, 30), "unit": "ppm"},
+                          "pm2_5": {"val": rng.uniform(0, 20), "unit": "ug/m3"}}
+        elif roll < 0.95:
+            properties = {"device_type": "actuator", "device_id": "drone-{}".format(i % 50), "status": "idle"}
+        elif roll < 0.98:
+            properties = {"device_type": "balloon"}
+        else:
+            corpus.append(b'{"type": "Feature", "geometry": ')
+            continue
+        corpus.append(json.dumps({"type": "Feature", "geometry": point, "properties": properties}).encode('utf-8'))
+    return corpus
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    import geojson
+    from .shared_utils import meets_device_format, is_device_sensor
+
+    def _geojson_path(body: bytes):
+        """
+        The original decoding path of handle_device_input, kept for comparison
+        """
+        try:
+            decoded_dict = geojson.loads(body.decode('utf-8'))
+        except json.decoder.JSONDecodeError:
+            return None
+        if decoded_dict is None or not meets_device_format(decoded_dict):
+            return None
+        try:
+            return is_device_sensor(decoded_dict), decoded_dict
+        except KeyError:
+            return None
+
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    print("Parser: {}".format("orjson" if orjson else "json"))
+    for count in counts:
+        corpus = _synthetic_corpus(count)
+
+        start = time.perf_counter()
+        for body in corpus:
+            _geojson_path(body)
+        baseline = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for body in corpus:
+            decode_event(body)
+        fast = time.perf_counter() - start
+
+        print("{:>8} events: geojson {:.3f}s ({:,.0f} ev/s), decoder {:.3f}s ({:,.0f} ev/s), speedup {:.1f}x".format(
+            count, baseline, count / baseline, fast, count / fast, baseline / fast))
@@ -0,0 +1,273 @@
+"""
+Flight Path Planning
+
+===================
+
+Turns the enclosing circle of a fire into drone sorties, with as many waypoints as the circle's size and the drones'
+speed call for.
+
+Waypoints are spaced by the distance a drone covers in `waypoint_interval` seconds, so that a small fire is not flown
+around through dozens of waypoints a few metres apart and a large fire is not cut into a coarse polygon. Every ring has
+between `min_waypoints` and `max_waypoints` waypoints. Besides the perimeter, the path may cover the inside of the
+circle with `rings` concentric rings, or with a spiral making as many turns, evenly spaced towards the center.
+
+Every path is closed: after its last waypoint, the drone flies back to the first one, which closes the perimeter. A
+drone flies at most `speed * endurance` metres per sortie, counting its transit from where it is to the first waypoint
+of its sortie, when that is known, and the closing leg for the sortie flying it. A longer path is split into
+consecutive stretches of about equal length, each sent to its own drone and none longer than a sortie, up to
+`max_sorties` drones per fire. When even `max_sorties` sorties cannot cover the whole path, each of them flies as far as
+its range allows, from where the previous one stopped, and the plan is marked as truncated: the rest of the path is not
+flown.
+
+All waypoints of every circle are projected in a single call to `vincenty_direct_batch`. Payloads are kept small for
+the direct method: coordinates are rounded to `precision` decimals, about 0.1 m at 6, and may be delta encoded, i.e.
+sent as integers in units of 10^-precision degrees, each relative to the previous waypoint:
+
+    {"type": "MultiPoint", "coordinates": [[-71.1, 42.30045], [-71.099395, 42.300318], ...]}
+    {"type": "MultiPoint", "encoding": "delta", "precision": 6, "deltas": [[-71100000, 42300450], [605, -132], ...]}
+
+`decode_waypoints` reads both forms back.
+"""
+
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from .vincenty import vincenty_direct_batch, vincenty_inverse_batch
+
+# Coverage patterns
+RINGS = 'rings'
+SPIRAL = 'spiral'
+
+# Path encodings
+GEOJSON = 'geojson'
+DELTA = 'delta'
+
+# Part of a fire's path flown by one drone. `target` is the (lon, lat) of its first waypoint, which the nearest drone is
+# picked for, `waypoints` the (n, 2) array of its (lon, lat) waypoints, `length` the metres flown from the first to the
+# last waypoint, and `transit` the metres flown to reach the first waypoint
+Sortie = namedtuple('Sortie', ['target', 'waypoints', 'length', 'transit'])
+
+# Sorties planned over one fire. `length` is the length in metres of the whole path, and `truncated` whether the sorties
+# stop short of its end because more than `max_sorties` drones would be needed
+FlightPlan = namedtuple('FlightPlan', ['sorties', 'length', 'truncated'])
+
+
+class FlightPlanner:
+    """
+    Plans the waypoints of the sorties flown around and over fires
+    """
+
+    def __init__(self, speed: float = 10.0, endurance: float = 1200.0, waypoint_interval: float = 15.0,
+                 min_waypoints: int = 4, max_waypoints: int = 64, rings: int = 0, pattern: str = RINGS,
+                 max_sorties: int = 3):
+        """
+        :param speed: drone cruise speed in metres per second
+        :param endurance: seconds a drone can fly per sortie
+        :param waypoint_interval: seconds of flight between consecutive waypoints
+        :param min_waypoints: fewest waypoints on a ring, or on a turn of the spiral
+        :param max_waypoints: most waypoints on a ring, or on a turn of the spiral
+        :param rings: number of rings, or spiral turns, covering the inside of the circle
+        :param pattern: RINGS or SPIRAL
+        :param max_sorties: most drones a single fire's path is split across
+        """
+        if pattern not in (RINGS, SPIRAL):
+            raise ValueError("Unknown coverage pattern: {!r}".format(pattern))
+        self.speed = speed
+        self.endurance = endurance
+        self.spacing = speed * waypoint_interval
+        self.min_waypoints = min_waypoints
+        self.max_waypoints = max_waypoints
+        self.rings = rings
+        self.pattern = pattern
+        self.max_sorties = max_sorties
+
+    @property
+    def sortie_range(self) -> float:
+        """
+        Metres a drone can fly per sortie
+        """
+        return self.speed * self.endurance
+
+    def waypoint_count(self, radius: float) -> int:
+        """
+        Returns the number of waypoints on a ring of the given radius in metres
+        """
+        count = math.ceil(2 * math.pi * radius / self.spacing) if self.spacing > 0 else self.max_waypoints
+        return int(min(self.max_waypoints, max(self.min_waypoints, count)))
+
+    def polar_path(self, radius: float) -> tuple:
+        """
+        Returns the path over a circle centered on the origin, as polar coordinates
+        :param radius: radius of the circle in metres
+        :return: tuple of arrays (azimuths in decimal degrees, distances in metres), in flight order
+        """
+        turns = self.rings + 1
+        radii = radius * (1 - np.arange(turns) / turns)
+        counts = [self.waypoint_count(r) for r in radii.tolist()]
+
+        if self.pattern == RINGS:
+            # Each ring starts due north and is flown clockwise, then the drone moves in to the next ring
+            azimuths = np.concatenate([np.arange(n) * (360.0 / n) for n in counts])
+            distances = np.repeat(radii, counts)
+        else:
+            # The distance shrinks steadily with the azimuth, down to the innermost ring after the last turn
+            fractions = np.concatenate([(i + np.arange(n) / n) / turns for i, n in enumerate(counts)])
+            azimuths = (fractions * turns * 360.0) % 360.0
+            distances = radius * (1 - fractions)
+        return azimuths, distances
+
+    def plan(self, circles: list, origins: list = None) -> list:
+        """
+        Plans the sorties of every circle
+        :param circles: list of (center longitude, center latitude, radius in metres)
+        :param origins: list with, for each circle, the (lon, lat) its drones take off from, or None when unknown, in
+            which case the transit to the path is not counted
+        :return: list with, for each circle, its FlightPlan
+        """
+        if not circles:
+            return []
+        paths = [self.polar_path(radius) for _, _, radius in circles]
+        counts = [len(azimuths) for azimuths, _ in paths]
+        centers = np.repeat(np.array([(lon, lat) for lon, lat, _ in circles], dtype=float), counts, axis=0)
+        azimuths = np.concatenate([azimuths for azimuths, _ in paths])
+        distances = np.concatenate([distances for _, distances in paths])
+
+        lats, lons, _ = vincenty_direct_batch(centers[:, 1], centers[:, 0], azimuths, distances)
+        lon_lat = np.column_stack([lons, lats])
+
+        # Flight distances between consecutive waypoints, on the plane tangent at each circle's center
+        theta = np.radians(azimuths)
+        x, y = distances * np.sin(theta), distances * np.cos(theta)
+        steps = np.hypot(np.diff(x, prepend=x[:1]), np.diff(y, prepend=y[:1]))
+
+        # Transit from each circle's origin to every waypoint of its path, in a single call
+        transits = np.zeros(len(lon_lat))
+        if origins is not None and any(origin is not None for origin in origins):
+            starts = np.repeat(np.array([origin if origin is not None else (np.nan, np.nan) for origin in origins],
+                                        dtype=float), counts, axis=0)
+            transits, _, _ = vincenty_inverse_batch(starts[:, 1], starts[:, 0], lon_lat[:, 1], lon_lat[:, 0])
+            transits = np.where(np.isnan(transits), 0.0, transits)
+
+        plans, start = [], 0
+        for count in counts:
+            stop = start + count
+            # The closing leg flies from the last waypoint back to the first, which ends the path
+            path_steps = np.append(steps[start:stop], np.hypot(x[start] - x[stop - 1], y[start] - y[stop - 1]))
+            path_steps[0] = 0.0
+            plans.append(self.split(np.vstack([lon_lat[start:stop], lon_lat[start:start + 1]]), np.cumsum(path_steps),
+                                    np.append(transits[start:stop], transits[start])))
+            start = stop
+        return plans
+
+    def split(self, lon_lat: np.ndarray, travelled: np.ndarray, transits: np.ndarray = None) -> FlightPlan:
+        """
+        Splits a path into stretches of about equal length, as few as the sortie range allows
+        :param lon_lat: (n, 2) array of waypoints in flight order
+        :param travelled: distance in metres flown from the first waypoint to each waypoint
+        :param transits: distance in metres flown to reach each waypoint, where a sortie would start, 0 by default
+        :return: FlightPlan
+        """
+        transits = np.zeros(len(lon_lat)) if transits is None else np.asarray(transits, dtype=float)
+        total = float(travelled[-1]) if len(travelled) else 0.0
+        if self.sortie_range <= 0 or (len(lon_lat) and total + transits[0] <= self.sortie_range):
+            return FlightPlan(self._sorties(lon_lat, travelled, transits, []), total, False)
+
+        # Stretches end on waypoints, so equal stretches may be a little longer than planned, and one more is tried
+        for count in range(math.ceil(total / self.sortie_range), min(self.max_sorties, len(lon_lat)) + 1):
+            bounds = np.searchsorted(travelled, total * np.arange(1, count) / count).tolist()
+            sorties = self._sorties(lon_lat, travelled, transits, bounds)
+            if all(sortie.transit + sortie.length <= self.sortie_range for sortie in sorties):
+                return FlightPlan(sorties, total, False)
+
+        # Otherwise each drone flies as far as it can from where the previous one stopped, which needs the fewest drones.
+        # A drone that cannot even reach the first waypoint left ends the plan
+        bounds = []
+        while len(bounds) < self.max_sorties:
+            first = bounds[-1] if bounds else 0
+            reach = self.sortie_range - transits[first]
+            stop = int(np.searchsorted(travelled, travelled[first] + reach, side='right'))
+            if reach < 0 or stop <= first:
+                return FlightPlan(self._sorties(lon_lat, travelled, transits, bounds)[:len(bounds)], total, True)
+            if stop >= len(lon_lat):
+                return FlightPlan(self._sorties(lon_lat, travelled, transits, bounds), total, False)
+            bounds.append(stop)
+        return FlightPlan(self._sorties(lon_lat, travelled, transits, bounds)[:self.max_sorties], total, True)
+
+    @staticmethod
+    def _sorties(lon_lat: np.ndarray, travelled: np.ndarray, transits: np.ndarray, bounds: list) -> list:
+        """
+        Cuts a path into Sorties at the given waypoint indices
+        """
+        result = []
+        for part, first in zip(np.split(lon_lat, bounds), [0] + bounds):
+            if len(part):
+                last = first + len(part) - 1
+                result.append(Sortie(tuple(part[0].tolist()), part, float(travelled[last] - travelled[first]),
+                                     float(transits[first])))
+        return result
+
+
+def encode_waypoints(lon_lat: np.ndarray, precision: int = 6, encoding: str = GEOJSON) -> dict:
+    """
+    Encodes waypoints as a compact direct method payload
+    :param lon_lat: (n, 2) array of (lon, lat) waypoints
+    :param precision: decimals kept of each coordinate
+    :param encoding: GEOJSON for a GeoJSON MultiPoint of rounded coordinates, DELTA for integer deltas
+    :return: payload dict
+    """
+    lon_lat = np.asarray(lon_lat, dtype=float).reshape(-1, 2)
+    if encoding == GEOJSON:
+        return {"type": "MultiPoint", "coordinates": np.round(lon_lat, precision).tolist()}
+    if encoding == DELTA:
+        scaled = np.round(lon_lat * 10 ** precision).astype(np.int64)
+        return {"type": "MultiPoint", "encoding": DELTA, "precision": precision,
+                "deltas": np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).tolist()}
+    raise ValueError("Unknown path encoding: {!r}".format(encoding))
+
+
+def decode_waypoints(payload: dict) -> list:
+    """
+    Reads the (lon, lat) waypoints back from a payload made by `encode_waypoints`
+    """
+    if payload.get('encoding') == DELTA:
+        scaled = np.cumsum(np.array(payload['deltas'], dtype=np.int64).reshape(-1, 2), axis=0)
+        return (scaled / 10 ** payload['precision']).tolist()
+    return payload['coordinates']
+
+
+if __name__ == '__main__':
+    import json
+    import time
+
+    # Fires from a few hundred metres to several kilometres across, against the fixed 10 waypoints sent before
+    rng = np.random.default_rng(0)
+    circles = [(-71.1 + rng.uniform(-1, 1), 42.3 + rng.uniform(-1, 1), r) for r in [50, 200, 1000, 5000, 20000]]
+    for rings, pattern in [(0, RINGS), (2, RINGS), (2, SPIRAL)]:
+        planner = FlightPlanner(rings=rings, pattern=pattern)
+        plans = planner.plan(circles)
+        for (_, _, radius), flight_plan in zip(circles, plans):
+            sorties = flight_plan.sorties
+            assert all(s.transit + s.length <= planner.sortie_range for s in sorties)
+            sizes = {encoding: sum(len(json.dumps(encode_waypoints(s.waypoints, encoding=encoding),
+                                                  separators=(',', ':'))) for s in sorties)
+                     for encoding in (GEOJSON, DELTA)}
+            print("{} rings, {:>6}, radius {:>6} m: {} sorties, {:>4} waypoints, {:>7.0f} of {:>7.0f} m flown{}, "
+                  "payload {} bytes, delta {} bytes".format(rings, pattern, radius, len(sorties),
+                                                            sum(len(s.waypoints) for s in sorties),
+                                                            sum(s.length for s in sorties), flight_plan.length,
+                                                            " (truncated)" if flight_plan.truncated else "",
+                                                            sizes[GEOJSON], sizes[DELTA]))
+
+    planner = FlightPlanner(rings=2)
+    for count in [10, 100, 1000]:
+        batch = [(-71.1 + rng.uniform(-1, 1), 42.3 + rng.uniform(-1, 1), rng.uniform(50, 5000)) for _ in range(count)]
+        start = time.perf_counter()
+        plans = planner.plan(batch)
+        elapsed = time.perf_counter() - start
+        print("{:>5} circles: {:.2f} ms, {} waypoints".format(
+            count, elapsed * 1e3, sum(len(s.waypoints) for flight_plan in plans for s in flight_plan.sorties)))
+
+    waypoints = plans[0].sorties[0].waypoints
+    assert np.allclose(decode_waypoints(encode_waypoints(waypoints, encoding=DELTA)), waypoints, atol=1e-6)
@@ -0,0 +1,271 @@
+"""
+Incremental Enclosing Circle
+
+===================
+
+Keeps the minimum enclosing circle of a fire up to date across timer ticks, instead of solving it from scratch every
+time.
+
+The minimum enclosing circle only depends on its support set, i.e. the points lying on its boundary. Inserting a point
+that falls inside the circle, or expiring a point that is not on the boundary, leaves the circle unchanged, so the
+solver is only run again when a new point lies outside the circle or a support point expires. Each update otherwise
+costs O(inserted + expired) point tests.
+
+Every tracker works on its own LocalPlane, fixed when the tracker is created, so that points projected on earlier ticks
+stay valid. The tracker also remembers the last circle a mission was sent for, so that a drone is only sent out again
+once the circle moved or grew beyond a tolerance. A mission may be split into several sorties, flown by different
+drones: the tracker keeps the sorties planned for its circle and which of them were delivered, so that only the others
+are sent again, and the mission counts as sent once every sortie was delivered. `match_clusters` carries trackers over from one tick to the next by
+matching each new cluster to the tracker sharing most of its points.
+
+Each tracker also keeps the history of its circles (see shared_code.fire_tracking), recorded by `record`, from which
+`predicted_circle` extrapolates where the fire will be.
+"""
+
+from collections import Counter
+
+import numpy as np
+
+from .fire_tracking import FireHistory
+from .projection import LocalPlane
+from .welzl import CircleSolver
+
+# Points within this many metres of the boundary count as on it, which absorbs the rounding of the solver
+SUPPORT_TOLERANCE = 0.01
+
+
+class IncrementalEnclosingCircle:
+    """
+    Minimum enclosing circle of a changing set of (lon, lat) points, and the circle last dispatched for
+    """
+
+    def __init__(self, plane: LocalPlane, support_tolerance: float = SUPPORT_TOLERANCE, history_size: int = 64,
+                 max_horizon: float = 1800.0):
+        """
+        :param plane: plane the points are projected on
+        :param support_tolerance: distance in metres from the boundary within which a point counts as on it
+        :param history_size: number of past circles kept to predict the fire's spread
+        :param max_horizon: most seconds a prediction extrapolates past the latest recorded circle
+        """
+        self.plane = plane
+        self.support_tolerance = support_tolerance
+
+        # Projected (x, y) of every point, by (lon, lat)
+        self.points = {}
+        self.center = np.zeros(2)
+        self.radius = 0.0
+        self.support = set()
+
+        # Number of solves so far, and iterations and convergence of the last one (see shared_code.welzl.CircleSolver)
+        self.solves = 0
+        self.iterations = 0
+        self.converged = True
+
+        # (x, y, radius) of the circle last dispatched for
+        self.dispatched = None
+
+        # Sorties planned for the mission in progress, (x, y, radius) of the circle they were planned for, and indices
+        # of the sorties delivered so far
+        self.sorties = []
+        self.planned = None
+        self.delivered = set()
+
+        # Circles recorded on past ticks
+        self.history = FireHistory(capacity=history_size, max_horizon=max_horizon)
+
+    @classmethod
+    def around(cls, points: list, **kwargs):
+        """
+        Creates a tracker on the plane around the centroid of the given (lon, lat) points, and adds them
+        """
+        lon_lat = np.array(points, dtype=float)
+        tracker = cls(LocalPlane.around(lon_lat[:, 0], lon_lat[:, 1]), **kwargs)
+        tracker.update(inserted=points)
+        return tracker
+
+    def __len__(self):
+        return len(self.points)
+
+    @property
+    def circle(self) -> tuple:
+        """
+        Current circle as a tuple of (center longitude, center latitude, radius in metres)
+        """
+        center_lon, center_lat = self.plane.to_geographic(self.center)
+        return center_lon, center_lat, self.radius
+
+    def record(self, t: float):
+        """
+        Records the current circle and up to three of its support points in the history
+        :param t: POSIX timestamp of the circle
+        """
+        support = [self.points[key] for key in self.support if key in self.points][:3]
+        self.history.push(t, self.center, self.radius, support)
+
+    def predicted_circle(self, t: float) -> tuple:
+        """
+        Circle the fire is predicted to have at time `t` from its history, or the current circle without history
+        :return: tuple of (center longitude, center latitude, radius in metres)
+        """
+        predicted = self.history.predict(t)
+        if predicted is None:
+            return self.circle
+        center, radius = predicted
+        center_lon, center_lat = self.plane.to_geographic(center)
+        return center_lon, center_lat, radius
+
+    def update(self, inserted=(), expired=()) -> bool:
+        """
+        Adds and removes points, solving the circle again only if a new point lies outside of it or a support point
+        expired
+        :param inserted: (lon, lat) points entering the set. Points already in the set are ignored
+        :param expired: (lon, lat) points leaving the set. Points not in the set are ignored
+        :return: True if the circle was solved again
+        """
+        stale = False
+        for point in expired:
+            if self.points.pop(point, None) is not None and point in self.support:
+                stale = True
+
+        inserted = [point for point in inserted if point not in self.points]
+        if inserted:
+            lon_lat = np.array(inserted, dtype=float)
+            xy = self.plane.to_plane(lon_lat[:, 0], lon_lat[:, 1])
+            self.points.update(zip(inserted, map(tuple, xy.tolist())))
+            if not stale:
+                outside = np.hypot(*(xy - self.center).T) > self.radius + self.support_tolerance
+                stale = bool(np.any(outside)) or self.solves == 0
+
+        if stale:
+            self._solve()
+        return stale
+
+    def _solve(self):
+        self.solves += 1
+        if not self.points:
+            self.center, self.radius, self.support, self.iterations = np.zeros(2), 0.0, set(), 0
+            return
+
+        keys = list(self.points)
+        xy = np.array([self.points[key] for key in keys])
+        nsphere = CircleSolver(xy).solve()
+        self.iterations, self.converged = nsphere.iterations, nsphere.converged
+        self.center, self.radius = np.array(nsphere.center, dtype=float), float(np.sqrt(nsphere.sqradius))
+
+        distances = np.hypot(*(xy - self.center).T)
+        on_boundary = np.nonzero(distances >= self.radius - self.support_tolerance)[0]
+        self.support = {keys[i] for i in on_boundary}
+
+    def should_dispatch(self, tolerance: float) -> bool:
+        """
+        Checks whether the circle moved or grew by more than `tolerance` metres since a mission was last sent for it
+        """
+        if not self.points:
+            return False
+        return self._changed_since(self.dispatched, tolerance)
+
+    def should_plan(self, tolerance: float) -> bool:
+        """
+        Checks whether no sortie was planned yet, or the circle moved or grew by more than `tolerance` metres since
+        """
+        return not self.sorties or self._changed_since(self.planned, tolerance)
+
+    def _changed_since(self, circle: tuple, tolerance: float) -> bool:
+        if circle is None:
+            return True
+        x, y, radius = circle
+        shift = np.hypot(self.center[0] - x, self.center[1] - y)
+        return bool(shift + abs(self.radius - radius) > tolerance)
+
+    def set_sorties(self, sorties: list):
+        """
+        Records the sorties planned for the current circle, none of which has been delivered yet
+        """
+        self.sorties = list(sorties)
+        self.planned = (float(self.center[0]), float(self.center[1]), self.radius)
+        self.delivered = set()
+
+    def undelivered(self) -> list:
+        """
+        Returns the (index, sortie) of every planned sortie not delivered yet
+        """
+        return [(i, sortie) for i, sortie in enumerate(self.sorties) if i not in self.delivered]
+
+    def mark_delivered(self, index: int):
+        """
+        Records that a planned sortie was delivered. The mission counts as sent once every sortie was
+        """
+        self.delivered.add(index)
+        if len(self.delivered) == len(self.sorties):
+            self.dispatched = self.planned
+
+
+def match_clusters(trackers: list, clusters: list, **kwargs) -> list:
+    """
+    Carries trackers over to a new set of clusters. Pairs of a cluster and a tracker are matched greedily by the
+    number of points they share, and matched trackers are updated with the difference. Clusters without a match get a
+    new tracker, and trackers without a match are dropped
+    :param trackers: IncrementalEnclosingCircles of the previous tick
+    :param clusters: lists of (lon, lat) points, one per cluster
+    :param kwargs: options of new trackers, see IncrementalEnclosingCircle
+    :return: list of IncrementalEnclosingCircles, one per cluster
+    """
+    owner = {}
+    for t, tracker in enumerate(trackers):
+        for point in tracker.points:
+            owner[point] = t
+
+    overlaps = []
+    for c, cluster in enumerate(clusters):
+        votes = Counter(owner[point] for point in cluster if point in owner)
+        overlaps.extend((shared, c, t) for t, shared in votes.items())
+
+    matches, taken = {}, set()
+    for shared, c, t in sorted(overlaps, reverse=True):
+        if c not in matches and t not in taken:
+            matches[c] = t
+            taken.add(t)
+
+    matched = []
+    for c, cluster in enumerate(clusters):
+        if c not in matches:
+            matched.append(IncrementalEnclosingCircle.around(cluster, **kwargs))
+            continue
+        tracker, members = trackers[matches[c]], set(cluster)
+        tracker.update(inserted=[point for point in cluster if point not in tracker.points],
+                       expired=[point for point in tracker.points if point not in members])
+        matched.append(tracker)
+    return matched
+
+
+if __name__ == '__main__':
+    import time
+
+    from .welzl import welzl
+
+    # Ticks that each add and expire a few readings of a fire of n readings, against a full solve every tick
+    rng = np.random.default_rng(0)
+    for count in [1000, 10000, 100000]:
+        points = [tuple(p) for p in (rng.normal(scale=0.01, size=(count, 2)) + [-71.1, 42.3]).tolist()]
+        tracker = IncrementalEnclosingCircle.around(points[:count // 2])
+        window = list(points[:count // 2])
+        plane = tracker.plane
+
+        incremental, full, ticks = 0.0, 0.0, 50
+        step = max(1, count // 2 // ticks)
+        for tick in range(ticks):
+            inserted = points[count // 2 + tick * step:count // 2 + (tick + 1) * step]
+            expired, window = window[:step], window[step:] + inserted
+
+            start = time.perf_counter()
+            tracker.update(inserted=inserted, expired=expired)
+            incremental += time.perf_counter() - start
+
+            start = time.perf_counter()
+            lon_lat = np.array(window)
+            nsphere = welzl(plane.to_plane(lon_lat[:, 0], lon_lat[:, 1]), maxiterations=len(window) * 10)
+            full += time.perf_counter() - start
+            assert abs(np.sqrt(nsphere.sqradius) - tracker.radius) < 1e-6 * max(1.0, tracker.radius)
+
+        print("{:>6} points: incremental {:.2f} ms/tick ({} solves), full {:.2f} ms/tick".format(
+            count, incremental / ticks * 1e3, tracker.solves, full / ticks * 1e3))
@@ -0,0 +1,223 @@
+"""
+Parallel Ingest
+
+===================
+
+Decodes large batches of device events on a pool of workers, so that a batch of thousands of events from many devices
+is not parsed on a single core.
+
+Decoding an event and laying it out as a document (see shared_code.event_decoder and shared_code.document_layout) only
+depend on the event itself, so a batch is cut into chunks of `chunk_size` events that are decoded independently. The
+chunks are merged back in the order they were submitted, whichever finishes first, so the decoded events come out in
+the order of the batch and every device's events keep their order. Deduplication and routing stay in the calling
+thread, since they share state across events.
+
+A pool has a fixed cost per batch: sending the chunks to the workers, and the decoded documents back. Batches of fewer
+than `threshold` events are decoded in line. The threshold starts at `min_parallel` and adapts to the measured costs:
+the CPU seconds spent decoding each event, and the seconds the pool adds to every parallel batch on top of the
+decoding spread over the workers. CPU time rather than wall time is measured, so that workers competing for fewer
+cores do not look slower at decoding. A batch goes parallel once the time saved per event,
+`event_cost * (1 - 1 / parallelism)`, makes up for the overhead, where the parallelism is the number of workers or of
+CPUs, whichever is smaller. With a single worker or a single CPU, every batch is decoded in line.
+
+Every batch is decoded in line by default. Decoding is pure Python and holds the GIL, so a pool of threads only adds
+its overhead, and is only worth asking for with a parser that releases the GIL. A pool of processes pays off with
+several CPUs, once measured on the plan the app runs on with this module's benchmark. Its workers are started with the
+"spawn" method: forking the Functions worker, which runs gRPC and asyncio threads, could leave a child waiting forever
+on a lock another thread held at the time. Spawned workers import this module afresh, which adds to the first parallel
+batch.
+
+The latency of every chunk, from the submission of the batch until the chunk is merged, and the number of chunks still
+queued at that point are reported through an `on_chunk` callback. If the pool fails, e.g. when a worker process dies,
+the decoder falls back to decoding in line for good.
+"""
+
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .dedup import event_time
+from .document_layout import to_document
+from .event_decoder import decode_event, DecodedEvent, MISSING_TIMESTAMP, REJECTED
+
+# Kinds of worker pools. INLINE uses none
+INLINE = 'inline'
+PROCESS = 'process'
+THREAD = 'thread'
+
+LOGGER = logging.getLogger('log')
+
+# Progress of a parallel batch, reported once per merged chunk: number of events of the chunk, chunks still queued,
+# seconds since the batch was submitted and CPU seconds the worker spent decoding the chunk
+ChunkStats = namedtuple('ChunkStats', ['events', 'queue_depth', 'latency', 'decode_seconds'])
+
+
+def decode_chunk(items: list) -> tuple:
+    """
+    Decodes a chunk of events and lays out the valid ones as documents. Runs in the workers. Events are partitioned by
+    their enqueued time, or their own timestamp when that is unknown, and rejected when they have neither
+    :param items: list of (raw event body, POSIX timestamp the event was enqueued at, or None)
+    :return: tuple of (list of DecodedEvents whose records are documents, CPU seconds spent)
+    """
+    start = time.thread_time()
+    results = []
+    for body, enqueued_ts in items:
+        decoded = decode_event(body)
+        if decoded.kind != REJECTED:
+            ts = enqueued_ts if enqueued_ts is not None else event_time(decoded.record, None)
+            if ts is None:
+                decoded = DecodedEvent(REJECTED, None, MISSING_TIMESTAMP)
+            else:
+                decoded = decoded._replace(record=to_document(decoded.record, body, ts))
+        results.append(decoded)
+    return results, time.thread_time() - start
+
+
+class ParallelDecoder:
+    """
+    Decodes batches of events in line or on a pool of workers, whichever the batch size makes faster
+    """
+
+    def __init__(self, workers: int = None, chunk_size: int = 64, min_parallel: int = 256, executor: str = INLINE,
+                 smoothing: float = 0.2):
+        """
+        :param workers: number of workers, the number of CPUs by default. 1 or fewer always decodes in line
+        :param chunk_size: number of events per chunk
+        :param min_parallel: batch size from which the pool is used, until its costs have been measured
+        :param executor: INLINE, THREAD or PROCESS. Threads share the GIL, so they only help a parser that releases
+            it. Processes are spawned rather than forked
+        :param smoothing: weight of the latest measurement in the moving averages of the costs
+        """
+        if executor not in (INLINE, PROCESS, THREAD):
+            raise ValueError("Unknown executor: {!r}".format(executor))
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.chunk_size = max(1, chunk_size)
+        self.min_parallel = min_parallel
+        self.executor = executor
+        self.smoothing = smoothing
+
+        # Moving averages of the CPU seconds spent decoding one event, and of the seconds the pool adds to a batch
+        self.event_cost = None
+        self.pool_overhead = None
+        self._pool = None
+        # Concurrent invocations share the decoder, and must not each create a pool
+        self._lock = threading.Lock()
+
+    @property
+    def parallelism(self) -> int:
+        """
+        Number of chunks that can be decoded at the same time
+        """
+        if self.executor == INLINE:
+            return 1
+        return min(self.workers, os.cpu_count() or 1)
+
+    @property
+    def threshold(self) -> float:
+        """
+        Smallest batch decoded on the pool
+        """
+        if self.parallelism <= 1:
+            return math.inf
+        if self.event_cost is None or self.pool_overhead is None:
+            return self.min_parallel
+        saved = self.event_cost * (1 - 1 / self.parallelism)
+        if saved <= 0:
+            return math.inf
+        # A batch of a single chunk gains nothing from the pool
+        return max(2 * self.chunk_size, math.ceil(self.pool_overhead / saved))
+
+    def _average(self, current, value: float) -> float:
+        return value if current is None else current + self.smoothing * (value - current)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None and self.executor == PROCESS:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            elif self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+    def decode(self, items: list, on_chunk=None) -> tuple:
+        """
+        Decodes a batch of events, keeping their order
+        :param items: list of (raw event body, POSIX timestamp the event was enqueued at, or None)
+        :param on_chunk: function called with the ChunkStats of every chunk of a parallel batch
+        :return: tuple of (list of DecodedEvents, one per item, whose records are laid out as documents, and whether
+            the batch was decoded on the pool)
+        """
+        if not items:
+            return [], False
+        if len(items) >= self.threshold:
+            try:
+                return self._decode_parallel(items, on_chunk), True
+            except Exception as e:
+                LOGGER.warning("Parallel decoding failed, decoding in line from now on: {}".format(e))
+                self.shutdown()
+                self.workers = 1
+
+        results, seconds = decode_chunk(items)
+        self.event_cost = self._average(self.event_cost, seconds / len(items))
+        return results, False
+
+    def _decode_parallel(self, items: list, on_chunk) -> list:
+        pool = self._get_pool()
+        submitted = time.perf_counter()
+        futures = [pool.submit(decode_chunk, items[start:start + self.chunk_size])
+                   for start in range(0, len(items), self.chunk_size)]
+
+        # Chunks are merged in submission order, which keeps the order of the batch
+        results, decode_seconds = [], 0.0
+        for merged, future in enumerate(futures, start=1):
+            chunk, seconds = future.result()
+            results.extend(chunk)
+            decode_seconds += seconds
+            if on_chunk is not None:
+                on_chunk(ChunkStats(len(chunk), len(futures) - merged, time.perf_counter() - submitted, seconds))
+
+        elapsed = time.perf_counter() - submitted
+        self.event_cost = self._average(self.event_cost, decode_seconds / len(items))
+        spread = decode_seconds / min(self.parallelism, len(futures))
+        self.pool_overhead = self._average(self.pool_overhead, max(0.0, elapsed - spread))
+        return results
+
+
+if __name__ == '__main__':
+    import sys
+
+    from .event_decoder import _synthetic_corpus
+
+    # In line against always using the pool, then the adaptive decoder, on batches from a few hundred to tens of
+    # thousands of events, with the number of workers and the kind of pool given on the command line
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+    executor = sys.argv[2] if len(sys.argv) > 2 else PROCESS
+    print("{} CPUs, {} {} workers".format(os.cpu_count(), workers, executor))
+    for count in [256, 2048, 16384, 65536]:
+        items = [(body, 1620000000.0) for body in _synthetic_corpus(count)]
+        expected = [d.kind for d in decode_chunk(items)[0]]
+        timings = {}
+        for name in ['in line', 'pool', 'adaptive']:
+            decoder = ParallelDecoder(workers=workers, executor=INLINE if name == 'in line' else executor)
+            decode = (lambda batch: decoder.decode(batch)[0]) if name != 'pool' else \
+                (lambda batch: decoder._decode_parallel(batch, None))
+            decode(items)
+            start = time.perf_counter()
+            for _ in range(3):
+                decoded = decode(items)
+            timings[name] = (time.perf_counter() - start) / 3
+            assert [d.kind for d in decoded] == expected
+            decoder.shutdown()
+        print("{:>6} events: {}, threshold {}".format(count, ", ".join(
+            "{} {:.2f} ms".format(name, seconds * 1e3) for name, seconds in timings.items()), decoder.threshold))
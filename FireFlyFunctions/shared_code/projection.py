@@ -0,0 +1,108 @@
+"""
+Local Metric Projection
+
+===================
+
+Maps (longitude, latitude) coordinates in degrees onto a flat plane measured in metres, so that geometric algorithms
+such as Welzl's Algorithm can run on true distances instead of degrees, whose length varies with latitude.
+
+The plane is an azimuthal equidistant projection centered on the centroid of the points. East and north offsets are
+scaled by the prime vertical and meridian radii of curvature of the WGS84 ellipsoid at the centroid, so that the plane
+matches the ellipsoid's metric there. Over the extent of a wildfire the remaining distortion is far below GPS
+accuracy. Every point is projected in a single vectorized NumPy pass.
+"""
+
+import numpy as np
+
+# WGS84
+SEMI_MAJOR_AXIS = 6378137.0  # metres
+FLATTENING = 1 / 298.257223563
+ECCENTRICITY_SQ = FLATTENING * (2 - FLATTENING)
+
+
+def radii_of_curvature(latitude: float) -> tuple:
+    """
+    Returns the radii of curvature of the WGS84 ellipsoid
+    :param latitude: latitude in decimal degrees
+    :return: tuple of (meridian, prime vertical) radii in metres, i.e. the north-south and east-west radii
+    """
+    w = 1 - ECCENTRICITY_SQ * np.sin(np.radians(latitude)) ** 2
+    meridian = SEMI_MAJOR_AXIS * (1 - ECCENTRICITY_SQ) / w ** 1.5
+    prime_vertical = SEMI_MAJOR_AXIS / np.sqrt(w)
+    return float(meridian), float(prime_vertical)
+
+
+def centroid(lon, lat) -> tuple:
+    """
+    Returns the (longitude, latitude) centroid of the given points, averaged as unit vectors so that points on both
+    sides of the antimeridian are handled correctly
+    """
+    lon, lat = np.radians(np.asarray(lon, dtype=float)), np.radians(np.asarray(lat, dtype=float))
+    x, y, z = np.mean(np.cos(lat) * np.cos(lon)), np.mean(np.cos(lat) * np.sin(lon)), np.mean(np.sin(lat))
+    return float(np.degrees(np.arctan2(y, x))), float(np.degrees(np.arctan2(z, np.hypot(x, y))))
+
+
+class LocalPlane:
+    """
+    Azimuthal equidistant projection around an origin, in metres
+    """
+
+    def __init__(self, origin_lon: float, origin_lat: float):
+        self.origin_lon = origin_lon
+        self.origin_lat = origin_lat
+        self.north_radius, self.east_radius = radii_of_curvature(origin_lat)
+        self._sin_lat0 = np.sin(np.radians(origin_lat))
+        self._cos_lat0 = np.cos(np.radians(origin_lat))
+
+    @classmethod
+    def around(cls, lon, lat):
+        """
+        Creates the plane centered on the centroid of the given points
+        """
+        return cls(*centroid(lon, lat))
+
+    def to_plane(self, lon, lat) -> np.ndarray:
+        """
+        Projects geographic coordinates onto the plane
+        :param lon: longitudes in decimal degrees
+        :param lat: latitudes in decimal degrees
+        :return: (n, 2) array of (east, north) offsets from the origin in metres
+        """
+        lat = np.radians(np.asarray(lat, dtype=float))
+        dlon = np.radians(np.asarray(lon, dtype=float) - self.origin_lon)
+        sin_lat, cos_lat, cos_dlon = np.sin(lat), np.cos(lat), np.cos(dlon)
+
+        cos_c = np.clip(self._sin_lat0 * sin_lat + self._cos_lat0 * cos_lat * cos_dlon, -1.0, 1.0)
+        c = np.arccos(cos_c)
+        sin_c = np.sin(c)
+        # Scale factor c / sin(c), which tends to 1 at the origin
+        with np.errstate(invalid='ignore', divide='ignore'):
+            k = np.where(sin_c > 1e-12, c / sin_c, 1.0)
+
+        x = self.east_radius * k * cos_lat * np.sin(dlon)
+        y = self.north_radius * k * (self._cos_lat0 * sin_lat - self._sin_lat0 * cos_lat * cos_dlon)
+        return np.column_stack((x, y))
+
+    def to_geographic(self, xy) -> tuple:
+        """
+        Projects points on the plane back to geographic coordinates
+        :param xy: (east, north) offset in metres, or an (n, 2) array of offsets
+        :return: tuple of (longitudes, latitudes) in decimal degrees, as floats for a single point
+        """
+        xy = np.asarray(xy, dtype=float)
+        x, y = xy[..., 0] / self.east_radius, xy[..., 1] / self.north_radius
+        # On the unit sphere, the distance from the origin is also the angular distance
+        rho = np.hypot(x, y)
+        sin_c, cos_c = np.sin(rho), np.cos(rho)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            lat = np.where(rho > 1e-15,
+                           np.arcsin(np.clip(cos_c * self._sin_lat0 + y * sin_c * self._cos_lat0 / rho, -1.0, 1.0)),
+                           np.radians(self.origin_lat))
+        dlon = np.arctan2(x * sin_c, rho * self._cos_lat0 * cos_c - y * self._sin_lat0 * sin_c)
+
+        lon = (self.origin_lon + np.degrees(dlon) + 180.0) % 360.0 - 180.0
+        lat = np.degrees(lat)
+        if xy.ndim == 1:
+            return float(lon), float(lat)
+        return lon, lat
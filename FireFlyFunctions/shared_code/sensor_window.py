@@ -0,0 +1,263 @@
+"""
+Sensor Window
+
+===================
+
+Sliding window over the coordinates of significant sensor readings, kept at module level so that it survives across
+warm invocations of a function.
+
+The first refresh (a cold start) runs the full query over the whole window. Every later refresh only asks Cosmos DB
+for documents at or after the `_ts` high-water mark of the previous refresh, evicts coordinates whose latest reading
+has fallen out of the window, and keeps the set of deduplicated coordinates up to date. The coordinates that entered
+or left the window are tracked as well, so that callers can skip work when nothing changed.
+
+Coordinates are aggregated in a SpatialGrid (see shared_code.spatial_grid). With a grid resolution, readings are
+quantized to the centers of their cells, so the window holds one coordinate per cell however many readings fall in
+it, and circles around those coordinates must be inflated by the grid's half diagonal to enclose every reading.
+
+Queries are expected to project only the fields the window needs, i.e. `SELECT r.id, r._ts, r.geometry.coordinates`
+plus any readings, and results are streamed page by page, so that at most one page of documents is held in memory no
+matter how many readings fall within the window. When a RuleEngine is given, each page is evaluated against the
+detection rules as one columnar batch, and only the readings indicating a fire are kept.
+
+Documents may also be pushed to the window as they are written, e.g. by a Cosmos DB change feed trigger. Pushed
+documents are full documents, which are projected the same way as query results, and are added whatever their `_ts`,
+since the change feed delivers each partition in its own order. Pushes move the high-water mark, so documents of
+partitions pushed to another instance would never be queried: `reconcile` queries again everything written since a
+given time, whatever the high-water mark.
+
+The window only relies on the `query_items` method of a Cosmos DB container client, so an in-memory stand-in with the
+same signature can be used in its place.
+"""
+
+from datetime import timedelta
+
+from .spatial_grid import SpatialGrid
+
+# Condition every window query filters on, which partition clauses are appended to
+TIME_CLAUSE = "r._ts >= @time"
+
+
+class SensorWindow:
+    """
+    Deduplicated coordinates of the sensor readings returned by `query_str` within the last `window`
+    """
+
+    def __init__(self, query_str: str, window: timedelta, page_size: int = 100, rules=None, partitions=None,
+                 resolution: float = None):
+        """
+        :param query_str: Cosmos DB SQL query, which must filter on `r._ts >= @time` and select `id`, `_ts` and
+            `coordinates`
+        :param window: length of the sliding window
+        :param page_size: maximum number of documents per page of query results
+        :param rules: optional RuleEngine deciding which of the returned readings indicate a fire. Without it, every
+            returned reading is kept
+        :param partitions: optional function of (since, now) returning the partition keys to query, which restricts
+            every query to those partitions with an `r.pk IN (...)` clause (see shared_code.document_layout), or None
+            to query every partition
+        :param resolution: optional grid resolution in decimal degrees. Without it, every distinct coordinate is kept
+        """
+        self.query_str = query_str
+        self.window_seconds = window.total_seconds()
+        self.page_size = page_size
+        self.rules = rules
+        self.partitions = partitions
+
+        # Latest `_ts` seen so far, and the ids of the documents with that exact `_ts`. The incremental query is
+        # inclusive of the high-water mark, since new documents may still arrive within the same second
+        self.high_water_mark = None
+        self._boundary_ids = set()
+
+        # Latest `_ts` and number of readings of each coordinate, or grid cell
+        self.grid = SpatialGrid(resolution)
+
+        # Coordinates that entered or left the window since the last call to `take_changes`
+        self._inserted = []
+        self._expired = []
+
+    @property
+    def is_cold(self) -> bool:
+        return self.high_water_mark is None
+
+    @property
+    def coordinates(self) -> list:
+        """
+        Deduplicated (x, y) coordinates, or grid cell centers, currently within the window
+        """
+        return list(map(tuple, self.grid.representatives.tolist()))
+
+    def __len__(self):
+        return len(self.grid)
+
+    def reset(self):
+        """
+        Forgets all cached readings, so that the next refresh runs the full query again
+        """
+        self.high_water_mark = None
+        self._boundary_ids = set()
+        self.grid.clear()
+        self._inserted = []
+        self._expired = []
+
+    def take_changes(self) -> tuple:
+        """
+        Returns the coordinates that entered and left the window since the last call, and starts tracking anew.
+        A coordinate that both entered and left in between is only reported where it currently stands
+        :return: tuple of (inserted, expired) lists of coordinates
+        """
+        inserted = [point for point in dict.fromkeys(self._inserted) if point in self.grid]
+        expired = [point for point in dict.fromkeys(self._expired) if point not in self.grid]
+        self._inserted, self._expired = [], []
+        return inserted, expired
+
+    def refresh(self, container, now: float, on_page=None) -> int:
+        """
+        Brings the window up to date with the given container
+        :param container: Cosmos DB container client, or any object with a matching `query_items` method
+        :param now: current time as a POSIX timestamp
+        :param on_page: optional callback, called with (page number, documents in page, bytes in page, request units
+            charged) after each page is consumed. Bytes and request units are None when the container does not report
+            them
+        :return: number of new documents retrieved
+        """
+        cutoff = now - self.window_seconds
+        since = cutoff if self.is_cold else max(self.high_water_mark, cutoff)
+
+        added = self.add_pages(self._pages(container, since, now, on_page))
+        if self.high_water_mark is None:
+            # Nothing was found, which still warms the window up: the next refresh starts where this one did
+            self.high_water_mark = since
+        self.evict(cutoff)
+        return added
+
+    def reconcile(self, container, since: float, now: float, on_page=None) -> int:
+        """
+        Adds every document written since `since`, including those older than the high-water mark. Documents already
+        in the window are added again, which leaves its coordinates unchanged
+        :param container: Cosmos DB container client, or any object with a matching `query_items` method
+        :param since: POSIX timestamp from which documents are queried
+        :param now: current time as a POSIX timestamp
+        :param on_page: optional callback, see `refresh`
+        :return: number of documents retrieved
+        """
+        cutoff = now - self.window_seconds
+        added = self.add_pages(self._pages(container, max(since, cutoff), now, on_page), skip_seen=False)
+        self.evict(cutoff)
+        return added
+
+    def _query(self, since: float, now: float) -> tuple:
+        """
+        Returns the query and its parameters for documents written since `since`
+        """
+        query, parameters = self.query_str, [{"name": "@time", "value": since}]
+        keys = self.partitions(since, now) if self.partitions is not None else None
+        if keys is not None:
+            names = ["@pk{}".format(i) for i in range(len(keys))]
+            query = query.replace(TIME_CLAUSE, "{} AND r.pk IN ({})".format(TIME_CLAUSE, ", ".join(names)), 1)
+            parameters += [{"name": name, "value": key} for name, key in zip(names, keys)]
+        return query, parameters
+
+    def _pages(self, container, since: float, now: float, on_page=None):
+        """
+        Yields query results one page at a time, as lists of documents
+        """
+        query, parameters = self._query(since, now)
+        results = container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True,
+                                         max_item_count=self.page_size)
+        pages = results.by_page() if hasattr(results, 'by_page') else [results]
+        for page_number, page in enumerate(pages):
+            page = list(page)
+            if on_page is not None:
+                headers = _last_response_headers(container)
+                on_page(page_number, len(page), _header_number(headers, 'Content-Length', int),
+                        _header_number(headers, 'x-ms-request-charge', float))
+            yield page
+
+    def add_documents(self, documents) -> int:
+        """
+        Adds query results to the window, skipping documents already seen at the high-water mark
+        :param documents: iterable of documents with `id`, `_ts` and `coordinates` keys
+        :return: number of new documents added
+        """
+        return self.add_pages([list(documents)])
+
+    def push(self, documents) -> int:
+        """
+        Adds full sensor documents as they are written, e.g. by the change feed, without checking them against the
+        high-water mark
+        :param documents: iterable of sensor documents laid out by shared_code.document_layout
+        :return: number of documents added
+        """
+        if self.rules is not None:
+            page = [self.rules.project(doc) for doc in documents]
+        else:
+            page = [{'id': doc.get('id'), '_ts': doc.get('_ts'),
+                     'coordinates': (doc.get('geometry') or {}).get('coordinates')} for doc in documents]
+        return self.add_pages([page], skip_seen=False)
+
+    def add_pages(self, pages, skip_seen: bool = True) -> int:
+        """
+        Adds pages of query results to the window, skipping documents already seen at the high-water mark
+        :param pages: iterable of lists of documents with `id`, `_ts` and `coordinates` keys
+        :param skip_seen: whether documents older than the high-water mark, or seen at it, are skipped
+        :return: number of new documents added
+        """
+        # Results are unordered, so documents are only compared against the mark of the previous refresh
+        prev_mark, prev_ids = self.high_water_mark, self._boundary_ids
+        mark, mark_ids = prev_mark, set(prev_ids)
+
+        added = 0
+        for page in pages:
+            points, timestamps = [], []
+            qualifies = self.rules.evaluate_documents(page) if self.rules is not None and page else None
+            for i, doc in enumerate(page):
+                try:
+                    ts, point_list = doc['_ts'], doc['coordinates']
+                except (KeyError, TypeError):
+                    continue
+                doc_id = doc.get('id')
+
+                if skip_seen and prev_mark is not None and (ts < prev_mark or (ts == prev_mark and doc_id in prev_ids)):
+                    continue
+                if mark is None or ts > mark:
+                    mark, mark_ids = ts, {doc_id}
+                elif ts == mark:
+                    mark_ids.add(doc_id)
+                added += 1
+
+                # Readings that do not indicate a fire still move the high-water mark, but are not kept
+                if qualifies is not None and not qualifies[i]:
+                    continue
+                points.append((point_list[0], point_list[1]))
+                timestamps.append(ts)
+            self._inserted.extend(self.grid.add(points, timestamps))
+
+        self.high_water_mark, self._boundary_ids = mark, mark_ids
+        return added
+
+    def evict(self, cutoff: float) -> int:
+        """
+        Removes every coordinate whose latest reading is older than `cutoff`
+        :param cutoff: POSIX timestamp marking the start of the window
+        :return: number of coordinates removed
+        """
+        expired = self.grid.evict(cutoff)
+        self._expired.extend(expired)
+        return len(expired)
+
+
+def _last_response_headers(container) -> dict:
+    """
+    Returns the headers of the last response received by a Cosmos DB container client, or an empty dict if unknown
+    """
+    return getattr(getattr(container, 'client_connection', None), 'last_response_headers', None) or {}
+
+
+def _header_number(headers: dict, name: str, convert):
+    """
+    Returns a numeric response header, looked up case-insensitively, or None if missing
+    """
+    value = headers.get(name)
+    if value is None:
+        value = headers.get(name.lower())
+    return convert(value) if value is not None else None
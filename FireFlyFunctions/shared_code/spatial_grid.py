@@ -0,0 +1,198 @@
+"""
+Spatial Grid
+
+===================
+
+Aggregates (lon, lat) points into the cells of a regular grid, so that the input of the clustering and of Welzl's
+Algorithm grows with the area a fire covers rather than with the number of readings. A stationary sensor reporting
+every few seconds, with a slightly different GPS fix each time, ends up as a single cell instead of hundreds of points.
+
+Points are quantized to cells of `resolution` decimal degrees, and each cell is represented by its center. Any point
+of a cell lies within half the cell's diagonal of its center, so a circle enclosing the representatives encloses every
+reading once its radius is inflated by `half_diagonal`. Without a resolution, every distinct point is its own cell and
+represents itself, as if no grid were used.
+
+Cells are stored in NumPy arrays: the representative, the number of readings and the latest `_ts` of each cell. Points
+are added in vectorized batches, e.g. one page of query results at a time, and eviction is a single pass over the
+latest timestamps, so only a dict from cell to array row is maintained in Python.
+"""
+
+import math
+
+import numpy as np
+
+from .projection import radii_of_curvature
+
+
+class SpatialGrid:
+    """
+    Cells of a regular (lon, lat) grid, with the number of readings and the latest timestamp of each
+    """
+
+    def __init__(self, resolution: float = None, capacity: int = 256):
+        """
+        :param resolution: size of a cell in decimal degrees, e.g. 1e-4 for cells of about 11 m. None or 0 keeps every
+            distinct point as its own cell
+        :param capacity: initial number of rows of the arrays, which double whenever they are full
+        """
+        self.resolution = resolution or None
+        self._rows = {}
+        self._size = 0
+        self._representatives = np.empty((capacity, 2))
+        self._counts = np.zeros(capacity, dtype=np.int64)
+        self._latest = np.empty(capacity)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, point):
+        return self._cell_keys(np.array([point], dtype=float))[0] in self._rows
+
+    @property
+    def representatives(self) -> np.ndarray:
+        """
+        (lon, lat) representative of every cell, as an (n, 2) array
+        """
+        return self._representatives[:self._size].copy()
+
+    @property
+    def counts(self) -> np.ndarray:
+        """
+        Number of readings of every cell since it was created, in the order of `representatives`
+        """
+        return self._counts[:self._size].copy()
+
+    @property
+    def latest(self) -> np.ndarray:
+        """
+        Latest timestamp of every cell, in the order of `representatives`
+        """
+        return self._latest[:self._size].copy()
+
+    def half_diagonal(self, latitude: float) -> float:
+        """
+        Returns the largest distance in metres between a point and the representative of its cell near `latitude`
+        """
+        if self.resolution is None:
+            return 0.0
+        meridian, prime_vertical = radii_of_curvature(latitude)
+        step = math.radians(self.resolution)
+        return 0.5 * math.hypot(step * prime_vertical * math.cos(math.radians(latitude)), step * meridian)
+
+    def quantize(self, points: np.ndarray) -> np.ndarray:
+        """
+        Returns the representatives of the cells of the given (lon, lat) points, as an (n, 2) array
+        """
+        points = np.asarray(points, dtype=float)
+        if self.resolution is None:
+            return points
+        return (np.floor(points / self.resolution) + 0.5) * self.resolution
+
+    def _cell_keys(self, points: np.ndarray) -> list:
+        """
+        Returns the hashable key of the cell of every (lon, lat) point
+        """
+        if self.resolution is None:
+            return list(map(tuple, points.tolist()))
+        return list(map(tuple, np.floor(points / self.resolution).astype(np.int64).tolist()))
+
+    def _grow(self, size: int):
+        capacity = len(self._latest)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        n = self._size
+        representatives = np.empty((capacity, 2))
+        counts, latest = np.zeros(capacity, dtype=np.int64), np.empty(capacity)
+        representatives[:n], counts[:n], latest[:n] = self._representatives[:n], self._counts[:n], self._latest[:n]
+        self._representatives, self._counts, self._latest = representatives, counts, latest
+
+    def add(self, points, timestamps) -> list:
+        """
+        Adds readings to their cells, creating the cells not seen before
+        :param points: (n, 2) array-like of (lon, lat) points
+        :param timestamps: n timestamps of the readings
+        :return: list of (lon, lat) representatives of the cells created
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        timestamps = np.asarray(timestamps, dtype=float).reshape(-1)
+        if not len(points):
+            return []
+
+        # One lookup per distinct cell of the batch, not per reading
+        distinct, first, inverse = {}, [], []
+        for i, key in enumerate(self._cell_keys(points)):
+            j = distinct.get(key)
+            if j is None:
+                j = distinct[key] = len(first)
+                first.append(i)
+            inverse.append(j)
+        cell_keys, first, inverse = list(distinct), np.array(first), np.array(inverse)
+
+        rows = np.empty(len(cell_keys), dtype=np.int64)
+        created = []
+        for i, key in enumerate(cell_keys):
+            row = self._rows.get(key)
+            if row is None:
+                row = self._rows[key] = self._size + len(created)
+                created.append(i)
+            rows[i] = row
+
+        if created:
+            self._grow(self._size + len(created))
+            new_rows = rows[created]
+            self._representatives[new_rows] = self.quantize(points[first[created]])
+            self._counts[new_rows] = 0
+            self._latest[new_rows] = -np.inf
+            self._size += len(created)
+
+        point_rows = rows[inverse]
+        np.add.at(self._counts, point_rows, 1)
+        np.maximum.at(self._latest, point_rows, timestamps)
+        return list(map(tuple, self._representatives[rows[created]].tolist()))
+
+    def evict(self, cutoff: float) -> list:
+        """
+        Removes every cell whose latest reading is older than `cutoff`
+        :param cutoff: POSIX timestamp marking the start of the window
+        :return: list of (lon, lat) representatives of the cells removed
+        """
+        n = self._size
+        stale = self._latest[:n] < cutoff
+        if not stale.any():
+            return []
+
+        removed = list(map(tuple, self._representatives[:n][stale].tolist()))
+        keep = np.nonzero(~stale)[0]
+        m = len(keep)
+        self._representatives[:m] = self._representatives[keep]
+        self._counts[:m] = self._counts[keep]
+        self._latest[:m] = self._latest[keep]
+        self._size = m
+        self._rows = dict(zip(self._cell_keys(self._representatives[:m]), range(m)))
+        return removed
+
+    def clear(self):
+        self._rows = {}
+        self._size = 0
+
+
+if __name__ == '__main__':
+    import time
+
+    # Stationary sensors around a fire, each reporting many slightly different GPS fixes
+    rng = np.random.default_rng(0)
+    for num_readings in [10000, 100000, 1000000]:
+        sensors = rng.uniform([-71.2, 42.25], [-71.1, 42.35], size=(2000, 2))
+        points = sensors[rng.integers(0, len(sensors), num_readings)] + rng.normal(0, 1e-5, (num_readings, 2))
+        timestamps = np.arange(num_readings, dtype=float)
+
+        for resolution in [None, 1e-4, 1e-3]:
+            grid = SpatialGrid(resolution)
+            start = time.perf_counter()
+            for i in range(0, num_readings, 100):
+                grid.add(points[i:i + 100], timestamps[i:i + 100])
+            elapsed = time.perf_counter() - start
+            print("{:>8} readings, resolution {}: {} cells, {:.2f} us per reading, half diagonal {:.1f} m".format(
+                num_readings, resolution, len(grid), elapsed / num_readings * 1e6, grid.half_diagonal(42.3)))
@@ -0,0 +1,187 @@
+"""
+Telemetry
+
+===================
+
+Per-invocation spans, counters and histograms, emitted through `logging` as a single structured JSON record per
+invocation, so that Application Insights can aggregate percentiles per stage across invocations, e.g.
+
+    traces | where message startswith '{"telemetry"'
+           | extend t = parse_json(message)
+           | summarize percentiles(todouble(t.spans.query), 50, 99) by tostring(t.telemetry)
+
+Spans are timed on the monotonic `time.perf_counter` clock and reported in milliseconds. Every span or observation is
+kept in a histogram under its name, summarized as count, sum, min, max, p50 and p99 when emitted.
+
+Telemetry is enabled unless the `TelemetryEnabled` app setting is "false". When disabled, `create_telemetry` returns a
+NullTelemetry whose methods do nothing, and whose spans are one shared, stateless context manager, so calls can stay
+in hot loops at the cost of a method call.
+"""
+
+import json
+import logging
+import os
+import time
+
+TELEMETRY_ENABLED = os.getenv('TelemetryEnabled', 'true').lower() not in ('false', '0', 'no')
+
+LOGGER = logging.getLogger('telemetry')
+LOGGER.setLevel(logging.INFO)
+
+
+class Span:
+    """
+    Context manager timing one stage into a histogram of its Telemetry
+    """
+    __slots__ = ('telemetry', 'name', 'start')
+
+    def __init__(self, telemetry, name: str):
+        self.telemetry = telemetry
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.telemetry.spans.setdefault(self.name, []).append((time.perf_counter() - self.start) * 1e3)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _percentile(ordered: list, q: float) -> float:
+    """
+    Returns the `q` quantile of a sorted list, with linear interpolation
+    """
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values: list) -> dict:
+    """
+    Summarizes a histogram
+    :param values: observed values
+    :return: dictionary of count, sum, min, max, p50 and p99, or the value itself if it was observed once
+    """
+    if len(values) == 1:
+        return values[0]
+    ordered = sorted(values)
+    return {'count': len(ordered), 'sum': sum(ordered), 'min': ordered[0], 'max': ordered[-1],
+            'p50': _percentile(ordered, 0.5), 'p99': _percentile(ordered, 0.99)}
+
+
+class Telemetry:
+    """
+    Spans, counters and histograms of one function, reset every time they are emitted
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: name reported with every record, usually the function name
+        """
+        self.name = name
+        self.spans = {}
+        self.counters = {}
+        self.histograms = {}
+
+    def span(self, name: str) -> Span:
+        """
+        Returns a context manager timing the enclosed stage in milliseconds
+        """
+        return Span(self, name)
+
+    def count(self, name: str, value=1):
+        """
+        Adds `value` to a counter
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value):
+        """
+        Adds a value to a histogram
+        """
+        self.histograms.setdefault(name, []).append(value)
+
+    def record(self) -> dict:
+        """
+        Returns everything recorded since the last reset, as a JSON-serializable dictionary
+        """
+        return {'telemetry': self.name,
+                'spans': {name: summarize(values) for name, values in self.spans.items()},
+                'counters': dict(self.counters),
+                'histograms': {name: summarize(values) for name, values in self.histograms.items()}}
+
+    def reset(self):
+        self.spans, self.counters, self.histograms = {}, {}, {}
+
+    def emit(self, **dimensions) -> dict:
+        """
+        Logs everything recorded since the last reset as one JSON record, then resets
+        :param dimensions: additional JSON-serializable fields of the record, e.g. an invocation id
+        :return: the emitted record
+        """
+        record = self.record()
+        record.update(dimensions)
+        LOGGER.info(json.dumps(record, default=str))
+        self.reset()
+        return record
+
+
+class NullTelemetry(Telemetry):
+    """
+    Telemetry that records nothing
+    """
+
+    def span(self, name: str):
+        return _NULL_SPAN
+
+    def count(self, name: str, value=1):
+        pass
+
+    def observe(self, name: str, value):
+        pass
+
+    def emit(self, **dimensions) -> dict:
+        return {}
+
+
+def create_telemetry(name: str, enabled: bool = None) -> Telemetry:
+    """
+    Creates the telemetry of a function
+    :param name: name reported with every record, usually the function name
+    :param enabled: whether anything is recorded, defaults to the `TelemetryEnabled` app setting
+    :return: Telemetry, or NullTelemetry when disabled
+    """
+    if enabled is None:
+        enabled = TELEMETRY_ENABLED
+    return Telemetry(name) if enabled else NullTelemetry(name)
+
+
+if __name__ == '__main__':
+    # Cost of instrumenting a hot loop, enabled and disabled
+    logging.basicConfig(level=logging.INFO)
+    for telemetry in [create_telemetry('enabled', True), create_telemetry('disabled', False)]:
+        iterations = 200000
+        start = time.perf_counter()
+        for i in range(iterations):
+            with telemetry.span('decode'):
+                pass
+            telemetry.count('accepted')
+        elapsed = time.perf_counter() - start
+        print("{:>8}: {:.3f} us per span + count".format(telemetry.name, elapsed / iterations * 1e6))
+        telemetry.reset()
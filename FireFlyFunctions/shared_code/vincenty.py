@@ -20,7 +20,10 @@ THIS IS PUBLICLY AVAILABLE CODE, ORIGINALLY WRITTEN BY THE U.S. GEOLOGICAL SURVE
 # -------------------------------------------------------------------------------
 import math
 
+import numpy as np
+
 FLATTENING = 1 / 298.257223563
+SEMI_MAJOR_AXIS = 6378137.0  # metres
 
 
 EPSILON = 1.0e-9
@@ -112,6 +115,155 @@ def vincentyDirect_kennedy(latitude1, longitude1, alpha1To2, s):
     # END of Vincenty's Direct formulae
 
 
+# -------------------------------------------------------------------------------
+# Vectorized Vincenty's Direct and Inverse formulae				|
+# Same formulae as above, evaluated with NumPy over whole arrays of points.	|
+# Every element iterates until it converges, and converged elements are	|
+# masked out of later iterations. Elements that fail to converge within	|
+# `max_iterations`, which only happens for nearly antipodal points in the	|
+# inverse formula, are returned as NaN.						|
+# -------------------------------------------------------------------------------
+
+def vincenty_direct_batch(lat, lon, azimuths, distances, max_iterations=200):
+    """
+    Vectorized version of `vincentyDirect_kennedy`. Arguments are broadcast against each other, so a single center can
+    be projected along many azimuths and distances at once
+    :param lat: latitudes of the reference points in decimal degrees
+    :param lon: longitudes of the reference points in decimal degrees
+    :param azimuths: geodetic azimuths to the projected points in decimal degrees
+    :param distances: ellipsoidal distances to the projected points in metres
+    :param max_iterations: maximum number of iterations for any element
+    :return: tuple of arrays ( latitude2, longitude2, alpha2To1 ) in decimal degrees
+    """
+    f, a = FLATTENING, SEMI_MAJOR_AXIS
+    b = a * (1.0 - f)
+    lat, lon, azimuths, distances = np.broadcast_arrays(*(np.asarray(x, dtype=float)
+                                                          for x in (lat, lon, azimuths, distances)))
+    shape = lat.shape
+    lat, lon, azimuths, distances = lat.ravel(), lon.ravel(), azimuths.ravel(), distances.ravel()
+
+    latitude1 = np.radians(lat)
+    alpha1To2 = np.radians(azimuths) % (2 * np.pi)
+
+    TanU1 = (1 - f) * np.tan(latitude1)
+    U1 = np.arctan(TanU1)
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sin_alpha1, cos_alpha1 = np.sin(alpha1To2), np.cos(alpha1To2)
+    sigma1 = np.arctan2(TanU1, cos_alpha1)
+    Sinalpha = cosU1 * sin_alpha1
+    cosalpha_sq = 1.0 - Sinalpha * Sinalpha
+
+    u2 = cosalpha_sq * (a * a - b * b) / (b * b)
+    A = 1.0 + (u2 / 16384) * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = (u2 / 1024) * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+
+    # Starting with the approximation
+    sigma0 = distances / (b * A)
+    sigma = sigma0.copy()
+    two_sigma_m = 2 * sigma1 + np.where(sigma > EPSILON, sigma, 0.0)
+
+    active = sigma > EPSILON
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        s, tsm, Ba = sigma[active], 2 * sigma1[active] + sigma[active], B[active]
+        cos_tsm, sin_s = np.cos(tsm), np.sin(s)
+        delta_sigma = Ba * sin_s * (cos_tsm + (Ba / 4) * (np.cos(s) * (-1 + 2 * cos_tsm ** 2 - (Ba / 6) * cos_tsm * (
+            -3 + 4 * sin_s ** 2) * (-3 + 4 * cos_tsm ** 2))))
+        new_sigma = sigma0[active] + delta_sigma
+        two_sigma_m[active] = tsm
+        sigma[active] = new_sigma
+        active[active] = np.abs((s - new_sigma) / new_sigma) > EPSILON
+
+    sin_sigma, cos_sigma = np.sin(sigma), np.cos(sigma)
+    cos_tsm = np.cos(two_sigma_m)
+
+    latitude2 = np.arctan2(sinU1 * cos_sigma + cosU1 * sin_sigma * cos_alpha1,
+                           (1 - f) * np.sqrt(Sinalpha ** 2 + (sinU1 * sin_sigma - cosU1 * cos_sigma * cos_alpha1) ** 2))
+
+    lembda = np.arctan2(sin_sigma * sin_alpha1, cosU1 * cos_sigma - sinU1 * sin_sigma * cos_alpha1)
+
+    C = (f / 16) * cosalpha_sq * (4 + f * (4 - 3 * cosalpha_sq))
+
+    omega = lembda - (1 - C) * f * Sinalpha * (sigma + C * sin_sigma * (cos_tsm + C * cos_sigma * (-1 + 2 * cos_tsm ** 2)))
+
+    longitude2 = np.radians(lon) + omega
+
+    alpha21 = np.arctan2(Sinalpha, -sinU1 * sin_sigma + cosU1 * cos_sigma * cos_alpha1)
+    alpha21 = (alpha21 + np.pi) % (2 * np.pi)
+
+    latitude2, longitude2, alpha21 = np.degrees(latitude2), np.degrees(longitude2), np.degrees(alpha21)
+    if active.any():
+        latitude2[active], longitude2[active], alpha21[active] = np.nan, np.nan, np.nan
+    return latitude2.reshape(shape), longitude2.reshape(shape), alpha21.reshape(shape)
+
+
+def vincenty_inverse_batch(lat1, lon1, lat2, lon2, max_iterations=200):
+    """
+    Vectorized Vincenty's Inverse formula. Arguments are broadcast against each other
+    :param lat1: latitudes of the first points in decimal degrees
+    :param lon1: longitudes of the first points in decimal degrees
+    :param lat2: latitudes of the second points in decimal degrees
+    :param lon2: longitudes of the second points in decimal degrees
+    :param max_iterations: maximum number of iterations for any element
+    :return: tuple of arrays ( distance in metres, alpha1To2, alpha2To1 ) with azimuths in decimal degrees.
+        Elements that did not converge, i.e. nearly antipodal pairs, are NaN
+    """
+    f, a = FLATTENING, SEMI_MAJOR_AXIS
+    b = a * (1.0 - f)
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (lat1, lon1, lat2, lon2)))
+    shape = lat1.shape
+    lat1, lon1, lat2, lon2 = lat1.ravel(), lon1.ravel(), lat2.ravel(), lon2.ravel()
+
+    L = np.radians(lon2 - lon1)
+    U1, U2 = np.arctan((1 - f) * np.tan(np.radians(lat1))), np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sinU1, cosU1, sinU2, cosU2 = np.sin(U1), np.cos(U1), np.sin(U2), np.cos(U2)
+
+    lembda = L.copy()
+    sin_sigma, cos_sigma, sigma = np.zeros(L.shape), np.ones(L.shape), np.zeros(L.shape)
+    cosalpha_sq, cos_tsm = np.ones(L.shape), np.zeros(L.shape)
+
+    active = np.ones(L.shape, dtype=bool)
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        lam = lembda[active]
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        cU1, sU1, cU2, sU2 = cosU1[active], sinU1[active], cosU2[active], sinU2[active]
+
+        ss = np.sqrt((cU2 * sin_lam) ** 2 + (cU1 * sU2 - sU1 * cU2 * cos_lam) ** 2)
+        cs = sU1 * sU2 + cU1 * cU2 * cos_lam
+        sg = np.arctan2(ss, cs)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Coincident points have sin(sigma) = 0, and lines along the equator have cos^2(alpha) = 0
+            sin_alpha = np.where(ss != 0, cU1 * cU2 * sin_lam / ss, 0.0)
+            ca2 = 1 - sin_alpha ** 2
+            ctsm = np.where(ca2 != 0, cs - 2 * sU1 * sU2 / ca2, 0.0)
+        C = (f / 16) * ca2 * (4 + f * (4 - 3 * ca2))
+        new_lam = L[active] + (1 - C) * f * sin_alpha * (sg + C * ss * (ctsm + C * cs * (-1 + 2 * ctsm ** 2)))
+
+        sin_sigma[active], cos_sigma[active], sigma[active] = ss, cs, sg
+        cosalpha_sq[active], cos_tsm[active] = ca2, ctsm
+        lembda[active] = new_lam
+        active[active] = np.abs(new_lam - lam) > 1e-12
+
+    u2 = cosalpha_sq * (a * a - b * b) / (b * b)
+    A = 1.0 + (u2 / 16384) * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = (u2 / 1024) * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_tsm + (B / 4) * (cos_sigma * (-1 + 2 * cos_tsm ** 2) - (B / 6) * cos_tsm * (
+        -3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_tsm ** 2)))
+    distances = b * A * (sigma - delta_sigma)
+
+    sin_lam, cos_lam = np.sin(lembda), np.cos(lembda)
+    alpha12 = np.arctan2(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam) % (2 * np.pi)
+    alpha21 = (np.arctan2(cosU1 * sin_lam, -sinU1 * cosU2 + cosU1 * sinU2 * cos_lam) + np.pi) % (2 * np.pi)
+
+    alpha12, alpha21 = np.degrees(alpha12), np.degrees(alpha21)
+    if active.any():
+        distances[active], alpha12[active], alpha21[active] = np.nan, np.nan, np.nan
+    return distances.reshape(shape), alpha12.reshape(shape), alpha21.reshape(shape)
+
+
 if __name__ == '__main__':
     print("Testing Vincenty's Direct Formula")
 
@@ -139,3 +291,35 @@ if __name__ == '__main__':
 
     print(lat, lon, a)
     print(buninyong_lat, buninyong_long, expected_return_bearing)
+
+    lats, lons, azs = vincenty_direct_batch(flinders_lat, flinders_long, [bearing], [dist])
+    distances, forward, reverse = vincenty_inverse_batch(flinders_lat, flinders_long, buninyong_lat, buninyong_long)
+    print("Direct (batch):  ", lats[0], lons[0], azs[0])
+    print("Inverse (batch): ", distances, forward, reverse)
+    print("Expected:        ", dist, bearing, expected_return_bearing)
+    assert abs(lats[0] - buninyong_lat) < 1e-8 and abs(lons[0] - buninyong_long) < 1e-8
+    assert abs(distances - dist) < 1e-3 and abs(forward - bearing) < 1e-5
+
+    import time
+    rng = np.random.default_rng(0)
+    for count in [100, 10000, 100000]:
+        lat1, lon1 = rng.uniform(-80, 80, count), rng.uniform(-180, 180, count)
+        azimuths, distances = rng.uniform(0, 360, count), rng.uniform(0, 100000, count)
+
+        start = time.perf_counter()
+        scalar = [vincentyDirect_kennedy(*args) for args in zip(lat1, lon1, azimuths, distances)]
+        scalar_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        lat2, lon2, _ = vincenty_direct_batch(lat1, lon1, azimuths, distances)
+        batch_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        inverse_distances, _, _ = vincenty_inverse_batch(lat1, lon1, lat2, lon2)
+        inverse_time = time.perf_counter() - start
+
+        error = np.max(np.abs(lat2 - np.array([p[0] for p in scalar])))
+        round_trip = np.nanmax(np.abs(inverse_distances - distances))
+        print("{:>8} points: scalar {:.4f}s, direct batch {:.4f}s ({:.0f}x), inverse batch {:.4f}s, "
+              "max difference {:.2e} deg, round trip error {:.2e} m".format(
+                  count, scalar_time, batch_time, scalar_time / batch_time, inverse_time, error, round_trip))
@@ -13,10 +13,24 @@ must change latitude and longitude to Latitude:  1 deg = 110.54 km
 Longitude: 1 deg = 111.320*cos(latitude) km before calculation of circle
 need to get data from file --> How on python?
 connect data to map how
+
+`welzl` runs GaertnerSolver, a non-recursive version of the move-to-front algorithm with pivoting, which keeps the
+boundary in preallocated buffers and scans for outside points with vectorized NumPy operations. The original recursive
+implementation is kept as `welzl_recursive`, as a reference for the benchmark in the `__main__` block, which is run
+with `python -m shared_code.welzl [max points]` from the FireFlyFunctions directory.
+
+Planar points, the common case, go to CircleSolver instead: the enclosing circle only depends on the convex hull
+vertices, so the points are reduced to those first, and the circle of the few vertices left is solved exactly.
+
+Both solvers report how their solve went on the NSphere they return: the number of iterations, the residual excess,
+i.e. the largest squared distance by which a point lies outside the sphere, and whether the solve converged, i.e.
+stopped before running out of iterations with an excess within EXCESS_TOLERANCE of the square radius.
 """
 
 import numpy as np
 
+from .convex_hull import convex_hull
+
 
 class ProjectorStack:
     """
@@ -86,10 +100,15 @@ def pop(bound):
 
 
 class NSphere:
-    def __init__(self, c, sqr):
+    def __init__(self, c, sqr, iterations=0, excess=0.0, converged=True):
         self.center = np.array(c)
         self.sqradius = sqr
 
+        # Diagnostics of the solve that found the sphere
+        self.iterations = iterations
+        self.excess = excess
+        self.converged = converged
+
 
 def is_inside(pt, nsphere, atol=1e-6, rtol=0.0):
     r2, R2 = sqdist(pt, nsphere.center), nsphere.sqradius
@@ -158,7 +177,286 @@ def find_max_excess(nsphere, pts, k1):
     return err_max, k_max - 1
 
 
+# Squared distance by which a point may lie outside a sphere and still count as inside, as in `is_inside`
+INSIDE_TOLERANCE = 1e-12
+
+# Number of points checked at once when scanning for a point outside the current sphere
+SCAN_CHUNK = 64
+
+# Residual excess, relative to the square radius, up to which a solve counts as converged
+EXCESS_TOLERANCE = 1e-9
+
+
+def _converged(excess: float, sqradius: float) -> bool:
+    return bool(excess <= EXCESS_TOLERANCE * max(sqradius, 1.0) + INSIDE_TOLERANCE)
+
+
+class GaertnerSolver:
+    """
+    Move-to-front solver with pivoting, using an explicit stack instead of recursion.
+    The boundary never holds more than d + 1 points, so its centers, square radii and orthonormal projector basis are
+    kept in fixed-size buffers
+    """
+
+    def __init__(self, points):
+        self.pts = np.array(points, dtype=float)
+        if self.pts.ndim != 2:
+            self.pts = self.pts.reshape(len(self.pts), -1)
+        self.dim = self.pts.shape[1]
+
+        # Boundary state: m points, with the sphere through the first i + 1 of them at centers[i], square_radii[i]
+        self.m = 0
+        self.centers = np.empty((self.dim + 1, self.dim))
+        self.square_radii = np.empty(self.dim + 1)
+        self.basis = np.empty((self.dim, self.dim))
+
+        # Current sphere, which is left as is when the boundary is popped
+        self.center = np.full(self.dim, np.nan)
+        self.sqradius = 0.0
+
+        # Index of the first point after the support set found by the last move-to-front pass
+        self.support_end = 0
+
+        # Number of pivoting iterations run by the last solve
+        self.iterations = 0
+
+    def push(self, pt) -> bool:
+        """
+        Adds `pt` to the boundary if it is affinely independent of the boundary points, and updates the current sphere
+        :return: True if the point was added
+        """
+        m = self.m
+        if m == 0:
+            self.centers[0] = pt
+            self.square_radii[0] = 0.0
+        else:
+            q0, center, r2 = self.centers[0], self.centers[m - 1], self.square_radii[m - 1]
+            qm = pt - q0
+            basis = self.basis[:m - 1]
+            residue = qm - basis.T.dot(basis.dot(qm))
+            offset = pt - center
+            e = offset.dot(offset) - r2
+            z = 2 * residue.dot(residue)
+            if not np.abs(z) > np.finfo(float).eps * max(r2, 1.0):
+                return False
+            self.centers[m] = center + (e / z) * residue
+            self.square_radii[m] = r2 + (e * e) / (2 * z)
+            self.basis[m - 1] = residue / np.sqrt(residue.dot(residue))
+        self.center = self.centers[m].copy()
+        self.sqradius = self.square_radii[m]
+        self.m = m + 1
+        return True
+
+    def pop(self):
+        self.m -= 1
+
+    def is_full(self) -> bool:
+        return self.m == self.dim + 1
+
+    def move_to_front(self, j):
+        """
+        Moves the point at index `j` to the front, shifting the points before it back by one
+        """
+        if self.support_end <= j:
+            self.support_end += 1
+        pt = self.pts[j].copy()
+        self.pts[1:j + 1] = self.pts[:j]
+        self.pts[0] = pt
+
+    def first_outside(self, start, end) -> int:
+        """
+        Returns the index of the first point in [start, end) outside the current sphere, or -1 if there is none.
+        Points are checked in growing chunks, so that an early hit does not cost a scan of every point
+        """
+        chunk = SCAN_CHUNK
+        while start < end:
+            stop = min(end, start + chunk)
+            offsets = self.pts[start:stop] - self.center
+            sqdists = np.einsum('ij,ij->i', offsets, offsets)
+            # An empty boundary has a NaN center, which leaves every point outside
+            outside = ~(sqdists <= self.sqradius + INSIDE_TOLERANCE)
+            if outside.any():
+                return start + int(np.argmax(outside))
+            start, chunk = stop, chunk * 2
+        return -1
+
+    def move_to_front_pass(self, end):
+        """
+        Finds the smallest sphere enclosing the first `end` points with the current boundary on its surface
+        """
+        self.support_end = 0
+        if self.is_full():
+            return
+        # Each frame is [end, next index to check, index of the point the frame pushed or -1]
+        frames = [[end, 0, -1]]
+        while frames:
+            frame = frames[-1]
+            frame_end, k, pushed = frame
+            if pushed >= 0:
+                # Back from the pass over the points before `pushed`
+                self.pop()
+                self.move_to_front(pushed)
+                frame[2] = -1
+
+            j = self.first_outside(k, frame_end)
+            if j < 0:
+                frames.pop()
+                continue
+            frame[1] = j + 1
+            if self.push(self.pts[j]):
+                frame[2] = j
+                self.support_end = 0
+                if not self.is_full():
+                    frames.append([j, 0, -1])
+
+    def max_excess(self, start):
+        """
+        Returns (excess, index) of the point from `start` onwards that lies furthest outside the current sphere
+        """
+        if start >= len(self.pts):
+            return -np.inf, start
+        offsets = self.pts[start:] - self.center
+        excess = np.einsum('ij,ij->i', offsets, offsets) - self.sqradius
+        k = int(np.argmax(excess))
+        return excess[k], start + k
+
+    def solve(self, maxiterations=2000):
+        """
+        Runs move-to-front passes, each time pivoting on the point furthest outside the current sphere
+        :return: NSphere enclosing all points, unless it did not converge within `maxiterations`
+        """
+        if len(self.pts) == 0:
+            self.iterations = 0
+            return NSphere(self.center, 0.0)
+
+        eps = np.finfo(float).eps
+        t = 1
+        self.move_to_front_pass(t)
+        self.iterations = 0
+        exhausted = True
+        for i in range(maxiterations):
+            self.iterations = i + 1
+            e, k = self.max_excess(t)
+            if e <= eps:
+                exhausted = False
+                break
+            t = self.support_end
+            if t == k:
+                t += 1
+            old_sqradius = self.sqradius
+            self.push(self.pts[k])
+            self.move_to_front_pass(self.support_end)
+            self.pop()
+            if t < k:
+                t += 1
+            self.move_to_front(k)
+            # Rounding may keep the sphere from growing any further, which only ends the solve once every point is
+            # inside within tolerance: on cospherical points the center still moves while the radius stays the same
+            if not self.sqradius > old_sqradius and _converged(self.max_excess(0)[0], self.sqradius):
+                exhausted = False
+                break
+        excess, _ = self.max_excess(0)
+        return NSphere(self.center, self.sqradius, self.iterations, float(excess),
+                       not exhausted and _converged(excess, self.sqradius))
+
+
+# Seed of the order the 2D solver visits hull vertices in, fixed so that solves are reproducible
+CIRCLE_SEED = 0
+
+
+def _circumcircle(a: list, b: list, c: list) -> tuple:
+    """
+    Returns (center x, center y, square radius) of the circle through three points, or of the smallest circle enclosing
+    them when they are collinear
+    """
+    abx, aby, acx, acy = b[0] - a[0], b[1] - a[1], c[0] - a[0], c[1] - a[1]
+    ab2, ac2 = abx * abx + aby * aby, acx * acx + acy * acy
+    d = 2 * (abx * acy - aby * acx)
+    if abs(d) <= np.finfo(float).eps * max(ab2, ac2):
+        # Collinear: the two points furthest apart span the circle
+        p, q = max([(a, b), (a, c), (b, c)], key=lambda pair: (pair[1][0] - pair[0][0]) ** 2 +
+                   (pair[1][1] - pair[0][1]) ** 2)
+        return _diametral_circle(p, q)
+    x, y = (acy * ab2 - aby * ac2) / d, (abx * ac2 - acx * ab2) / d
+    return a[0] + x, a[1] + y, x * x + y * y
+
+
+def _diametral_circle(a: list, b: list) -> tuple:
+    """
+    Returns (center x, center y, square radius) of the circle with diameter ab
+    """
+    return (a[0] + b[0]) / 2, (a[1] + b[1]) / 2, ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) / 4
+
+
+class CircleSolver:
+    """
+    Exact minimum enclosing circle of 2D points: the convex hull vertices are found first (see shared_code.convex_hull),
+    then Welzl's randomized incremental algorithm runs on them, with its recursion unrolled into three nested loops.
+    A hull has few vertices, so the loops work on Python floats rather than paying the overhead of NumPy calls
+    """
+
+    def __init__(self, points):
+        pts = np.array(points, dtype=float).reshape(-1, 2)
+        hull = pts[convex_hull(pts)] if len(pts) else pts
+        # Points are taken relative to the first one, which keeps the circumcircle arithmetic well conditioned
+        self.origin = hull[0].copy() if len(hull) else np.zeros(2)
+        self.pts = np.random.default_rng(CIRCLE_SEED).permutation(hull - self.origin)
+
+        self.center = np.full(2, np.nan)
+        self.sqradius = 0.0
+
+        # Number of times the circle was replaced by the last solve
+        self.iterations = 0
+
+    def solve(self, maxiterations=None):
+        """
+        :param maxiterations: ignored, since the solve is exact and always terminates. Accepted so that the solver can
+            stand in for GaertnerSolver
+        :return: NSphere enclosing all points. Its excess is measured over the hull vertices, which are the points
+            furthest from any center
+        """
+        pts, n = self.pts.tolist(), len(self.pts)
+        if n == 0:
+            self.iterations = 0
+            return NSphere(self.center, 0.0)
+
+        def outside(p, circle):
+            dx, dy = p[0] - circle[0], p[1] - circle[1]
+            return dx * dx + dy * dy > circle[2] * (1 + 1e-12) + INSIDE_TOLERANCE
+
+        circle, iterations = (pts[0][0], pts[0][1], 0.0), 1
+        for i in range(1, n):
+            if not outside(pts[i], circle):
+                continue
+            # Smallest circle through pts[i] enclosing pts[:i]
+            circle, iterations = (pts[i][0], pts[i][1], 0.0), iterations + 1
+            for j in range(i):
+                if not outside(pts[j], circle):
+                    continue
+                # Smallest circle through pts[i] and pts[j] enclosing pts[:j]
+                circle, iterations = _diametral_circle(pts[i], pts[j]), iterations + 1
+                for k in range(j):
+                    if outside(pts[k], circle):
+                        circle, iterations = _circumcircle(pts[i], pts[j], pts[k]), iterations + 1
+
+        self.iterations = iterations
+        self.center, self.sqradius = np.array(circle[:2]) + self.origin, circle[2]
+        excess = max((p[0] - circle[0]) ** 2 + (p[1] - circle[1]) ** 2 for p in pts) - circle[2]
+        return NSphere(self.center, self.sqradius, iterations, excess, _converged(excess, self.sqradius))
+
+
 def welzl(points, maxiterations=2000):
+    """
+    Returns the smallest NSphere enclosing the points. Planar points go to the exact CircleSolver, any other dimension
+    to GaertnerSolver. See the `iterations`, `excess` and `converged` attributes of the NSphere for how the solve went
+    """
+    pts = np.asarray(points, dtype=float)
+    if pts.ndim == 2 and pts.shape[1] == 2:
+        return CircleSolver(pts).solve()
+    return GaertnerSolver(points).solve(maxiterations)
+
+
+def welzl_recursive(points, maxiterations=2000):
     pts, eps = np.array(points, copy=True), np.finfo(float).eps
     bdry, t = GaertnerBoundary(pts), 1
     nsphere, s = welzl_helper(pts, t, bdry)
@@ -176,7 +474,41 @@ def welzl(points, maxiterations=2000):
     return nsphere
 
 
+def _check_against_reference(trials=400, seed=0):
+    """
+    Property check: on random inputs, including rounded ones full of duplicates and points all on one circle or sphere,
+    both implementations find the same enclosing sphere within tolerance, and every point lies inside it. Besides
+    `welzl`, GaertnerSolver is checked on planar points too, which `welzl` sends to CircleSolver. The recursive
+    reference itself may stop short of enclosing cospherical points, in which case the sphere they lie on bounds the
+    radius instead
+    """
+    rng = np.random.default_rng(seed)
+    for trial in range(trials):
+        n, d = int(rng.integers(1, 200)), int(rng.integers(2, 6))
+        pts, bound = rng.normal(size=(n, d)), None
+        if trial % 3 == 0:
+            pts = np.round(pts, 1)
+        elif trial % 3 == 1:
+            # Cospherical points, on a sphere of radius 1 to 1000 around a random center
+            radius = 10.0 ** rng.integers(0, 4)
+            pts, bound = radius * (pts / np.linalg.norm(pts, axis=1)[:, None] + rng.normal(size=d)), radius ** 2
+        reference = welzl_recursive(pts, n * 10)
+        scale = max(1.0, reference.sqradius)
+        encloses = np.sum((pts - reference.center) ** 2, axis=1).max() <= reference.sqradius + 1e-9 * scale
+        for fast in (welzl(pts, n * 10), GaertnerSolver(pts).solve(n * 10)):
+            assert fast.converged, (trial, n, d)
+            assert np.all(np.sum((pts - fast.center) ** 2, axis=1) <= fast.sqradius + 1e-9 * scale), (trial, n, d)
+            if encloses:
+                assert np.isclose(fast.sqradius, reference.sqradius, rtol=1e-9, atol=1e-9 * scale), (trial, n, d)
+                assert np.allclose(fast.center, reference.center, atol=1e-6 * np.sqrt(scale)), (trial, n, d)
+            else:
+                assert bound is not None and fast.sqradius <= bound * (1 + 1e-9), (trial, n, d)
+
+
 if __name__ == '__main__':
+    import sys
+    import time
+
     TESTDATA = [
         np.array([[-118.0, 24.0], [-119.0, 25.0], [-118.0, 26.0]]),
         np.array([[5.0, -2.0], [-3.0, -2.0], [-2.0, 5.0], [1.0, 6.0], [0.0, 2.0]]),
@@ -188,3 +520,44 @@ if __name__ == '__main__':
         print("For points: ", test)
         print("    Center is at: ", nsphere.center)
         print("    Radius is: ", np.sqrt(nsphere.sqradius), "\n")
+
+    _check_against_reference()
+    print("Property check passed: both implementations agree on random inputs\n")
+
+    # Dense planar clusters, as seen by parse_actuator_data, against the general solver
+    rng = np.random.default_rng(0)
+    for shape in ['normal', 'uniform disk']:
+        for count in [10000, 100000, 1000000]:
+            if shape == 'normal':
+                pts = rng.normal(scale=500, size=(count, 2))
+            else:
+                radii, angles = 500 * np.sqrt(rng.uniform(size=count)), rng.uniform(0, 2 * np.pi, count)
+                pts = np.column_stack([radii * np.cos(angles), radii * np.sin(angles)])
+            start = time.perf_counter()
+            general = GaertnerSolver(pts).solve(count * 10)
+            general_time = time.perf_counter() - start
+            start = time.perf_counter()
+            planar = welzl(pts)
+            planar_time = time.perf_counter() - start
+            assert np.isclose(planar.sqradius, general.sqradius, rtol=1e-9)
+            print("2D {:>12} {:>8} points: GaertnerSolver {:.4f}s, hull + CircleSolver {:.4f}s, speedup {:.1f}x".format(
+                shape, count, general_time, planar_time, general_time / planar_time))
+    print()
+
+    # The recursive implementation loops over points in Python, so it is only timed up to this many points
+    reference_limit = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rng = np.random.default_rng(0)
+    for dim in [2, 3, 5]:
+        for count in [10, 100, 1000, 10000, 100000, 1000000]:
+            pts = rng.normal(size=(count, dim))
+            start = time.perf_counter()
+            welzl(pts, count * 10)
+            fast = time.perf_counter() - start
+            if count <= reference_limit:
+                start = time.perf_counter()
+                welzl_recursive(pts, count * 10)
+                reference = time.perf_counter() - start
+                comparison = "recursive {:.4f}s, speedup {:.1f}x".format(reference, reference / fast)
+            else:
+                comparison = "recursive skipped"
+            print("{}D {:>8} points: solver {:.4f}s, {}".format(dim, count, fast, comparison))
@@ -0,0 +1,43 @@
+"""
+watch_sensor_changes
+a.k.a. Azure Function 3
+
+===================
+
+This function triggers when sensor documents are written to the 'sensors' Cosmos DB database, through its change
+feed, and does the work of parse_actuator_data as soon as readings arrive instead of polling for them:
+1. Add the new readings that meet the detection rules to the sensor window
+2. Estimate the boundary of every fire, and send out drones around fires whose boundary changed
+
+Both steps are shared with parse_actuator_data, along with the window and fire state, so the functions must run in the
+same function app. The function only acts when the `DetectionMode` app setting is "changefeed"; otherwise it returns
+right away, and may also be turned off with the `AzureWebJobs.watch_sensor_changes.Disabled` app setting. The lease
+container `leases` records how far the change feed was read, and is created in the sensors database if missing. On
+several instances, the leases spread the change feed's partitions across them, so readings pushed to another instance
+only reach this one when parse_actuator_data reconciles its window (see ChangeFeedReconcileInterval).
+"""
+
+from datetime import datetime
+
+import azure.functions as func
+
+from .. import parse_actuator_data as detection
+
+
+def to_dicts(documents) -> list:
+    """
+    Converts the documents delivered by the trigger into plain dicts
+    """
+    return [doc.to_dict() if hasattr(doc, 'to_dict') else dict(doc) for doc in documents]
+
+
+def main(documents: func.DocumentList):
+    if detection.DETECTION_MODE != detection.CHANGE_FEED or not documents:
+        return
+
+    detection.LOGGER.setLevel(detection.LEVEL)
+    with detection.DETECTION_LOCK:
+        try:
+            detection.on_sensor_documents(to_dicts(documents), datetime.timestamp(datetime.now()))
+        finally:
+            detection.TELEMETRY.emit(trigger='change_feed')
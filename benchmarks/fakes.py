@@ -0,0 +1,403 @@
+"""
+Local Stand-ins
+
+===================
+
+In-memory replacements for the Event Hub trigger, the Cosmos DB output bindings, containers and change feed, and the
+IoT Hub registry manager, so that the functions can be driven without any Azure service.
+
+InMemoryContainer evaluates the subset of Cosmos DB SQL that the function app emits:
+
+    SELECT r.a.b, r.c AS d, ... FROM data r WHERE <condition>
+
+where conditions combine comparisons (=, !=, <, <=, >, >=) and IN lists of property paths, numbers, strings, booleans
+and @parameters with AND, OR, NOT and parentheses. As in Cosmos DB, a comparison involving a missing property or
+values of different types is undefined, and only documents whose condition is true are returned. Projected properties
+that are missing are left out of the result.
+"""
+
+import bisect
+import re
+import time
+from datetime import datetime, timezone
+
+import azure.functions as func
+
+_TOKEN = re.compile(r"\s*(?:(?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)|(?P<string>'[^']*'|\"[^\"]*\")|"
+                    r"(?P<param>@\w+)|(?P<op>>=|<=|!=|<>|=|<|>|\(|\)|,)|(?P<name>[A-Za-z_][\w.]*))")
+
+_COMPARISONS = {
+    '=': lambda a, b: a == b, '!=': lambda a, b: a != b, '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b, '<=': lambda a, b: a <= b, '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+}
+
+
+def _tokenize(text: str) -> list:
+    tokens, position = [], 0
+    text = text.strip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError("Unsupported query syntax at: {!r}".format(text[position:position + 30]))
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+def _lookup(doc, path: list):
+    for key in path:
+        if not isinstance(doc, dict) or key not in doc:
+            return None
+        doc = doc[key]
+    return doc
+
+
+def _comparable(a, b) -> bool:
+    if a is None or b is None:
+        return False
+    numeric = (int, float)
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool)
+    return (isinstance(a, numeric) and isinstance(b, numeric)) or type(a) is type(b)
+
+
+def _either(a, b):
+    def evaluate(doc, params):
+        x, y = a(doc, params), b(doc, params)
+        if x is True or y is True:
+            return True
+        return False if x is False and y is False else None
+    return evaluate
+
+
+def _both(a, b):
+    def evaluate(doc, params):
+        x, y = a(doc, params), b(doc, params)
+        if x is False or y is False:
+            return False
+        return True if x is True and y is True else None
+    return evaluate
+
+
+def _negate(a):
+    def evaluate(doc, params):
+        x = a(doc, params)
+        return None if x is None else not x
+    return evaluate
+
+
+class _Parser:
+    """
+    Recursive descent parser compiling a WHERE condition into a function of (document, parameters), which returns
+    True, False or None when undefined
+    """
+
+    def __init__(self, tokens: list, alias: str):
+        self.tokens = tokens
+        self.position = 0
+        self.alias = alias
+
+    def peek(self, value=None):
+        if self.position >= len(self.tokens):
+            return None
+        kind, text = self.tokens[self.position]
+        if value is not None:
+            return text.upper() == value if kind == 'name' or kind == 'op' else False
+        return kind, text
+
+    def take(self, value=None):
+        token = self.peek()
+        if token is None or (value is not None and token[1].upper() != value):
+            raise ValueError("Expected {} in query".format(value or "a term"))
+        self.position += 1
+        return token
+
+    def condition(self):
+        left = self.conjunction()
+        while self.peek('OR'):
+            self.take('OR')
+            left = _either(left, self.conjunction())
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.peek('AND'):
+            self.take('AND')
+            left = _both(left, self.negation())
+        return left
+
+    def negation(self):
+        if self.peek('NOT'):
+            self.take('NOT')
+            return _negate(self.negation())
+        if self.peek('('):
+            self.take('(')
+            inner = self.condition()
+            self.take(')')
+            return inner
+        return self.comparison()
+
+    def operand(self):
+        kind, text = self.take()
+        if kind == 'number':
+            value = float(text) if any(c in text for c in '.eE') else int(text)
+            return lambda doc, params: value
+        if kind == 'string':
+            return lambda doc, params: text[1:-1]
+        if kind == 'param':
+            return lambda doc, params: params.get(text)
+        if kind == 'name' and text.lower() in ('true', 'false'):
+            value = text.lower() == 'true'
+            return lambda doc, params: value
+        if kind == 'name':
+            path = text.split('.')
+            if path[0] != self.alias:
+                raise ValueError("Unknown alias in {}".format(text))
+            return lambda doc, params: _lookup(doc, path[1:])
+        raise ValueError("Unexpected {} in query".format(text))
+
+    def comparison(self):
+        left = self.operand()
+        if self.peek('IN'):
+            self.take('IN')
+            self.take('(')
+            options = [self.operand()]
+            while self.peek(','):
+                self.take(',')
+                options.append(self.operand())
+            self.take(')')
+
+            def evaluate_in(doc, params):
+                value = left(doc, params)
+                return None if value is None else any(value == option(doc, params) for option in options)
+            return evaluate_in
+        _, op = self.take()
+        compare, right = _COMPARISONS[op], self.operand()
+
+        def evaluate(doc, params):
+            a, b = left(doc, params), right(doc, params)
+            return compare(a, b) if _comparable(a, b) else None
+        return evaluate
+
+
+def compile_query(query: str):
+    """
+    Compiles a query into a function of (document, parameters) returning the projected document, or None if the
+    document does not match
+    :return: tuple of (function, name of the parameter bounding `_ts` from below, or None). The bound is only
+        reported when the condition starts with `<alias>._ts >= @parameter AND`, so that it can be used as an index
+    """
+    match = re.match(r"\s*SELECT\s+(?P<fields>.+?)\s+FROM\s+\w+\s+(?P<alias>\w+)(?:\s+WHERE\s+(?P<where>.+))?\s*$",
+                     query, re.IGNORECASE | re.DOTALL)
+    if match is None:
+        raise ValueError("Unsupported query: {}".format(query))
+    alias = match.group('alias')
+
+    projections = []
+    for field in match.group('fields').split(','):
+        parts = field.strip().split()
+        path = parts[0].split('.')
+        if path[0] != alias:
+            raise ValueError("Unknown alias in {}".format(parts[0]))
+        name = parts[2] if len(parts) == 3 and parts[1].upper() == 'AS' else path[-1]
+        projections.append((name, path[1:]))
+
+    where, since = None, None
+    if match.group('where'):
+        parser = _Parser(_tokenize(match.group('where')), alias)
+        where = parser.condition()
+        if parser.position != len(parser.tokens):
+            raise ValueError("Unexpected trailing tokens in query: {}".format(query))
+        bound = re.match(r"\s*{}\._ts\s*>=\s*(@\w+)(\s+AND\s|\s*$)".format(alias), match.group('where'), re.IGNORECASE)
+        if bound is not None:
+            since = bound.group(1)
+
+    def run(doc, params):
+        if where is not None and where(doc, params) is not True:
+            return None
+        projected = {}
+        for name, path in projections:
+            value = _lookup(doc, path)
+            if value is not None:
+                projected[name] = value
+        return projected
+    return run, since
+
+
+class InMemoryContainer:
+    """
+    Stand-in for a Cosmos DB container client, holding documents by id and indexed by `_ts`
+    """
+
+    def __init__(self, documents=None):
+        self.items = {}
+        self.queries = 0
+        self.documents_scanned = 0
+        self.changes = []
+        self._order = []
+        self._compiled = {}
+        for doc in documents or []:
+            self.upsert_item(doc)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def documents(self) -> list:
+        """
+        Every document, in `_ts` order
+        """
+        return [self.items[doc_id] for _, doc_id in self._order]
+
+    def upsert_item(self, body: dict, ts: float = None) -> dict:
+        """
+        Writes a document, replacing any document with the same id, and stamps `_ts` with the given or current time
+        """
+        doc = dict(body)
+        doc.setdefault('id', str(len(self.items)))
+        doc['_ts'] = int(ts if ts is not None else doc.get('_ts', time.time()))
+        previous = self.items.get(doc['id'])
+        if previous is not None:
+            del self._order[bisect.bisect_left(self._order, (previous['_ts'], doc['id']))]
+        self.items[doc['id']] = doc
+        bisect.insort(self._order, (doc['_ts'], doc['id']))
+        self.changes.append(doc)
+        return doc
+
+    def query_items(self, query: str, parameters=None, **kwargs):
+        compiled = self._compiled.get(query)
+        if compiled is None:
+            compiled = self._compiled[query] = compile_query(query)
+        run, since = compiled
+        params = {p['name']: p['value'] for p in parameters or []}
+        first = 0
+        if since is not None and isinstance(params.get(since), (int, float)):
+            first = bisect.bisect_left(self._order, (params[since],))
+
+        self.queries += 1
+        self.documents_scanned += len(self._order) - first
+        results = []
+        for _, doc_id in self._order[first:]:
+            projected = run(self.items[doc_id], params)
+            if projected is not None:
+                results.append(projected)
+        return results
+
+    def read(self) -> dict:
+        return {'id': 'data'}
+
+
+class ChangeFeed:
+    """
+    Stand-in for the change feed of a container, as delivered to a cosmosDBTrigger: every document written since the
+    last read, in write order, in batches of at most `max_items`
+    """
+
+    def __init__(self, container: InMemoryContainer, max_items: int = 500):
+        self.container = container
+        self.max_items = max_items
+        self.position = len(container.changes)
+
+    def __len__(self):
+        return len(self.container.changes) - self.position
+
+    def read(self) -> list:
+        """
+        Returns the pending changes as a list of func.DocumentList batches, and moves past them
+        """
+        changes, self.position = self.container.changes[self.position:], len(self.container.changes)
+        return [func.DocumentList([func.Document.from_dict(doc) for doc in changes[i:i + self.max_items]])
+                for i in range(0, len(changes), self.max_items)]
+
+
+class Out:
+    """
+    Stand-in for a func.Out binding
+    """
+
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def documents(self) -> list:
+        """
+        Returns the documents written to the binding as plain dicts
+        """
+        if self.value is None:
+            return []
+        return [doc.to_dict() if hasattr(doc, 'to_dict') else dict(doc) for doc in self.value]
+
+
+def make_event(body: bytes, sequence_number: int = None, enqueued_ts: float = None) -> func.EventHubEvent:
+    """
+    Returns an event enqueued at the given POSIX timestamp, or now, as the Event Hub stamps every event
+    """
+    enqueued_time = datetime.fromtimestamp(enqueued_ts if enqueued_ts is not None else time.time(), timezone.utc)
+    return func.EventHubEvent(body=body, sequence_number=sequence_number, enqueued_time=enqueued_time)
+
+
+class Response:
+    def __init__(self, status: int = 200, payload=None):
+        self.status = status
+        self.payload = payload
+
+
+class DirectMethod:
+    """
+    Stand-in for the IoT Hub SDK's CloudToDeviceMethod
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class DeliveryError(Exception):
+    """
+    Stand-in for the IoT Hub client's transport and HTTP errors
+    """
+
+
+class FakeRegistryManager:
+    """
+    Stand-in for IoTHubRegistryManager, accepting every direct method after an optional delay. It takes DirectMethods,
+    see `install_dispatcher`
+    """
+
+    def __init__(self, latency: float = 0.0, refuse=()):
+        """
+        :param latency: seconds each direct method takes
+        :param refuse: device ids that refuse every mission
+        """
+        self.latency = latency
+        self.refuse = set(refuse)
+        self.invocations = []
+
+    def invoke_device_method(self, device_id, method):
+        if self.latency:
+            time.sleep(self.latency)
+        self.invocations.append((device_id, method))
+        if device_id in self.refuse:
+            return Response(409, {'accepted': False})
+        return Response(200, {'accepted': True})
+
+    def get_service_statistics(self):
+        return {'connectedDeviceCount': 0}
+
+
+def install_dispatcher(module, registry_manager):
+    """
+    Gives parse_actuator_data a dispatcher sending DirectMethods through a stand-in registry manager, so that missions
+    are delivered without the IoT Hub SDK. The dispatcher is kept as long as the registry manager is registered
+    :param module: the parse_actuator_data module
+    :param registry_manager: the registry manager registered with shared_code.connections
+    """
+    module.DISPATCHER = module.Dispatcher(registry_manager, module.METHOD_NAME, max_workers=module.DISPATCH_WORKERS,
+                                          timeout=module.DISPATCH_TIMEOUT, max_attempts=module.DISPATCH_ATTEMPTS,
+                                          fallback_device_id=module.DEVICE_ID, method_class=DirectMethod,
+                                          errors=(DeliveryError,))
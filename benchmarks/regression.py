@@ -0,0 +1,474 @@
+"""
+Geometry and Ingest Regression Suite
+
+===================
+
+Benchmarks the geometry core and the ingest helpers of shared_code on large and degenerate inputs, checks that every
+result is still correct, and compares throughput against a recorded baseline:
+- welzl: dense planar clusters of a million points, collinear points, cocircular and cospherical points, heavily
+  duplicated points and a single repeated point, in 2D (CircleSolver) and in higher dimensions (GaertnerSolver). Every
+  solve must report convergence, a residual excess within tolerance, and enclose every point. Tests of minimality
+  against `welzl_recursive` are in tests/test_welzl.py
+- vincenty: `vincentyDirect_kennedy` and `vincenty_direct_batch` over a global grid of positions, azimuths and distances
+  up to nearly half the globe, which must agree, and `vincenty_inverse_batch` on nearly antipodal pairs, where the
+  pairs it does not converge on must come back as NaN and the others must round trip through the direct formula
+- detection_rules: `evaluate_documents` on readings that are often missing, under rules mixing negations, "!=" and
+  "at_least". The documents the pushed down query returns must lead to the same detections as every document
+- shared_utils: `dict_to_str` and `is_device_sensor` on a large synthetic event corpus
+
+Each benchmark runs once to warm up, then `--repeat` times. Its throughput is the number of items it processes divided
+by its fastest run, as pytest-benchmark compares its minimum. Shared and throttled hosts change speed from one minute
+to the next, so a fixed calibration workload, half NumPy and half Python loops, is timed right before every benchmark,
+and throughputs are compared in items per calibration run rather than per second. A benchmark fails when its check
+fails. It regresses when its normalized throughput falls more than `--tolerance` below the baseline, plus the spread
+between its own fastest and slowest normalized runs, and only with at least 3 timed runs: otherwise it is reported as
+slower, without failing. Run from the repository root:
+
+    python benchmarks/regression.py [-k welzl] [--repeat 5] [--tolerance 0.3] [--json results.json]
+    python benchmarks/regression.py --update
+
+The baseline, benchmarks/regression_baseline.json by default, holds the throughput of every benchmark and the machine
+it was recorded on. `--update` records it again, which is only meaningful on the machine the suite is compared on. The
+exit status is 1 if any benchmark failed or regressed. This directory is not part of the deployed function app.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import geojson
+import numpy as np
+
+from fakes import InMemoryContainer
+from FireFlyFunctions.shared_code.detection_rules import RuleEngine
+from FireFlyFunctions.shared_code.event_decoder import _synthetic_corpus, decode_event, SENSOR
+from FireFlyFunctions.shared_code.shared_utils import dict_to_str, is_device_sensor, meets_device_format
+from FireFlyFunctions.shared_code.vincenty import vincentyDirect_kennedy, vincenty_direct_batch, vincenty_inverse_batch
+from FireFlyFunctions.shared_code.welzl import welzl
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'regression_baseline.json')
+
+# A benchmark: `run` is timed and processes `items` items. `check` is given the result of the last run, raises
+# AssertionError if it is wrong, and returns a dict of diagnostics to report
+Benchmark = namedtuple('Benchmark', ['run', 'items', 'check'])
+
+# Functions creating each benchmark, by name, in the order they run
+CASES = {}
+
+
+def case(name: str):
+    def register(make):
+        CASES[name] = make
+        return make
+    return register
+
+
+# -------------------------------------------------------------------------------
+# welzl
+# -------------------------------------------------------------------------------
+
+def _solve(points: np.ndarray, expected_sqradius: float = None, max_sqradius: float = None) -> Benchmark:
+    """
+    Benchmarks the enclosing sphere of `points`, optionally against a known square radius, or the square radius of a
+    sphere known to enclose them
+    """
+    def check(nsphere) -> dict:
+        scale = max(nsphere.sqradius, 1.0)
+        assert nsphere.converged, "did not converge after {} iterations".format(nsphere.iterations)
+        assert nsphere.excess <= 1e-9 * scale, "residual excess {}".format(nsphere.excess)
+        sqdists = np.einsum('ij,ij->i', points - nsphere.center, points - nsphere.center)
+        assert sqdists.max() <= nsphere.sqradius + 1e-9 * scale, "a point lies outside the sphere"
+        if expected_sqradius is not None:
+            assert np.isclose(nsphere.sqradius, expected_sqradius, rtol=1e-9, atol=1e-12), \
+                "square radius {}, expected {}".format(nsphere.sqradius, expected_sqradius)
+        if max_sqradius is not None:
+            assert nsphere.sqradius <= max_sqradius * (1 + 1e-9), \
+                "square radius {}, larger than {}".format(nsphere.sqradius, max_sqradius)
+        return {'iterations': nsphere.iterations, 'excess': float(nsphere.excess), 'radius': float(np.sqrt(
+            nsphere.sqradius))}
+
+    return Benchmark(lambda: welzl(points, maxiterations=len(points) * 10), len(points), check)
+
+
+@case('welzl.normal_2d')
+def _welzl_normal_2d():
+    return _solve(np.random.default_rng(0).normal(scale=500, size=(1000000, 2)))
+
+
+@case('welzl.uniform_disk_2d')
+def _welzl_uniform_disk_2d():
+    rng = np.random.default_rng(1)
+    radii, angles = 500 * np.sqrt(rng.uniform(size=1000000)), rng.uniform(0, 2 * np.pi, 1000000)
+    return _solve(np.column_stack([radii * np.cos(angles), radii * np.sin(angles)]))
+
+
+@case('welzl.collinear_2d')
+def _welzl_collinear_2d():
+    x = np.random.default_rng(2).uniform(-1000, 1000, 100000)
+    points = np.column_stack([x, 2 * x + 1])
+    return _solve(points, (np.ptp(x) ** 2 * 5) / 4)
+
+
+@case('welzl.duplicates_2d')
+def _welzl_duplicates_2d():
+    corners = np.array([[0.0, 0.0], [300.0, 0.0], [300.0, 400.0], [0.0, 400.0]])
+    return _solve(corners[np.random.default_rng(3).integers(0, 4, 100000)], 250.0 ** 2)
+
+
+@case('welzl.single_point_2d')
+def _welzl_single_point_2d():
+    return _solve(np.tile([[-71.1, 42.3]], (100000, 1)), 0.0)
+
+
+@case('welzl.collinear_3d')
+def _welzl_collinear_3d():
+    t = np.random.default_rng(4).uniform(-10, 10, 10000)
+    points = np.column_stack([t, -2 * t, 3 * t])
+    return _solve(points, np.ptp(t) ** 2 * 14 / 4)
+
+
+def _cospherical(seed: int, n: int, d: int, radius: float) -> tuple:
+    """
+    Returns `n` points on a sphere of `radius` around a random center, and its square radius
+    """
+    rng = np.random.default_rng(seed)
+    points = rng.normal(size=(n, d))
+    return radius * (points / np.linalg.norm(points, axis=1)[:, None] + rng.normal(size=d)), radius ** 2
+
+
+@case('welzl.cocircular_2d')
+def _welzl_cocircular_2d():
+    points, sqradius = _cospherical(7, 100000, 2, 1000.0)
+    return _solve(points, max_sqradius=sqradius)
+
+
+@case('welzl.cospherical_3d')
+def _welzl_cospherical_3d():
+    points, sqradius = _cospherical(8, 100000, 3, 1000.0)
+    return _solve(points, max_sqradius=sqradius)
+
+
+@case('welzl.duplicates_3d')
+def _welzl_duplicates_3d():
+    vertices = np.vstack([np.eye(3), -np.eye(3)])
+    return _solve(vertices[np.random.default_rng(5).integers(0, 6, 100000)], 1.0)
+
+
+@case('welzl.normal_5d')
+def _welzl_normal_5d():
+    return _solve(np.random.default_rng(6).normal(size=(100000, 5)))
+
+
+# -------------------------------------------------------------------------------
+# vincenty
+# -------------------------------------------------------------------------------
+
+def _global_grid(latitudes: int, longitudes: int, azimuths: int) -> tuple:
+    """
+    Returns flat arrays of (latitude, longitude, azimuth, distance) over the globe, with distances from 1 km to nearly
+    half the circumference
+    """
+    grid = np.meshgrid(np.linspace(-89, 89, latitudes), np.linspace(-180, 180, longitudes, endpoint=False),
+                       np.linspace(0, 360, azimuths, endpoint=False), [1e3, 1e5, 1e6, 1e7, 19.9e6, 20.0e6],
+                       indexing='ij')
+    return tuple(values.ravel() for values in grid)
+
+
+@case('vincenty.direct_scalar_global')
+def _vincenty_direct_scalar_global():
+    lat, lon, azimuth, distance = _global_grid(19, 12, 12)
+    arguments = list(zip(lat.tolist(), lon.tolist(), azimuth.tolist(), distance.tolist()))
+
+    def check(results) -> dict:
+        results = np.array(results)
+        assert np.isfinite(results).all(), "non-finite results"
+        lats, lons, azimuths = vincenty_direct_batch(lat, lon, azimuth, distance)
+        lon_error = np.abs((results[:, 1] - lons + 180) % 360 - 180)
+        error = max(np.abs(results[:, 0] - lats).max(), lon_error.max())
+        assert error < 1e-9, "scalar and batch disagree by {} degrees".format(error)
+        return {'max_difference_deg': float(error)}
+
+    return Benchmark(lambda: [vincentyDirect_kennedy(*a) for a in arguments], len(arguments), check)
+
+
+@case('vincenty.direct_batch_global')
+def _vincenty_direct_batch_global():
+    lat, lon, azimuth, distance = _global_grid(91, 72, 36)
+
+    def check(results) -> dict:
+        lats, lons, azimuths = results
+        assert np.isfinite(lats).all() and np.isfinite(lons).all(), "non-finite results"
+        assert np.abs(lats).max() <= 90, "latitude out of range"
+        # Short projections must come back to their origin through the inverse formula
+        short = distance <= 1e6
+        distances, _, _ = vincenty_inverse_batch(lat[short], lon[short], lats[short], lons[short])
+        error = np.nanmax(np.abs(distances - distance[short]))
+        assert error < 1e-3, "inverse distance off by {} m".format(error)
+        return {'max_round_trip_m': float(error)}
+
+    return Benchmark(lambda: vincenty_direct_batch(lat, lon, azimuth, distance), len(lat), check)
+
+
+@case('vincenty.inverse_near_antipodal')
+def _vincenty_inverse_near_antipodal():
+    # Each point against the points around its antipode, then against points well short of it, which must converge
+    lat1, offset = np.meshgrid(np.linspace(-60, 60, 200), np.concatenate([np.linspace(179, 180, 200),
+                                                                          np.linspace(90, 170, 50)]), indexing='ij')
+    lat1, offset = lat1.ravel(), offset.ravel()
+    lat2, lon2 = -lat1, offset
+
+    def check(results) -> dict:
+        distances, alpha12, _ = results
+        converged = np.isfinite(distances)
+        assert converged[offset <= 170].all(), "pairs far from antipodal did not converge"
+        assert (np.isnan(alpha12) == ~converged).all(), "partial results of pairs that did not converge"
+        assert distances[converged].max() < 20003932, "distance longer than half a meridian"
+        lats, lons, _ = vincenty_direct_batch(lat1[converged], 0.0, alpha12[converged], distances[converged])
+        lon_error = np.abs((lons - lon2[converged] + 180) % 360 - 180)
+        error = max(np.abs(lats - lat2[converged]).max(), lon_error.max())
+        assert error < 1e-6, "direct formula misses the second point by {} degrees".format(error)
+        return {'unconverged_fraction': float(1 - converged.mean()), 'max_round_trip_deg': float(error)}
+
+    return Benchmark(lambda: vincenty_inverse_batch(lat1, 0.0, lat2, lon2), len(lat1), check)
+
+
+# -------------------------------------------------------------------------------
+# detection_rules
+# -------------------------------------------------------------------------------
+
+# Rules mixing negations, "!=" and "at_least", whose pushed down conditions must not change the outcome
+_PARITY_RULES = [
+    {"any": [{"not": "high_co"}, "nonzero_pm2_5"]},
+    {"not": {"all": ["high_co", "high_pm2_5"]}},
+    {"not": {"any": ["high_co", {"not": "nonzero_pm2_5"}]}},
+    {"all": ["high_co", {"not": {"at_least": 2, "of": ["high_pm2_5", "nonzero_pm2_5", {"not": "high_co"}]}}]},
+    "any",
+]
+
+
+@case('detection_rules.pushdown_parity')
+def _detection_rules_pushdown_parity():
+    rng = np.random.default_rng(3)
+    container = InMemoryContainer()
+    for i in range(20000):
+        readings = {'carbon_monoxide': float(rng.uniform(0, 30)), 'pm2_5': float(rng.choice([0.0, 2.0, 8.0]))}
+        readings = {name: value for name, value in readings.items() if rng.uniform() > 0.2}
+        container.upsert_item({'id': str(i), 'geometry': {'coordinates': [0.0, 0.0]}, 'readings': readings}, ts=i)
+
+    thresholds = {"high_co": {"reading": "carbon_monoxide", "op": ">", "value": 12},
+                  "high_pm2_5": {"reading": "pm2_5", "op": ">", "value": 5},
+                  "nonzero_pm2_5": {"reading": "pm2_5", "op": "!=", "value": 0}}
+    engines = [RuleEngine({"thresholds": thresholds, "combination": rules}) for rules in _PARITY_RULES]
+    unfiltered = RuleEngine({"thresholds": thresholds, "pushdown": False})
+    parameters = [{"name": "@time", "value": 0}]
+    documents = container.query_items(unfiltered.query(), parameters)
+
+    def check(flags) -> dict:
+        returned = []
+        for engine, flagged in zip(engines, flags):
+            expected = {doc['id'] for doc, flag in zip(documents, flagged) if flag}
+            pushed = container.query_items(engine.query(), parameters)
+            found = {doc['id'] for doc, flag in zip(pushed, engine.evaluate_documents(pushed)) if flag}
+            assert found == expected, "{}: pushdown changes {} outcomes".format(engine.query(), len(found ^ expected))
+            returned.append(round(len(pushed) / len(documents), 3))
+        return {'returned_fraction': returned}
+
+    return Benchmark(lambda: [engine.evaluate_documents(documents) for engine in engines],
+                     len(documents) * len(engines), check)
+
+
+# -------------------------------------------------------------------------------
+# shared_utils
+# -------------------------------------------------------------------------------
+
+@case('shared_utils.dict_to_str')
+def _shared_utils_dict_to_str():
+    records = []
+    for body in _synthetic_corpus(100000):
+        try:
+            records.append(json.loads(body))
+        except ValueError:
+            continue
+
+    def check(strings) -> dict:
+        for record, string in zip(records[:1000], strings):
+            assert json.loads(string) == record, "{} does not round trip".format(record)
+        return {'bytes': sum(len(string) for string in strings)}
+
+    return Benchmark(lambda: [dict_to_str(record) for record in records], len(records), check)
+
+
+@case('shared_utils.is_device_sensor')
+def _shared_utils_is_device_sensor():
+    corpus = _synthetic_corpus(100000)
+    features = []
+    for body in corpus:
+        try:
+            feature = geojson.loads(body.decode('utf-8'))
+        except ValueError:
+            continue
+        if meets_device_format(feature):
+            features.append(feature)
+    expected = sum(decode_event(body).kind == SENSOR for body in corpus)
+
+    def classify() -> tuple:
+        sensors, unknown = 0, 0
+        for feature in features:
+            try:
+                sensors += is_device_sensor(feature)
+            except KeyError:
+                unknown += 1
+        return sensors, unknown
+
+    def check(result) -> dict:
+        sensors, unknown = result
+        assert sensors == expected, "{} sensors, the decoder found {}".format(sensors, expected)
+        return {'sensors': sensors, 'unknown_device_types': unknown}
+
+    return Benchmark(classify, len(features), check)
+
+
+# -------------------------------------------------------------------------------
+# Runner
+# -------------------------------------------------------------------------------
+
+_CALIBRATION_ARRAY = np.random.default_rng(0).normal(size=200000)
+
+
+def calibrate(repeat: int = 3) -> float:
+    """
+    Returns the fastest of `repeat` runs of the calibration workload, in seconds
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        np.sort(np.sqrt(np.abs(_CALIBRATION_ARRAY)) * 3.0 + 1.0)
+        total = 0.0
+        for value in range(100000):
+            total += value * 0.5
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+def run_case(make, repeat: int) -> dict:
+    """
+    Creates a benchmark, warms it up, times it `repeat` times and checks its result
+    :return: dict of its items, timings, throughput, the spread of its normalized runs, diagnostics, and the error of a
+    failed check
+    """
+    benchmark = make()
+    benchmark.run()
+    seconds, calibrations = [], []
+    for _ in range(repeat):
+        calibrations.append(calibrate())
+        start = time.perf_counter()
+        result = benchmark.run()
+        seconds.append(time.perf_counter() - start)
+
+    # Each run is normalized by the calibration just before it, and the best normalized run is kept
+    normalized = [benchmark.items / run * calibration for run, calibration in zip(seconds, calibrations)]
+    report = {'items': benchmark.items, 'runs': repeat, 'min_s': min(seconds), 'median_s': statistics.median(seconds),
+              'items_per_second': benchmark.items / min(seconds), 'calibration_s': min(calibrations),
+              'items_per_calibration': max(normalized), 'spread': 1 - min(normalized) / max(normalized),
+              'diagnostics': {}, 'error': None}
+    try:
+        report['diagnostics'] = benchmark.check(result)
+    except AssertionError as e:
+        report['error'] = str(e) or 'check failed'
+    return report
+
+
+# Fewest timed runs whose spread is taken as a measure of the noise of the host
+MIN_RUNS = 3
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> str:
+    """
+    Returns the status of a benchmark: 'failed', 'regressed', 'slower' when it is below the tolerance but within the
+    noise of its runs, or with too few runs to tell, 'improved', 'ok', or 'new' when the baseline has no comparable entry
+    """
+    if report['error'] is not None:
+        return 'failed'
+    if baseline is None or baseline.get('items') != report['items'] or 'items_per_calibration' not in baseline:
+        return 'new'
+    ratio = report['items_per_calibration'] / baseline['items_per_calibration']
+    if ratio < 1 - tolerance:
+        return 'regressed' if report['runs'] >= MIN_RUNS and ratio < 1 - tolerance - report['spread'] else 'slower'
+    if ratio > 1 + tolerance:
+        return 'improved'
+    return 'ok'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('-k', dest='keyword', default='', help="only run benchmarks whose name contains this")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help="fraction of the baseline throughput a benchmark may lose before it regresses")
+    parser.add_argument('--baseline', default=BASELINE, help="baseline file")
+    parser.add_argument('--update', action='store_true', help="record the results as the new baseline")
+    parser.add_argument('--json', help="file the results are written to")
+    parser.add_argument('--list', action='store_true', help="list the benchmarks and exit")
+    args = parser.parse_args()
+
+    names = [name for name in CASES if args.keyword in name]
+    if args.list:
+        print("\n".join(names))
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    machine = {'python': platform.python_version(), 'machine': platform.machine(), 'system': platform.system(),
+               'cpus': os.cpu_count()}
+    if baseline and baseline.get('environment') != machine:
+        print("Baseline recorded on {}, running on {}".format(baseline.get('environment'), machine))
+
+    results, statuses = {}, {}
+    for name in names:
+        report = run_case(CASES[name], args.repeat)
+        status = compare(report, baseline.get('results', {}).get(name), args.tolerance)
+        results[name], statuses[name] = report, status
+        reference = baseline.get('results', {}).get(name)
+        change = "{:+.0%}".format(report['items_per_calibration'] / reference['items_per_calibration'] - 1) \
+            if status not in ('new', 'failed') else ''
+        print("{:<36} {:>9} {:>12.0f} items/s {:>6}  min {:>9.2f} ms  median {:>9.2f} ms  {}".format(
+            name, status, report['items_per_second'], change, report['min_s'] * 1e3, report['median_s'] * 1e3,
+            report['error'] or json.dumps(report['diagnostics'])))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'environment': machine, 'results': results, 'statuses': statuses}, f, indent=2)
+
+    failures = [name for name, status in statuses.items() if status in ('failed', 'regressed')]
+    if args.update:
+        if any(status == 'failed' for status in statuses.values()):
+            print("Not updating the baseline while benchmarks fail")
+            return 1
+        recorded = baseline.get('results', {}) if baseline.get('environment') == machine else {}
+        recorded.update({name: {key: report[key] for key in ('items', 'items_per_second', 'items_per_calibration')}
+                         for name, report in results.items()})
+        with open(args.baseline, 'w') as f:
+            json.dump({'date': datetime.now().isoformat(timespec='seconds'), 'environment': machine,
+                       'results': recorded}, f, indent=2)
+            f.write('\n')
+        print("Baseline written to {}".format(args.baseline))
+        return 0
+
+    print("{} benchmarks, {} failed or regressed{}".format(len(statuses), len(failures),
+                                                           ": " + ", ".join(failures) if failures else ""))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
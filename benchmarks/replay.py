@@ -0,0 +1,321 @@
+"""
+Replay and Load Harness
+
+===================
+
+Drives both functions offline (see fakes.py for the stand-ins). A stream of GeoJSON device events, either synthetic or
+recorded, is replayed through `handle_device_input.main` in Event Hub sized batches, and the documents it writes are
+stored in in-memory Cosmos DB containers. Every `--tick` simulated seconds, `parse_actuator_data` runs against those
+containers and a fake registry manager, on the same simulated clock. With `--mode changefeed`, the documents written
+are also pushed to the detection logic through a fake change feed after every simulated second, as the
+watch_sensor_changes function would receive them, and ticks only flush deferred updates.
+
+Reports ingestion throughput and batch latency, per-stage latency of the timer function taken from its telemetry
+records, the simulated second a fire was first estimated at, missions sent, and memory. Run from the repository root,
+e.g.
+
+    python benchmarks/replay.py --scenario spreading --rate 500 --duration 600
+    python benchmarks/replay.py --input recorded.jsonl --json results.json
+    python benchmarks/replay.py --scenario single --mode changefeed
+
+Synthetic scenarios place `--sensors` sensors uniformly over a 20 x 20 km area. Sensors inside a fire report readings
+above the default detection thresholds, the others report background readings:
+- quiet: no fire
+- single: one fire growing from 300 m at 1 m/s
+- multi: three separate fires
+- spreading: one fire growing at 3 m/s while drifting east at 2 m/s
+
+Recorded streams are JSON lines, each holding an event body, optionally wrapped as {"t": seconds, "body": {...}} to
+replay it at a given offset. Unwrapped events are spread over time at `--rate` events per second. This directory is not
+part of the deployed function app.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from fakes import ChangeFeed, FakeRegistryManager, InMemoryContainer, Out, install_dispatcher, make_event
+from FireFlyFunctions import handle_device_input, parse_actuator_data, watch_sensor_changes
+from FireFlyFunctions.shared_code import connections
+from FireFlyFunctions.shared_code.document_layout import parse_regions
+from FireFlyFunctions.shared_code.projection import LocalPlane
+from FireFlyFunctions.shared_code.telemetry import summarize
+
+BASE = (-71.1, 42.3)
+AREA = 10000.0  # metres from the center of the area to its edges
+
+# Fires as (x, y, start radius, growth in m/s, drift x, drift y in m/s), in metres on the area's plane
+SCENARIOS = {
+    'quiet': [],
+    'single': [(0.0, 0.0, 300.0, 1.0, 0.0, 0.0)],
+    'multi': [(-5000.0, -4000.0, 300.0, 1.0, 0.0, 0.0), (4000.0, 3000.0, 500.0, 0.5, 0.0, 0.0),
+              (6000.0, -6000.0, 200.0, 2.0, 0.0, 0.0)],
+    'spreading': [(-3000.0, 0.0, 300.0, 3.0, 2.0, 0.0)],
+}
+
+
+class TelemetryCollector(logging.Handler):
+    """
+    Collects the JSON records emitted by shared_code.telemetry
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(json.loads(record.getMessage()))
+
+
+class SyntheticStream:
+    """
+    Sensor and drone events of a fire scenario, second by second
+    """
+
+    def __init__(self, scenario: str, rate: int, sensors: int, drones: int, seed: int = 0):
+        self.fires = SCENARIOS[scenario]
+        self.rate = rate
+        self.rng = np.random.default_rng(seed)
+        self.plane = LocalPlane(*BASE)
+
+        self.sensor_xy = self.rng.uniform(-AREA, AREA, size=(sensors, 2))
+        lon, lat = self.plane.to_geographic(self.sensor_xy)
+        self.sensor_lon_lat = np.column_stack((lon, lat)).tolist()
+        lon, lat = self.plane.to_geographic(self.rng.uniform(-AREA, AREA, size=(drones, 2)))
+        self.drone_lon_lat = np.column_stack((np.atleast_1d(lon), np.atleast_1d(lat))).tolist()
+
+    def burning(self, second: int) -> np.ndarray:
+        """
+        Returns which sensors are within a fire at the given second
+        """
+        burning = np.zeros(len(self.sensor_xy), dtype=bool)
+        for x, y, radius, growth, drift_x, drift_y in self.fires:
+            center = np.array([x + drift_x * second, y + drift_y * second])
+            burning |= np.hypot(*(self.sensor_xy - center).T) <= radius + growth * second
+        return burning
+
+    def events(self, second: int) -> list:
+        """
+        Returns the event bodies sent during the given second
+        """
+        burning = self.burning(second)
+        bodies = []
+        for i in self.rng.integers(0, len(self.sensor_xy), self.rate).tolist():
+            co, pm = (self.rng.uniform(15, 60), self.rng.uniform(8, 40)) if burning[i] else \
+                (self.rng.uniform(0, 4), self.rng.uniform(0, 3))
+            bodies.append(_feature(self.sensor_lon_lat[i], {
+                'device_type': 'sensor', 'device_id': 'sensor-{}'.format(i),
+                'carbon_monoxide': {'val': round(co, 2)}, 'pm2_5': {'val': round(pm, 2)},
+                'temperature': {'val': round(self.rng.uniform(15, 30) + 40 * burning[i], 1)}}))
+        # Drones report their position every 30 seconds
+        if second % 30 == 0:
+            for i, lon_lat in enumerate(self.drone_lon_lat):
+                bodies.append(_feature(lon_lat, {'device_type': 'actuator', 'device_id': 'drone-{}'.format(i),
+                                                 'status': 'idle'}))
+        return [json.dumps(body).encode() for body in bodies]
+
+
+class RecordedStream:
+    """
+    Events read from a JSON lines file
+    """
+
+    def __init__(self, path: str, rate: int):
+        self.by_second = {}
+        with open(path) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        for i, line in enumerate(lines):
+            wrapped = isinstance(line, dict) and 'body' in line and 't' in line
+            second = int(line['t']) if wrapped else i // max(1, rate)
+            body = line['body'] if wrapped else line
+            self.by_second.setdefault(second, []).append(json.dumps(body).encode())
+        self.duration = max(self.by_second) + 1 if self.by_second else 0
+
+    def events(self, second: int) -> list:
+        return self.by_second.get(second, [])
+
+
+def _feature(lon_lat, properties: dict) -> dict:
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': lon_lat}, 'properties': properties}
+
+
+def _latency(values: list) -> dict:
+    summary = summarize(values) if values else {}
+    if not isinstance(summary, dict):
+        summary = {'count': 1, 'sum': summary, 'min': summary, 'max': summary, 'p50': summary, 'p99': summary}
+    return summary
+
+
+def replay(stream, duration: int, batch_size: int, tick: int, dispatch_latency: float, measure_memory: bool,
+           mode: str = parse_actuator_data.TIMER) -> dict:
+    """
+    Replays a stream through the functions on a simulated clock
+    :return: dictionary of results
+    """
+    sensors, actuators = InMemoryContainer(), InMemoryContainer()
+    feed = ChangeFeed(sensors)
+    parse_actuator_data.DETECTION_MODE = mode
+    registry_manager = FakeRegistryManager(latency=dispatch_latency)
+    connections.register_container('sensors', 'data', sensors)
+    connections.register_container('actuators', 'data', actuators)
+    connections.register_registry_manager(registry_manager)
+    install_dispatcher(parse_actuator_data, registry_manager)
+
+    collector = TelemetryCollector()
+    telemetry_logger = logging.getLogger('telemetry')
+    telemetry_logger.addHandler(collector)
+    telemetry_logger.propagate = False
+
+    if measure_memory:
+        tracemalloc.start()
+    start = time.time()
+    events, ingest_time, batch_latencies, tick_latencies, feed_latencies = 0, 0.0, [], [], []
+    sequence_numbers = itertools.count()
+    first_fire = None
+    for second in range(duration):
+        now = start + second
+        bodies = stream.events(second)
+        for offset in range(0, len(bodies), batch_size):
+            batch = [make_event(body, next(sequence_numbers), now) for body in bodies[offset:offset + batch_size]]
+            actuator_out, sensor_out = Out(), Out()
+            begin = time.perf_counter()
+            handle_device_input.main(batch, actuator_out, sensor_out)
+            elapsed = time.perf_counter() - begin
+            ingest_time += elapsed
+            batch_latencies.append(elapsed * 1e3)
+            events += len(batch)
+            for doc in sensor_out.documents():
+                sensors.upsert_item(doc, ts=now)
+            for doc in actuator_out.documents():
+                actuators.upsert_item(doc, ts=now)
+
+        if mode == parse_actuator_data.CHANGE_FEED:
+            for documents in feed.read():
+                begin = time.perf_counter()
+                try:
+                    parse_actuator_data.on_sensor_documents(watch_sensor_changes.to_dicts(documents), now)
+                finally:
+                    parse_actuator_data.TELEMETRY.emit(trigger='change_feed')
+                feed_latencies.append((time.perf_counter() - begin) * 1e3)
+            if first_fire is None and parse_actuator_data.TRACKERS:
+                first_fire = second
+
+        if second % tick == 0:
+            begin = time.perf_counter()
+            try:
+                parse_actuator_data.run(now)
+            finally:
+                parse_actuator_data.TELEMETRY.emit()
+            tick_latencies.append((time.perf_counter() - begin) * 1e3)
+            if first_fire is None and parse_actuator_data.TRACKERS:
+                first_fire = second
+
+    peak = None
+    if measure_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    telemetry_logger.removeHandler(collector)
+
+    stages, counters = {}, {}
+    for record in collector.records:
+        if record.get('telemetry') != 'parse_actuator_data':
+            continue
+        for name, value in record['spans'].items():
+            stages.setdefault(name, []).append(value if not isinstance(value, dict) else value['sum'])
+        for name, value in record['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+
+    return {
+        'ingest': {'events': events, 'seconds': ingest_time, 'events_per_second': events / ingest_time if ingest_time
+                   else None, 'batch_latency_ms': _latency(batch_latencies)},
+        'timer': {'ticks': len(tick_latencies), 'tick_latency_ms': _latency(tick_latencies),
+                  'change_feed_batches': len(feed_latencies), 'change_feed_latency_ms': _latency(feed_latencies),
+                  'first_fire_s': first_fire,
+                  'stage_latency_ms': {name: _latency(values) for name, values in stages.items()},
+                  'counters': counters},
+        'cosmos': {'sensor_documents': len(sensors), 'actuator_documents': len(actuators),
+                   'queries': sensors.queries + actuators.queries,
+                   'documents_scanned': sensors.documents_scanned + actuators.documents_scanned},
+        'missions_sent': len(registry_manager.invocations),
+        'memory': {'traced_peak_bytes': peak,
+                   'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss},
+    }
+
+
+def _print_latency(label: str, summary: dict):
+    if summary:
+        print("    {:<24} p50 {:>8.2f} ms   p99 {:>8.2f} ms   max {:>8.2f} ms   ({} samples)".format(
+            label, summary['p50'], summary['p99'], summary['max'], summary['count']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays device events through both functions offline")
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='single')
+    parser.add_argument('--input', help="JSON lines file of recorded event bodies, instead of a scenario")
+    parser.add_argument('--rate', type=int, default=200, help="sensor events per simulated second")
+    parser.add_argument('--duration', type=int, default=300, help="simulated seconds")
+    parser.add_argument('--sensors', type=int, default=2000)
+    parser.add_argument('--drones', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=256, help="events per handle_device_input invocation")
+    parser.add_argument('--tick', type=int, default=5, help="simulated seconds between parse_actuator_data runs")
+    parser.add_argument('--mode', choices=[parse_actuator_data.TIMER, parse_actuator_data.CHANGE_FEED],
+                        default=parse_actuator_data.TIMER, help="DetectionMode of the timer function")
+    parser.add_argument('--dispatch-latency', type=float, default=0.0, help="seconds each direct method takes")
+    parser.add_argument('--memory', action='store_true', help="trace allocations, which slows the run down")
+    parser.add_argument('--regions', help="SensorRegions geohashes the timer queries are restricted to")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="file the results are written to")
+    parser.add_argument('--verbose', action='store_true', help="show the functions' own logs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    if not args.verbose:
+        logging.getLogger('log').setLevel(logging.ERROR)
+
+    if args.regions is not None:
+        parse_actuator_data.SENSOR_REGIONS = parse_regions(args.regions)
+
+    if args.input:
+        stream = RecordedStream(args.input, args.rate)
+        duration = stream.duration
+    else:
+        stream = SyntheticStream(args.scenario, args.rate, args.sensors, args.drones, args.seed)
+        duration = args.duration
+
+    results = replay(stream, duration, args.batch_size, args.tick, args.dispatch_latency, args.memory, args.mode)
+    results['config'] = {k: v for k, v in vars(args).items() if k not in ('json', 'verbose')}
+
+    ingest, timer = results['ingest'], results['timer']
+    print("Ingestion: {} events in {:.2f} s, {:.0f} events/s".format(
+        ingest['events'], ingest['seconds'], ingest['events_per_second'] or 0))
+    _print_latency('batch', ingest['batch_latency_ms'])
+    print("Timer: {} ticks, {} change feed batches, first fire estimated after {} s, {} missions sent".format(
+        timer['ticks'], timer['change_feed_batches'], timer['first_fire_s'], results['missions_sent']))
+    _print_latency('tick', timer['tick_latency_ms'])
+    _print_latency('change feed batch', timer['change_feed_latency_ms'])
+    for name, summary in timer['stage_latency_ms'].items():
+        _print_latency(name, summary)
+    print("Counters: {}".format(timer['counters']))
+    print("Cosmos: {}".format(results['cosmos']))
+    memory = results['memory']
+    print("Memory: max RSS {:.1f} MB{}".format(memory['max_rss_kb'] / 1024, "" if memory['traced_peak_bytes'] is None
+                                             else ", traced peak {:.1f} MB".format(memory['traced_peak_bytes'] / 2**20)))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Startup Benchmark
+
+===================
+
+Measures the cold start cost of each function app module:
+1. Import time, from `python -X importtime`, with the slowest imports by cumulative time
+2. Latency of the first and second invocation, in a fresh interpreter, with the in-memory stand-ins of fakes.py
+   registered in place of the Cosmos DB and IoT Hub clients (see shared_code.connections)
+
+Every measurement runs in its own interpreter, so that no module is already cached. Run from the repository root:
+
+    python benchmarks/startup.py [--repeat 5] [--top 15] [--history benchmarks/startup_history.jsonl]
+
+With `--history`, the results are appended as one JSON line per run, so that cold start cost can be tracked over time.
+This directory is not part of the deployed function app.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = ['handle_device_input', 'parse_actuator_data']
+
+
+def import_times(module: str) -> list:
+    """
+    Imports the module in a fresh interpreter with `-X importtime`
+    :return: list of (cumulative microseconds, imported module name), in import order
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)], cwd=ROOT,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError("Importing {} failed:\n{}".format(module, result.stderr[-2000:]))
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative), name.strip()))
+    return times
+
+
+def _feature(lon_lat: list, properties: dict) -> dict:
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': lon_lat}, 'properties': properties}
+
+
+def _invoke_parse_actuator_data(module, now: float):
+    from fakes import FakeRegistryManager, InMemoryContainer, install_dispatcher
+    from FireFlyFunctions.shared_code import connections
+    from FireFlyFunctions.shared_code.document_layout import to_document
+
+    def store(container, lon_lat, properties, ts):
+        feature = _feature(lon_lat, properties)
+        container.upsert_item(to_document(feature, json.dumps(feature).encode(), ts), ts=ts)
+
+    sensors, actuators = InMemoryContainer(), InMemoryContainer()
+    for i in range(50):
+        store(sensors, [-71.1 + i * 1e-3, 42.3 + (i % 7) * 1e-3], {'device_type': 'sensor', 'device_id': str(i),
+              'carbon_monoxide': {'val': 20.0}, 'pm2_5': {'val': 10.0}}, now - i)
+    for i in range(4):
+        store(actuators, [-71.0 - i * 1e-2, 42.2], {'device_type': 'actuator', 'device_id': 'drone{}'.format(i),
+              'status': 'idle'}, now)
+    connections.register_container('sensors', 'data', sensors)
+    connections.register_container('actuators', 'data', actuators)
+    registry_manager = FakeRegistryManager()
+    connections.register_registry_manager(registry_manager)
+    install_dispatcher(module, registry_manager)
+    return lambda: module.main(None)
+
+
+def _invoke_handle_device_input(module, now: float):
+    from fakes import Out, make_event
+
+    bodies = [json.dumps(_feature([-71.1, 42.3], {'device_type': 'sensor' if i % 4 else 'actuator',
+                                                  'device_id': str(i), 'carbon_monoxide': {'val': 15.0}})).encode()
+              for i in range(64)]
+    return lambda: module.main([make_event(body) for body in bodies], Out(), Out())
+
+
+def invocation_times(name: str) -> dict:
+    """
+    Runs in a fresh interpreter: imports a function module, then times its first and second invocations
+    """
+    start = time.perf_counter()
+    module = __import__('FireFlyFunctions.{}'.format(name), fromlist=['main'])
+    imported = time.perf_counter()
+
+    prepare = _invoke_parse_actuator_data if name == 'parse_actuator_data' else _invoke_handle_device_input
+    invoke = prepare(module, time.time())
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(2):
+            begin = time.perf_counter()
+            invoke()
+            latencies.append(time.perf_counter() - begin)
+    return {'import_s': imported - start, 'first_invocation_s': latencies[0], 'second_invocation_s': latencies[1],
+            'modules_loaded': len(sys.modules)}
+
+
+def measure(name: str, repeat: int, top: int) -> dict:
+    """
+    Collects the import and invocation measurements of a function module over `repeat` fresh interpreters
+    """
+    module = 'FireFlyFunctions.{}'.format(name)
+    totals, slowest = [], {}
+    for _ in range(repeat):
+        times = import_times(module)
+        totals.append(max(cumulative for cumulative, _ in times) / 1e6)
+        for cumulative, imported in times:
+            slowest[imported] = min(cumulative, slowest.get(imported, cumulative))
+
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), '--invoke', name], cwd=ROOT,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0:
+            raise RuntimeError("Invoking {} failed:\n{}".format(name, result.stderr[-2000:]))
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    top_imports = sorted(slowest.items(), key=lambda item: -item[1])[:top]
+    return {
+        'importtime_s': statistics.median(totals),
+        'import_s': statistics.median(run['import_s'] for run in runs),
+        'first_invocation_s': statistics.median(run['first_invocation_s'] for run in runs),
+        'second_invocation_s': statistics.median(run['second_invocation_s'] for run in runs),
+        'modules_loaded': runs[0]['modules_loaded'],
+        'slowest_imports': [[imported, cumulative / 1e6] for imported, cumulative in top_imports],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--repeat', type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument('--top', type=int, default=15, help="number of slowest imports to report")
+    parser.add_argument('--history', help="JSON lines file the results are appended to")
+    parser.add_argument('--invoke', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.invoke:
+        sys.path.insert(0, ROOT)
+        print(json.dumps(invocation_times(args.invoke)))
+        return
+
+    results = {}
+    for name in FUNCTIONS:
+        results[name] = report = measure(name, args.repeat, args.top)
+        print("{}: import {:.1f} ms (-X importtime {:.1f} ms), first invocation {:.1f} ms, second {:.1f} ms, "
+              "{} modules".format(name, report['import_s'] * 1e3, report['importtime_s'] * 1e3,
+                                  report['first_invocation_s'] * 1e3, report['second_invocation_s'] * 1e3,
+                                  report['modules_loaded']))
+        for imported, cumulative in report['slowest_imports']:
+            print("    {:>9.1f} ms  {}".format(cumulative * 1e3, imported))
+
+    if args.history:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps({'date': datetime.now().isoformat(timespec='seconds'),
+                                'python': platform.python_version(), 'results': results}) + '\n')
+
+
+if __name__ == '__main__':
+    main()
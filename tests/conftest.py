@@ -0,0 +1,78 @@
+"""
+Tests of the function app, run from the repository root without any Azure service:
+
+    python -m pytest -q tests
+
+Azure is replaced by the stand-ins of benchmarks/fakes.py. Like the benchmarks, this directory is not part of the
+deployed function app.
+"""
+
+import itertools
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from fakes import FakeRegistryManager, InMemoryContainer, Out, install_dispatcher, make_event
+
+
+def sensor_event(lon_lat, device_id: str, burning: bool = True) -> bytes:
+    """
+    Returns the body of a sensor event, whose readings meet the default detection rules when `burning`
+    """
+    readings = {'carbon_monoxide': {'val': 40.0 if burning else 1.0}, 'pm2_5': {'val': 20.0 if burning else 1.0}}
+    return json.dumps({'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': list(lon_lat)},
+                       'properties': dict(device_type='sensor', device_id=device_id, **readings)}).encode()
+
+
+def drone_event(lon_lat, device_id: str) -> bytes:
+    return json.dumps({'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': list(lon_lat)},
+                       'properties': {'device_type': 'actuator', 'device_id': device_id, 'status': 'idle'}}).encode()
+
+
+@pytest.fixture
+def detection(monkeypatch):
+    """
+    parse_actuator_data with its warm state cleared, in-memory containers and a stand-in registry manager. `ingest`
+    runs events through handle_device_input and stores the documents it writes, stamped with the given time
+    """
+    from FireFlyFunctions import handle_device_input, parse_actuator_data
+    from FireFlyFunctions.shared_code import connections
+    from FireFlyFunctions.shared_code.dispatch import DroneRegistry
+
+    sensors, actuators, registry_manager = InMemoryContainer(), InMemoryContainer(), FakeRegistryManager()
+    for name, value in [('SENSOR_WINDOW', None), ('TRACKERS', []), ('LAST_UPDATE', None), ('LAST_QUERY', None),
+                        ('LAST_HEALTH_CHECK', float('inf')), ('DETECTION_MODE', parse_actuator_data.TIMER),
+                        ('DRONE_REGISTRY', DroneRegistry(stale_after=parse_actuator_data.DRONE_STALE_AFTER,
+                                                         busy_for=parse_actuator_data.DRONE_BUSY_FOR))]:
+        monkeypatch.setattr(parse_actuator_data, name, value)
+    monkeypatch.setattr(handle_device_input, 'DEDUP_CACHE', handle_device_input.DedupCache(
+        capacity=handle_device_input.DEDUP_CAPACITY, lateness=handle_device_input.DEDUP_LATENESS))
+    monkeypatch.delenv('DetectionRules', raising=False)
+    monkeypatch.delenv('DetectionRulesPath', raising=False)
+    connections.reset()
+    connections.register_container('sensors', 'data', sensors)
+    connections.register_container('actuators', 'data', actuators)
+    connections.register_registry_manager(registry_manager)
+    install_dispatcher(parse_actuator_data, registry_manager)
+    sequence_numbers = itertools.count()
+
+    def ingest(bodies: list, now: float):
+        actuator_out, sensor_out = Out(), Out()
+        handle_device_input.main([make_event(body, next(sequence_numbers), now) for body in bodies], actuator_out,
+                                 sensor_out)
+        for doc in sensor_out.documents():
+            sensors.upsert_item(doc, ts=now)
+        for doc in actuator_out.documents():
+            actuators.upsert_item(doc, ts=now)
+
+    yield SimpleNamespace(module=parse_actuator_data, sensors=sensors, actuators=actuators,
+                          registry_manager=registry_manager, ingest=ingest)
+    connections.reset()
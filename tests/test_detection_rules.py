@@ -0,0 +1,74 @@
+import json
+import logging
+
+import pytest
+
+from FireFlyFunctions.shared_code import detection_rules
+from FireFlyFunctions.shared_code.detection_rules import DEFAULT_RULES, load_rule_engine, RuleEngine
+
+
+def _rules(value) -> dict:
+    return {'thresholds': {'high_co': {'reading': 'carbon_monoxide', 'op': '>', 'value': value}}}
+
+
+@pytest.mark.parametrize('value', [float('inf'), float('-inf'), float('nan'), 'Infinity', 'nan', None, 'high', [1]])
+def test_non_finite_values_are_rejected(value):
+    with pytest.raises(ValueError):
+        RuleEngine(_rules(value))
+
+
+@pytest.mark.parametrize('text', ['1e999', 'Infinity', 'NaN'])
+def test_non_finite_json_values_are_rejected(text):
+    with pytest.raises(ValueError):
+        RuleEngine(json.loads('{"thresholds": {"high_co": {"reading": "co", "op": ">", "value": ' + text + '}}}'))
+
+
+@pytest.mark.parametrize('rules', [[], {'thresholds': []}, {'thresholds': {'high_co': 12}}])
+def test_malformed_rules_are_rejected(rules):
+    with pytest.raises(ValueError):
+        RuleEngine(rules)
+
+
+def test_finite_values_reach_the_query():
+    assert 'r.readings.carbon_monoxide > 12.5' in RuleEngine(_rules('12.5')).query()
+
+
+@pytest.fixture
+def fresh_rules(monkeypatch):
+    monkeypatch.setattr(detection_rules, 'RULE_ENGINE', None)
+    monkeypatch.setattr(detection_rules, 'RULES_SOURCE', None)
+    monkeypatch.delenv('DetectionRules', raising=False)
+    monkeypatch.delenv('DetectionRulesPath', raising=False)
+    return monkeypatch
+
+
+def test_bad_setting_keeps_the_previous_rules(fresh_rules, caplog):
+    fresh_rules.setenv('DetectionRules', json.dumps(_rules(20)))
+    engine = load_rule_engine()
+    assert engine.thresholds['high_co'][2] == 20.0
+
+    fresh_rules.setenv('DetectionRules', json.dumps(_rules(float('inf'))))
+    with caplog.at_level(logging.ERROR, logger='log'):
+        assert load_rule_engine() is engine
+        assert load_rule_engine() is engine
+    assert len(caplog.records) == 1, "an invalid configuration is logged once"
+
+    fresh_rules.setenv('DetectionRules', '{not json')
+    assert load_rule_engine() is engine
+
+    fresh_rules.setenv('DetectionRules', json.dumps(_rules(30)))
+    assert load_rule_engine().thresholds['high_co'][2] == 30.0
+
+
+def test_bad_rules_without_previous_fall_back_to_default(fresh_rules):
+    fresh_rules.setenv('DetectionRules', json.dumps(_rules('nan')))
+    assert load_rule_engine().query() == RuleEngine(DEFAULT_RULES).query()
+
+
+def test_missing_rules_file(fresh_rules, tmp_path):
+    path = tmp_path / 'rules.json'
+    fresh_rules.setenv('DetectionRulesPath', str(path))
+    assert load_rule_engine().query() == RuleEngine(DEFAULT_RULES).query()
+
+    path.write_text(json.dumps(_rules(7)))
+    assert load_rule_engine().thresholds['high_co'][2] == 7.0
@@ -0,0 +1,95 @@
+import pytest
+
+from fakes import DeliveryError, DirectMethod, FakeRegistryManager
+from FireFlyFunctions.shared_code.dispatch import Dispatcher, DroneRegistry
+
+NOW = 1620000000.0
+
+
+class FailingRegistryManager(FakeRegistryManager):
+    """
+    Raises `error` instead of answering the drones in `fail`
+    """
+
+    def __init__(self, fail=(), error=DeliveryError):
+        super().__init__()
+        self.fail = set(fail)
+        self.error = error
+
+    def invoke_device_method(self, device_id, method):
+        if device_id in self.fail:
+            self.invocations.append((device_id, method))
+            raise self.error("{} is unreachable".format(device_id))
+        return super().invoke_device_method(device_id, method)
+
+
+def make_dispatcher(registry_manager, **kwargs):
+    return Dispatcher(registry_manager, 'DetermineFlightPath', fallback_device_id='fallback', method_class=DirectMethod,
+                      errors=(DeliveryError,), **kwargs)
+
+
+def make_registry(*drones):
+    registry = DroneRegistry()
+    registry.add_documents([{'id': device_id, 'device_id': device_id, '_ts': NOW, 'coordinates': [lon, lat]}
+                            for device_id, lon, lat in drones])
+    return registry
+
+
+def test_no_missions_invoke_nothing():
+    registry_manager = FakeRegistryManager()
+    dispatcher = make_dispatcher(registry_manager)
+    registry = DroneRegistry()
+    assert dispatcher.candidates([], []) == []
+    assert dispatcher.dispatch([], registry, NOW) == []
+
+    registry = make_registry(('drone-0', -118.0, 34.0))
+    assert dispatcher.candidates([], registry.idle_drones(NOW)) == []
+    assert dispatcher.dispatch([], registry, NOW) == []
+    assert registry_manager.invocations == []
+    assert registry.idle_drones(NOW), "no drone should be marked busy"
+
+
+def test_missions_go_to_the_nearest_drones():
+    registry_manager = FakeRegistryManager()
+    registry = make_registry(('far', -117.0, 34.0), ('near', -118.0, 34.0))
+    results = make_dispatcher(registry_manager).dispatch([((-118.01, 34.0), {'mission': 0})], registry, NOW)
+    assert [result.device_id for result in results] == ['near']
+    assert [device_id for device_id, _ in registry_manager.invocations] == ['near']
+    assert [drone.device_id for drone in registry.idle_drones(NOW)] == ['far']
+
+
+def test_undelivered_mission_moves_to_the_next_drone():
+    registry_manager = FailingRegistryManager(fail={'near'})
+    registry = make_registry(('far', -117.0, 34.0), ('near', -118.0, 34.0))
+    results = make_dispatcher(registry_manager).dispatch([((-118.01, 34.0), {'mission': 0})], registry, NOW)
+    assert results[0].device_id == 'far'
+    assert results[0].attempts == 2
+
+
+def test_refused_mission_moves_to_the_next_drone():
+    registry_manager = FakeRegistryManager(refuse={'near'})
+    registry = make_registry(('far', -117.0, 34.0), ('near', -118.0, 34.0))
+    results = make_dispatcher(registry_manager).dispatch([((-118.01, 34.0), {'mission': 0})], registry, NOW)
+    assert results[0].device_id == 'far'
+
+
+def test_attempts_are_bounded():
+    registry_manager = FailingRegistryManager(fail={'a', 'b', 'c'})
+    registry = make_registry(('a', -118.0, 34.0), ('b', -118.1, 34.0), ('c', -118.2, 34.0))
+    results = make_dispatcher(registry_manager, max_attempts=2).dispatch([((-118.0, 34.0), {})], registry, NOW)
+    assert results[0].device_id is None
+    assert results[0].attempts == 2
+    assert len(registry.idle_drones(NOW)) == 3
+
+
+def test_other_errors_are_raised():
+    registry_manager = FailingRegistryManager(fail={'drone-0'}, error=TypeError)
+    registry = make_registry(('drone-0', -118.0, 34.0))
+    with pytest.raises(TypeError):
+        make_dispatcher(registry_manager).dispatch([((-118.0, 34.0), {})], registry, NOW)
+
+
+def test_fallback_drone_before_any_report():
+    registry_manager = FakeRegistryManager()
+    results = make_dispatcher(registry_manager).dispatch([((-118.0, 34.0), {})], DroneRegistry(), NOW)
+    assert results[0].device_id == 'fallback'
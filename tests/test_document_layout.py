@@ -0,0 +1,80 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import azure.functions as func
+import pytest
+
+from fakes import Out
+from FireFlyFunctions import handle_device_input
+from FireFlyFunctions.shared_code.document_layout import (BUCKET_SECONDS, MAX_PARTITION_KEYS, PARTITION_SLACK,
+                                                          parse_regions, partition_key, partition_keys)
+from FireFlyFunctions.shared_code.sensor_window import SensorWindow
+
+NOW = 1620000000.0
+
+
+def _cells(count: int) -> list:
+    return parse_regions(','.join(parse_regions('drk,drm,drq,drs,drt')[:count]))
+
+
+def _body(properties: dict) -> bytes:
+    return json.dumps({'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-71.1, 42.3]},
+                       'properties': dict(device_type='sensor', device_id='sensor-1', carbon_monoxide={'val': 20},
+                                          **properties)}).encode()
+
+
+def _ingest(events: list) -> list:
+    actuator_out, sensor_out = Out(), Out()
+    handle_device_input.main(events, actuator_out, sensor_out)
+    return sensor_out.documents()
+
+
+@pytest.fixture(autouse=True)
+def fresh_dedup(monkeypatch):
+    monkeypatch.setattr(handle_device_input, 'DEDUP_CACHE', handle_device_input.DedupCache(
+        capacity=handle_device_input.DEDUP_CAPACITY, lateness=handle_device_input.DEDUP_LATENESS))
+
+
+@pytest.mark.parametrize('cells', [1, 32, 64, 128, 129, 160])
+@pytest.mark.parametrize('hours', [0, 1, 2, 6])
+def test_partition_keys_are_capped(cells, hours):
+    regions = _cells(cells)
+    assert len(regions) == cells
+    keys = partition_keys(regions, NOW - hours * BUCKET_SECONDS, NOW)
+    buckets = (hours * BUCKET_SECONDS + PARTITION_SLACK) // BUCKET_SECONDS + 1
+    if cells * buckets > MAX_PARTITION_KEYS:
+        assert keys is None
+    else:
+        assert len(keys) == len(set(keys)) <= MAX_PARTITION_KEYS
+
+
+def test_too_many_keys_query_every_partition():
+    window = SensorWindow("SELECT * FROM data r WHERE r._ts >= @time", timedelta(hours=2),
+                          partitions=lambda since, now: partition_keys(_cells(160), since, now))
+    query, parameters = window._query(NOW - 7200, NOW)
+    assert 'r.pk IN' not in query
+    assert len(parameters) == 1
+
+    window.partitions = lambda since, now: partition_keys(parse_regions('drt2'), since, now)
+    query, parameters = window._query(NOW - 7200, NOW)
+    assert 'r.pk IN' in query
+    assert len(parameters) == 5
+
+
+def test_redelivered_event_keeps_its_id_and_partition():
+    body = _body({})
+    enqueued = datetime.fromtimestamp(NOW - BUCKET_SECONDS, timezone.utc)
+    first, = _ingest([func.EventHubEvent(body=body, enqueued_time=enqueued)])
+    handle_device_input.DEDUP_CACHE = handle_device_input.DedupCache()
+    again, = _ingest([func.EventHubEvent(body=body, enqueued_time=enqueued)])
+    assert (first['id'], first['pk']) == (again['id'], again['pk'])
+    assert first['pk'] == partition_key(-71.1, 42.3, NOW - BUCKET_SECONDS)
+
+
+def test_device_timestamp_partitions_events_without_enqueued_time():
+    document, = _ingest([func.EventHubEvent(body=_body({'timestamp': NOW - 5 * BUCKET_SECONDS}))])
+    assert document['pk'] == partition_key(-71.1, 42.3, NOW - 5 * BUCKET_SECONDS)
+
+
+def test_events_without_any_timestamp_are_rejected():
+    assert _ingest([func.EventHubEvent(body=_body({}))]) == []
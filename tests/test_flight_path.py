@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from FireFlyFunctions.shared_code.flight_path import FlightPlanner, RINGS, SPIRAL
+from FireFlyFunctions.shared_code.vincenty import vincenty_inverse_batch
+
+CENTER = (-71.1, 42.3)
+
+
+def _distance(a, b) -> float:
+    distance, _, _ = vincenty_inverse_batch(np.array([a[1]]), np.array([a[0]]), np.array([b[1]]), np.array([b[0]]))
+    return float(distance[0])
+
+
+def test_path_is_closed():
+    plan, = FlightPlanner(endurance=1e6).plan([CENTER + (500.0,)])
+    sortie, = plan.sorties
+    assert np.array_equal(sortie.waypoints[0], sortie.waypoints[-1])
+    # The closing leg is part of the length: the whole perimeter of the polygon is flown
+    perimeter = sum(_distance(a, b) for a, b in zip(sortie.waypoints[:-1], sortie.waypoints[1:]))
+    assert sortie.length == pytest.approx(perimeter, rel=1e-3)
+    assert plan.length == pytest.approx(perimeter, rel=1e-3)
+
+
+@pytest.mark.parametrize('pattern, rings', [(RINGS, 0), (RINGS, 2), (SPIRAL, 2)])
+@pytest.mark.parametrize('radius', [50.0, 1000.0, 3000.0, 20000.0])
+@pytest.mark.parametrize('origin', [None, (-71.12, 42.3), (-71.3, 42.45)])
+def test_sorties_stay_within_range(pattern, rings, radius, origin):
+    planner = FlightPlanner(rings=rings, pattern=pattern)
+    plan, = planner.plan([CENTER + (radius,)], [origin])
+    for sortie in plan.sorties:
+        transit = 0.0 if origin is None else _distance(origin, sortie.target)
+        assert sortie.transit == pytest.approx(transit, rel=1e-9, abs=1e-6)
+        assert sortie.transit + sortie.length <= planner.sortie_range * (1 + 1e-9)
+    if not plan.truncated:
+        assert sum(sortie.length for sortie in plan.sorties) <= plan.length + 1e-6
+
+
+def test_transit_splits_a_path_that_fits_without_it():
+    planner = FlightPlanner(endurance=350.0)
+    plan, = planner.plan([CENTER + (500.0,)])
+    assert len(plan.sorties) == 1
+    plan, = planner.plan([CENTER + (500.0,)], [(-71.1, 42.31)])
+    assert len(plan.sorties) > 1
+    assert all(sortie.transit + sortie.length <= planner.sortie_range for sortie in plan.sorties)
+
+
+def test_unreachable_fire_plans_no_sortie():
+    planner = FlightPlanner()
+    plan, = planner.plan([CENTER + (500.0,)], [(-70.0, 42.3)])
+    assert plan.sorties == []
+    assert plan.truncated
+
+
+def test_origins_only_apply_to_their_circle():
+    planner = FlightPlanner()
+    near, far = planner.plan([CENTER + (500.0,), (-70.0, 42.3, 500.0)], [(-71.1, 42.31), None])
+    assert near.sorties[0].transit > 0
+    assert far.sorties[0].transit == 0
@@ -0,0 +1,56 @@
+import pytest
+
+from FireFlyFunctions.shared_code import parallel_ingest
+from FireFlyFunctions.shared_code.event_decoder import _synthetic_corpus
+from FireFlyFunctions.shared_code.parallel_ingest import decode_chunk, ParallelDecoder, THREAD
+
+
+@pytest.fixture
+def items():
+    return [(body, 1620000000.0) for body in _synthetic_corpus(512)]
+
+
+@pytest.fixture
+def four_cpus(monkeypatch):
+    monkeypatch.setattr(parallel_ingest.os, 'cpu_count', lambda: 4)
+
+
+def test_inline_by_default(items, four_cpus):
+    decoder = ParallelDecoder(workers=4)
+    decoded, parallel = decoder.decode(items)
+    assert not parallel
+    assert decoder.threshold == float('inf')
+    assert [d.kind for d in decoded] == [d.kind for d in decode_chunk(items)[0]]
+
+
+def test_pool_keeps_the_order_of_the_batch(items, four_cpus):
+    decoder = ParallelDecoder(workers=4, chunk_size=64, min_parallel=256, executor=THREAD)
+    chunks = []
+    decoded, parallel = decoder.decode(items, on_chunk=chunks.append)
+    decoder.shutdown()
+    assert parallel
+    assert len(chunks) == 8
+    assert [d.record for d in decoded] == [d.record for d in decode_chunk(items)[0]]
+
+
+def test_small_batches_stay_inline(items, four_cpus):
+    decoder = ParallelDecoder(workers=4, min_parallel=256, executor=THREAD)
+    assert decoder.decode(items[:255])[1] is False
+
+
+def test_failed_pool_is_reported_inline(items, four_cpus, monkeypatch):
+    decoder = ParallelDecoder(workers=4, min_parallel=256, executor=THREAD)
+
+    def fail(batch, on_chunk):
+        raise OSError("worker died")
+
+    monkeypatch.setattr(decoder, '_decode_parallel', fail)
+    decoded, parallel = decoder.decode(items)
+    assert not parallel
+    assert len(decoded) == len(items)
+    assert decoder.threshold == float('inf')
+
+
+def test_unknown_executor():
+    with pytest.raises(ValueError):
+        ParallelDecoder(executor='fork')
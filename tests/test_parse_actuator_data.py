@@ -0,0 +1,72 @@
+import json
+
+import numpy as np
+import pytest
+
+from conftest import drone_event, sensor_event
+from FireFlyFunctions.shared_code.flight_path import FlightPlanner
+
+NOW = 1620000000.0
+FIRE = (-71.1, 42.3)
+
+
+def _fire(count: int = 20, spread: float = 0.002, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(-spread, spread, size=(count, 2)) + FIRE
+    return [sensor_event(point, 'sensor-{}'.format(i)) for i, point in enumerate(points.tolist())]
+
+
+def _payloads(invocations) -> list:
+    return [json.dumps(method.payload, sort_keys=True) for _, method in invocations]
+
+
+@pytest.fixture
+def short_range(detection, monkeypatch):
+    # Sorties of at most 1.5 km, so that each fire's path is split across several drones
+    monkeypatch.setattr(detection.module, 'FLIGHT_PLANNER', FlightPlanner(speed=10.0, endurance=150.0, max_sorties=4))
+    return detection
+
+
+def test_only_undelivered_sorties_are_sent_again(short_range):
+    detection = short_range
+    drones = [(-71.1, 42.305), (-71.095, 42.3), (-71.1, 42.295), (-71.105, 42.3)]
+    detection.ingest(_fire() + [drone_event(lon_lat, 'drone-{}'.format(i)) for i, lon_lat in enumerate(drones)], NOW)
+    detection.registry_manager.refuse = {'drone-1', 'drone-2', 'drone-3'}
+
+    detection.module.run(NOW)
+    tracker, = detection.module.TRACKERS
+    assert len(tracker.sorties) > 1
+    delivered = {json.dumps(method.payload, sort_keys=True) for device_id, method in
+                 detection.registry_manager.invocations if device_id not in detection.registry_manager.refuse}
+    assert 0 < len(tracker.delivered) < len(tracker.sorties)
+    assert tracker.dispatched is None
+
+    detection.registry_manager.refuse = set()
+    detection.registry_manager.invocations = []
+    detection.module.run(NOW + 5)
+    resent = _payloads(detection.registry_manager.invocations)
+    assert len(resent) == len(tracker.sorties) - len(delivered)
+    assert not delivered & set(resent), "a drone was sent a sortie already delivered"
+    assert tracker.delivered == set(range(len(tracker.sorties)))
+    assert tracker.dispatched is not None
+
+    detection.registry_manager.invocations = []
+    detection.module.run(NOW + 10)
+    assert detection.registry_manager.invocations == []
+
+
+def test_changed_circle_plans_every_sortie_again(short_range):
+    detection = short_range
+    drones = [(-71.1, 42.305), (-71.095, 42.3), (-71.1, 42.295), (-71.105, 42.3)]
+    detection.ingest(_fire() + [drone_event(lon_lat, 'drone-{}'.format(i)) for i, lon_lat in enumerate(drones)], NOW)
+    detection.registry_manager.refuse = {'drone-1', 'drone-2', 'drone-3'}
+    detection.module.run(NOW)
+    tracker, = detection.module.TRACKERS
+    first_plan = tracker.planned
+    assert tracker.delivered
+
+    # The fire grows well beyond the tolerance: the partly delivered plan is dropped for a new one
+    detection.ingest([sensor_event((FIRE[0] + 0.01, FIRE[1]), 'sensor-far')], NOW + 5)
+    detection.module.run(NOW + 5)
+    assert tracker.planned != first_plan
+    assert tracker.delivered == set(), "every sortie of the new plan is still to be delivered"
@@ -0,0 +1,132 @@
+import time
+
+import pytest
+
+from conftest import sensor_event
+from fakes import ChangeFeed
+from FireFlyFunctions import watch_sensor_changes
+
+# Current time, since watch_sensor_changes stamps its invocations with the wall clock
+NOW = float(int(time.time()))
+
+
+def _readings(first: int, count: int, burning: bool = True) -> list:
+    # Sensors about 110 m apart, each in its own grid cell
+    return [sensor_event((-71.1 + 0.001 * i, 42.3), 'sensor-{}'.format(i), burning)
+            for i in range(first, first + count)]
+
+
+@pytest.fixture
+def change_feed(detection, monkeypatch):
+    monkeypatch.setattr(detection.module, 'DETECTION_MODE', detection.module.CHANGE_FEED)
+    detection.feed = ChangeFeed(detection.sensors)
+    return detection
+
+
+def _push(detection, now: float):
+    for documents in detection.feed.read():
+        detection.module.on_sensor_documents(watch_sensor_changes.to_dicts(documents), now)
+
+
+def test_timer_mode_ignores_the_change_feed(detection):
+    detection.ingest(_readings(0, 5), NOW)
+    feed = ChangeFeed(detection.sensors)
+    detection.ingest(_readings(5, 5), NOW)
+    for documents in feed.read():
+        watch_sensor_changes.main(documents)
+    assert detection.module.SENSOR_WINDOW is None
+    assert detection.sensors.queries == 0
+
+
+def test_timer_mode_queries_every_tick(detection):
+    detection.ingest(_readings(0, 5), NOW)
+    detection.module.run(NOW)
+    detection.ingest(_readings(5, 5), NOW + 5)
+    detection.module.run(NOW + 5)
+    detection.module.run(NOW + 10)
+    assert detection.sensors.queries == 3
+    assert len(detection.module.SENSOR_WINDOW) == 10
+
+
+def test_cold_window_falls_back_to_a_full_query(change_feed):
+    change_feed.ingest(_readings(0, 5), NOW - 600)
+    change_feed.feed = ChangeFeed(change_feed.sensors)
+    change_feed.ingest(_readings(5, 3), NOW)
+    _push(change_feed, NOW)
+    # The first push finds the window cold and queries it whole, which covers the readings written before it
+    assert change_feed.sensors.queries == 1
+    assert len(change_feed.module.SENSOR_WINDOW) == 8
+
+
+def test_pushed_readings_enter_the_window_without_queries(change_feed):
+    change_feed.ingest(_readings(0, 3), NOW)
+    _push(change_feed, NOW)
+    queries = change_feed.sensors.queries
+
+    change_feed.ingest(_readings(3, 4) + _readings(100, 2, burning=False), NOW + 1)
+    _push(change_feed, NOW + 1)
+    change_feed.module.run(NOW + 5)
+    assert change_feed.sensors.queries == queries
+    # Readings that do not meet the detection rules are left out
+    assert len(change_feed.module.SENSOR_WINDOW) == 7
+
+
+def test_change_feed_main_updates_the_window(change_feed):
+    change_feed.ingest(_readings(0, 3), NOW)
+    _push(change_feed, NOW)
+    change_feed.ingest(_readings(3, 2), NOW)
+    for documents in change_feed.feed.read():
+        watch_sensor_changes.main(documents)
+    assert len(change_feed.module.SENSOR_WINDOW) == 5
+
+
+def test_readings_leave_the_window_on_ticks(change_feed):
+    window = change_feed.module.WINDOW.total_seconds()
+    change_feed.ingest(_readings(0, 3), NOW)
+    _push(change_feed, NOW)
+    change_feed.ingest(_readings(3, 2), NOW + 600)
+    _push(change_feed, NOW + 600)
+
+    change_feed.module.run(NOW + window + 1)
+    assert len(change_feed.module.SENSOR_WINDOW) == 2
+    change_feed.module.run(NOW + window + 601)
+    assert len(change_feed.module.SENSOR_WINDOW) == 0
+
+
+def test_reconcile_picks_up_readings_pushed_elsewhere(change_feed):
+    interval = change_feed.module.CHANGE_FEED_RECONCILE_INTERVAL
+    change_feed.ingest(_readings(0, 3), NOW)
+    _push(change_feed, NOW)
+    queries = change_feed.sensors.queries
+
+    # Readings of partitions whose change feed another instance reads never reach this one's push
+    change_feed.ingest(_readings(3, 4), NOW + 1)
+    change_feed.feed.read()
+    change_feed.module.run(NOW + interval / 2)
+    assert change_feed.sensors.queries == queries
+    assert len(change_feed.module.SENSOR_WINDOW) == 3
+
+    change_feed.module.run(NOW + interval + 1)
+    assert change_feed.sensors.queries == queries + 1
+    assert len(change_feed.module.SENSOR_WINDOW) == 7
+
+    # Reconciling again finds nothing new, and the next one waits for another interval
+    change_feed.module.run(NOW + interval + 5)
+    assert change_feed.sensors.queries == queries + 1
+
+
+def test_updates_are_debounced(change_feed):
+    change_feed.ingest(_readings(0, 3), NOW)
+    _push(change_feed, NOW)
+    assert change_feed.module.LAST_UPDATE == NOW
+
+    change_feed.ingest(_readings(3, 3), NOW + change_feed.module.CHANGE_FEED_DEBOUNCE / 2)
+    _push(change_feed, NOW + change_feed.module.CHANGE_FEED_DEBOUNCE / 2)
+    assert change_feed.module.LAST_UPDATE == NOW
+    assert len(change_feed.module.SENSOR_WINDOW) == 6
+
+    # The deferred update is completed by the next tick
+    change_feed.module.run(NOW + change_feed.module.CHANGE_FEED_DEBOUNCE)
+    assert change_feed.module.LAST_UPDATE == NOW + change_feed.module.CHANGE_FEED_DEBOUNCE
+    tracker, = change_feed.module.TRACKERS
+    assert len(tracker.points) == 6
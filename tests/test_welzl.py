@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from FireFlyFunctions.shared_code.welzl import CircleSolver, GaertnerSolver, welzl, welzl_recursive
+
+SOLVERS = {
+    'welzl': lambda pts: welzl(pts, len(pts) * 10),
+    'gaertner': lambda pts: GaertnerSolver(pts).solve(len(pts) * 10),
+}
+
+
+def _cospherical(rng, n, d, radius):
+    pts = rng.normal(size=(n, d))
+    return radius * (pts / np.linalg.norm(pts, axis=1)[:, None] + rng.normal(size=d))
+
+
+def _assert_encloses(nsphere, pts):
+    scale = max(nsphere.sqradius, 1.0)
+    sqdists = np.sum((pts - nsphere.center) ** 2, axis=1)
+    assert sqdists.max() <= nsphere.sqradius + 1e-9 * scale
+
+
+def _assert_minimal(nsphere, pts):
+    """
+    The reference is the minimum whenever it encloses every point, since the minimum enclosing sphere is unique
+    """
+    reference = welzl_recursive(pts, len(pts) * 10)
+    scale = max(reference.sqradius, 1.0)
+    if np.sum((pts - reference.center) ** 2, axis=1).max() <= reference.sqradius + 1e-9 * scale:
+        assert nsphere.sqradius == pytest.approx(reference.sqradius, rel=1e-9, abs=1e-9 * scale)
+        assert np.allclose(nsphere.center, reference.center, atol=1e-6 * np.sqrt(scale))
+    else:
+        assert nsphere.sqradius <= reference.sqradius * (1 + 1e-9) or not np.isfinite(reference.sqradius)
+
+
+@pytest.mark.parametrize('solver', SOLVERS)
+@pytest.mark.parametrize('seed', range(20))
+def test_random_points_match_reference(solver, seed):
+    rng = np.random.default_rng(seed)
+    d = 2 + seed % 4
+    pts = rng.normal(size=(int(rng.integers(1, 150)), d))
+    nsphere = SOLVERS[solver](pts)
+    assert nsphere.converged
+    _assert_encloses(nsphere, pts)
+    _assert_minimal(nsphere, pts)
+
+
+@pytest.mark.parametrize('solver', SOLVERS)
+@pytest.mark.parametrize('d', [2, 3, 5])
+@pytest.mark.parametrize('seed', range(10))
+def test_cospherical_points(solver, d, seed):
+    rng = np.random.default_rng(seed)
+    radius = 10.0 ** (seed % 4)
+    pts = _cospherical(rng, int(rng.integers(3, 400)), d, radius)
+    nsphere = SOLVERS[solver](pts)
+    assert nsphere.converged
+    _assert_encloses(nsphere, pts)
+    # The sphere the points were drawn on encloses them all, so the minimum is no larger
+    assert nsphere.sqradius <= radius ** 2 * (1 + 1e-9)
+    _assert_minimal(nsphere, pts)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_gaertner_cocircular_points_regression(seed):
+    # Points on a circle made the solver stop at a radius that did not grow, with points still outside
+    rng = np.random.default_rng(1000 + seed)
+    pts = _cospherical(rng, int(rng.integers(500, 2000)), 2, 1000.0)
+    nsphere = GaertnerSolver(pts).solve(len(pts) * 10)
+    assert nsphere.converged
+    _assert_encloses(nsphere, pts)
+    assert nsphere.sqradius == pytest.approx(CircleSolver(pts).solve().sqradius, rel=1e-9)
+
+
+@pytest.mark.parametrize('solver', SOLVERS)
+@pytest.mark.parametrize('pts, sqradius', [
+    (np.tile([[-71.1, 42.3]], (50, 1)), 0.0),
+    (np.array([[0.0, 0.0], [300.0, 0.0], [300.0, 400.0], [0.0, 400.0]] * 25), 250.0 ** 2),
+    (np.column_stack([np.linspace(-10, 10, 101), 2 * np.linspace(-10, 10, 101) + 1]), 5 * 20.0 ** 2 / 4),
+    (np.vstack([np.eye(3), -np.eye(3)] * 10), 1.0),
+    (np.column_stack([np.linspace(-1, 1, 51), -2 * np.linspace(-1, 1, 51), 3 * np.linspace(-1, 1, 51)]), 14.0),
+], ids=['single_point', 'duplicates_2d', 'collinear_2d', 'duplicates_3d', 'collinear_3d'])
+def test_degenerate_points(solver, pts, sqradius):
+    nsphere = SOLVERS[solver](pts)
+    assert nsphere.converged
+    _assert_encloses(nsphere, pts)
+    assert nsphere.sqradius == pytest.approx(sqradius, rel=1e-9, abs=1e-9)
+
+
+@pytest.mark.parametrize('solver', SOLVERS)
+def test_no_points(solver):
+    nsphere = SOLVERS[solver](np.empty((0, 3)) if solver == 'gaertner' else np.empty((0, 2)))
+    assert nsphere.sqradius == 0.0